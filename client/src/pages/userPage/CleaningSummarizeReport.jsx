@@ -238,6 +238,7 @@ const DataQualityReport = () => {
       check_mandatory_columns: { title: '✓ Column Validation', icon: '📋', color: 'bg-blue-50' },
       customer_check_optional_columns: { title: '✓ Optional Fields Check', icon: '📊', color: 'bg-purple-50' },
       remove_duplicate_entries: { title: '✓ Duplicate Removal', icon: '🔄', color: 'bg-green-50' },
+      drop_unknown_columns: { title: '✓ Unused Columns Removed', icon: '🗂️', color: 'bg-gray-50' },
       standardize_dob: { title: '✓ Date of Birth Processing', icon: '📅', color: 'bg-indigo-50' },
       standardize_purchase_date: { title: '✓ Purchase Date Processing', icon: '📅', color: 'bg-indigo-50' },
       handle_missing_values_customer: { title: '✓ Missing Values Handled', icon: '🔧', color: 'bg-yellow-50' },
@@ -9,6 +9,7 @@ import { getGridFSBucket } from '../utils/gridfs.js';
 import { spawn } from 'child_process';
 import fs from 'fs';
 import os from 'os';
+import readline from 'readline';
 import XLSX from 'xlsx';
 
 const __filename = fileURLToPath(import.meta.url);
@@ -345,20 +346,42 @@ export const startDatasetCleaning = async (req, res) => {
     // Step B: Spawn Python cleaning process (emit stage updates according to stdout or custom mapping)
     const pythonScript = path.join(__dirname, '../python/cleaningPipeline/cleaning_main.py');
 
-    // Emit: start
-    io?.to(userId).emit("cleaning-progress", { stage: "analyze", message: "Analyzing and clean your dataset", progress: 85});
+    // Emit: start (the pipeline's own progress events take over from here)
+    io?.to(userId).emit("cleaning-progress", { stage: "analyze", message: "Analyzing and clean your dataset", progress: 10});
 
+    // fd 3 carries JSON-lines progress events (stage, rows, percent, eta_s); logs stay on stdout/stderr
     const py = spawn('python', [
       '-u',
       pythonScript,
       '--type', type.toLowerCase(),
       '--temp_file_path_with_filename', tempFilePath,
-      '--original_file_name', dataset.originalname
+      '--original_file_name', dataset.originalname,
+      '--progress-fd', '3'
     ], {
-      stdio: 'inherit',
+      stdio: ['inherit', 'inherit', 'inherit', 'pipe'],
       env: { ...process.env, PYTHONIOENCODING: 'utf-8' }
     });
 
+    // Map pipeline percent (0-100) onto the 10-85% band between download and upload
+    readline.createInterface({ input: py.stdio[3] }).on('line', (line) => {
+      let event;
+      try {
+        event = JSON.parse(line);
+      } catch {
+        return;
+      }
+      if ((event.event !== 'stage' && event.event !== 'progress') || event.percent == null) return;
+      const eta = event.eta_s != null ? ` (about ${Math.ceil(event.eta_s)}s left)` : '';
+      io?.to(userId).emit("cleaning-progress", {
+        stage: "analyze",
+        message: `Cleaning your dataset: ${event.stage}${eta}`,
+        progress: Math.round(10 + event.percent * 0.75),
+        rows: event.rows,
+        total: event.total,
+        eta: event.eta_s
+      });
+    });
+
     // wait for python to exit
     const exitCode = await new Promise((resolve, reject) => {
       py.on('close', (code) => {
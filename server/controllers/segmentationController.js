@@ -2,237 +2,10 @@ import datasetModel from '../models/datasetModel.js';
 import segmentationModel from '../models/segmentationModel.js';
 import { getGridFSBucket } from '../utils/gridfs.js';
 import csvParser from 'csv-parser';
-import { Readable } from 'stream';
 import segmentationPairs from '../utils/segmentationPairs.js';
 import path from 'path';
 import fs from 'fs';
 import { spawn } from 'child_process';
-import { stringify as csvStringify } from 'csv-stringify/sync';
-
-// Merge dataset
-const aggregateOrderData = (orderRows) => {
-  const customerOrders = {};
-
-  // Loop through each order row
-  orderRows.forEach(row => {
-    const customerId = row['customerid'];
-    
-    // If this is the first order for this customer, initialize their data
-    if (!customerOrders[customerId]) {
-      customerOrders[customerId] = {
-        orders: [],              // Store all raw orders
-        totalSpend: 0,           // Sum of all 'total spend'
-        totalOrders: 0,          // Count of orders
-        purchaseDates: [],       // Array of purchase dates for recency calculation
-        items: [],               // Array of items purchased
-        purchaseTimes: [],       // Array of purchase times (optional, may remain empty)
-      };
-    }
-
-    // Extract values from the row (all lowercase column names from cleaning)
-    const spend = parseFloat(row['total spend']) || 0;  // Convert to number, default to 0
-    const purchaseDate = row['purchase date'];  // Format: YYYY-MM-DD from cleaning
-    const item = row['purchase item'];
-    const purchaseTime = row['purchase time']; // Optional: derived by cleaning if time info exists
-
-    // Add this order to the customer's order history
-    customerOrders[customerId].orders.push(row);
-    
-    // Add to total spend (accumulate all orders)
-    customerOrders[customerId].totalSpend += spend;
-    
-    // Increment order count
-    customerOrders[customerId].totalOrders += 1;
-    
-    // Collect purchase dates (for recency calculation later)
-    if (purchaseDate) {
-      customerOrders[customerId].purchaseDates.push(new Date(purchaseDate));
-    }
-    
-    // Collect items purchased (to find favorite item later)
-    if (item) {
-      customerOrders[customerId].items.push(item);
-    }
-
-    // Collect purchase time if available (e.g., "14:35:00")
-    if (purchaseTime) {
-      customerOrders[customerId].purchaseTimes.push(purchaseTime);
-    }
-  });
-
-  // Now calculate derived metrics (RFM, averages, etc.) for each customer
-  const aggregatedData = {};
-  
-  Object.keys(customerOrders).forEach(customerId => {
-    const data = customerOrders[customerId];
-    
-    // Sort dates: most recent first (newest to oldest)
-    const dates = data.purchaseDates.sort((a, b) => b - a);
-
-    let recency = null;
-    let customerLifetimeMonths = 0;
-
-    if (dates.length > 0) {
-      const lastPurchaseDate = dates[0];
-      const firstPurchaseDate = dates[dates.length - 1];
-      const now = new Date();
-
-      recency = Math.floor((now - lastPurchaseDate) / (1000 * 60 * 60 * 24));
-
-      const diffTime = lastPurchaseDate - firstPurchaseDate;
-      customerLifetimeMonths = Math.max(
-        1,
-        Math.floor(diffTime / (1000 * 60 * 60 * 24 * 30))
-      );
-    }
-
-    // === CALCULATE AVERAGE ORDER VALUE ===
-    // Total spend divided by number of orders
-    const avgOrderValue = data.totalOrders > 0 ? data.totalSpend / data.totalOrders : 0;
-
-    // === FIND FAVORITE ITEM ===
-    // Count how many times each item was purchased
-    const itemCounts = {};
-    data.items.forEach(item => {
-      itemCounts[item] = (itemCounts[item] || 0) + 1;
-    });
-
-    // Find the item with highest count
-    const favoriteItem = Object.keys(itemCounts).length > 0
-      ? Object.keys(itemCounts).reduce((a, b) => 
-          itemCounts[a] > itemCounts[b] ? a : b
-        )
-      : null;
-
-    // === DERIVE PURCHASE TIME PREFERENCES (OPTIONAL) ===
-    // Compute favorite purchase hour (0-23) and day-part if times exist
-    let favoritePurchaseHour = null;
-    let favoriteDayPart = null;
-    if (data.purchaseTimes.length > 0) {
-      const hourCounts = {};
-      const dayPartCounts = { Night: 0, Morning: 0, Afternoon: 0, Evening: 0 };
-
-      const toDayPart = (h) => {
-        if (h >= 0 && h <= 5) return 'Night';
-        if (h >= 6 && h <= 11) return 'Morning';
-        if (h >= 12 && h <= 17) return 'Afternoon';
-        return 'Evening';
-      };
-
-      data.purchaseTimes.forEach(t => {
-        // Expect format HH:MM or HH:MM:SS
-        const parts = String(t).split(':');
-        const h = parseInt(parts[0], 10);
-        if (!isNaN(h) && h >= 0 && h <= 23) {
-          hourCounts[h] = (hourCounts[h] || 0) + 1;
-          const dp = toDayPart(h);
-          dayPartCounts[dp] = (dayPartCounts[dp] || 0) + 1;
-        }
-      });
-
-      // Determine most frequent hour and day-part
-      const hourKeys = Object.keys(hourCounts);
-      if (hourKeys.length > 0) {
-        favoritePurchaseHour = parseInt(hourKeys.reduce((a, b) => (hourCounts[a] > hourCounts[b] ? a : b)) ,10);
-      }
-      favoriteDayPart = Object.keys(dayPartCounts).reduce((a, b) => (dayPartCounts[a] > dayPartCounts[b] ? a : b));
-    }
-
-    // Store all calculated metrics for this customer
-    aggregatedData[customerId] = {
-      customerid: customerId,  // Keep lowercase to match cleaned data
-      
-      // === BEHAVIORAL METRICS ===
-      totalOrders: data.totalOrders,
-      avgOrderValue: parseFloat(avgOrderValue.toFixed(2)),
-      customerLifetimeMonths: customerLifetimeMonths || 0, // Months active between first and last purchase.
-      favoriteItem: favoriteItem,
-      favoritePurchaseHour: favoritePurchaseHour,   // Optional, integer 0-23
-      favoriteDayPart: favoriteDayPart,             // Optional, one of Night/Morning/Afternoon/Evening
-      
-      // === RFM COMPONENTS (for RFM segmentation) ===
-      recency: recency,      // R: Days since last purchase (lower is better)
-      // F: Orders per month (normalized by customer lifetime)
-      frequency: data.customerLifetimeMonths > 0 
-        ? parseFloat((data.totalOrders / data.customerLifetimeMonths).toFixed(2)) 
-        : data.totalOrders,
-      monetary: parseFloat(data.totalSpend.toFixed(2)),  // M: Total spend (higher is better)
-    };
-  });
-
-  return aggregatedData;
-};
-
-const mergeCustomerAndOrderData = (customerRows, aggregatedOrderData) => {
-  const mergedData = [];
-
-  // === CHECK WHICH OPTIONAL COLUMNS EXIST IN CLEANED CUSTOMER DATASET ===
-  // Look at the first row to see which columns are present
-  const sampleCustomer = customerRows[0] || {};
-  // Support both underscore and hyphen variants from cleaning outputs
-  const hasAgeColumn = 'age' in sampleCustomer;
-  const hasAgeGroupColumn = ('age group' in sampleCustomer);
-  const hasGenderColumn = 'gender' in sampleCustomer;
-
-  console.log('[LOG - MERGE] Column availability check:');
-  console.log(`  - age: ${hasAgeColumn}`);
-  console.log(`  - age group: ${hasAgeGroupColumn}`);
-  console.log(`  - gender: ${hasGenderColumn}`);
-
-  customerRows.forEach(customer => {
-    // Get customer ID (lowercase from cleaning)
-    const customerId = customer['customerid'];
-    
-    // Find this customer's behavioral data (or empty object if no orders)
-    const orderData = aggregatedOrderData[customerId] || {};
-
-    // === CREATE MERGED CUSTOMER PROFILE ===
-    // Start with mandatory fields (always present)
-    const mergedCustomer = {
-      // === IDENTIFICATION ===
-      CustomerId: customerId,
-      
-      // === GEOGRAPHIC DATA (always present) ===
-      City: customer['city'] || null,
-      State: customer['state'] || null,
-      
-      // === BEHAVIORAL DATA FROM ORDERS ===
-      TotalOrders: orderData.totalOrders || 0,
-      AvgOrderValue: orderData.avgOrderValue || 0,
-      CustomerLifetimeMonths: orderData.customerLifetimeMonths || 0,
-      FavoriteItem: orderData.favoriteItem || null,
-      FavoritePurchaseHour: orderData.favoritePurchaseHour ?? null,
-      FavoriteDayPart: orderData.favoriteDayPart ?? null,
-      
-      // === RFM SCORES (for RFM segmentation) ===
-      Recency: orderData.recency || null,
-      Frequency: orderData.frequency || 0,
-      Monetary: orderData.monetary || 0,
-    };
-
-    if (hasAgeGroupColumn) {
-      // Prefer underscore if present, else fallback to hyphen variant
-      const ageGroupValue = customer['age group'];
-      if (ageGroupValue && ageGroupValue !== 'Unknown') {
-        mergedCustomer.AgeGroup = ageGroupValue;
-      } else {
-        mergedCustomer.AgeGroup = null; // mark as truly missing
-      }
-    }
-
-    if (hasGenderColumn) {
-      const genderValue = customer['gender'];
-      if (genderValue && genderValue !== 'Unknown') {
-        mergedCustomer.Gender = genderValue;
-      } else {
-        mergedCustomer.Gender = null; // mark as missing for accurate summary
-      }
-    }
-    mergedData.push(mergedCustomer);
-  });
-
-  return mergedData;
-};
 
 export const prepareSegmentationData = async (req, res) => {
   console.log('>>>>>>>>>>>>>>>>>>>>>>>>>> ENTRY: prepareSegmentationData function >>>>>>>>>>>>>>>>>>>>>>>>');
@@ -327,46 +100,30 @@ export const prepareSegmentationData = async (req, res) => {
       }
     }
 
-    // Read customer data from GridFS
-    const bucket = getGridFSBucket();
-    const customerRows = await new Promise((resolve, reject) => {
-      const rows = [];
-      const downloadStream = bucket.openDownloadStream(customerDataset.fileId);
-      
-      downloadStream
-        .pipe(csvParser())
-        .on('data', (row) => rows.push(row))
-        .on('end', () => resolve(rows))
-        .on('error', reject);
-    });
-
-    // Read order data from GridFS
-    const orderRows = await new Promise((resolve, reject) => {
-      const rows = [];
-      const downloadStream = bucket.openDownloadStream(orderDataset.fileId);
-      
-      downloadStream
-        .pipe(csvParser())
-        .on('data', (row) => rows.push(row))
-        .on('end', () => resolve(rows))
-        .on('error', reject);
-    });
-
-    console.log(`[LOG - STEP 0: STAGE PREPARE MERGING] - Loaded ${customerRows.length} customers and ${orderRows.length} orders`);
+    // === STEP 1 + 2: AGGREGATE ORDER DATA AND MERGE WITH CUSTOMERS (Python, customer_profiles.py) ===
+    // Both cleaned files go to temp and are grouped with pandas, so no order rows are held in the Node heap
+    const tempDir = getServerTempDir();
+    const stamp = `${customerDatasetId}_${orderDatasetId}_${Date.now()}`;
+    const customerPath = path.join(tempDir, `profile_customers_${stamp}${path.extname(customerDataset.originalname) || '.csv'}`);
+    const orderPath = path.join(tempDir, `profile_orders_${stamp}${path.extname(orderDataset.originalname) || '.csv'}`);
+    const mergedPath = path.join(tempDir, `merged_${stamp}.csv`);
+    const removeTemp = (files) => files.forEach((f) => { try { fs.unlinkSync(f); } catch (_) {} });
 
-    // === STEP 1: AGGREGATE ORDER DATA ===
-    // Group all orders by customerid and calculate behavioral metrics
-    console.log('>>>>>>>>>>>>>>>>>>>>>>>>>> ENTRY: aggregateOrderData function >>>>>>>>>>>>>>>>>>>>>>>>>>');
-    const aggregatedOrderData = aggregateOrderData(orderRows);
-    console.log(`[LOG - STEP 1: AGGREGATE ORDER DATA] - Aggregated order data for ${Object.keys(aggregatedOrderData).length} customers`);
-    console.log('>>>>>>>>>>>>>>>>>>>>>>>>>> EXIT: aggregateOrderData function >>>>>>>>>>>>>>>>>>>>>>>>>>');
-
-    // === STEP 2: MERGE CUSTOMER AND ORDER DATA ===
-    // Combine demographics (from customer CSV) with behavior (from aggregated orders)
-    console.log('>>>>>>>>>>>>>>>>>>>>>>>>>> ENTRY: mergeCustomerAndOrderData function >>>>>>>>>>>>>>>>>>>>>>>>>>');
-    const mergedData = mergeCustomerAndOrderData(customerRows, aggregatedOrderData);
-    console.log(`[LOG - STEP 2: MERGE CUSTOMER AND ORDER DATA] - Merged data: ${mergedData.length} customer profiles created`);
-    console.log('>>>>>>>>>>>>>>>>>>>>>>>>>> EXIT: mergeCustomerAndOrderData function >>>>>>>>>>>>>>>>>>>>>>>>>>');
+    let profileSummary;
+    try {
+      await streamFileToTemp(customerDataset.fileId, customerPath);
+      await streamFileToTemp(orderDataset.fileId, orderPath);
+      console.log('>>>>>>>>>>>>>>>>>>>>>>>>>> ENTRY: runProfileAggregationPython function >>>>>>>>>>>>>>>>>>>>>>>>>>');
+      profileSummary = await runProfileAggregationPython(customerPath, orderPath, mergedPath);
+      console.log(`[LOG - STEP 1: AGGREGATE ORDER DATA] - Aggregated order data for ${profileSummary.customersWithOrders} customers`);
+      console.log(`[LOG - STEP 2: MERGE CUSTOMER AND ORDER DATA] - Merged data: ${profileSummary.totalCustomers} customer profiles created`);
+      console.log('>>>>>>>>>>>>>>>>>>>>>>>>>> EXIT: runProfileAggregationPython function >>>>>>>>>>>>>>>>>>>>>>>>>>');
+    } catch (mergeErr) {
+      removeTemp([mergedPath]);
+      throw mergeErr;
+    } finally {
+      removeTemp([customerPath, orderPath]);
+    }
 
     // === CREATE OR REUSE SEGMENTATION RECORD WITHOUT STORING JSON ===
     let segRecord = existingDoc;
@@ -391,37 +148,12 @@ export const prepareSegmentationData = async (req, res) => {
       }
     }
 
-    // Convert merged data to CSV and upload to GridFS for durable storage/download
-    const toCsv = (rows) => {
-      if (!rows || rows.length === 0) return '';
-      // Build a stable column order: first row's keys in order, then any additional keys encountered
-      const first = rows[0] || {};
-      const firstKeys = Object.keys(first);
-      const seen = new Set(firstKeys);
-      const extras = [];
-      for (const r of rows) {
-        for (const k of Object.keys(r)) {
-          if (!seen.has(k)) { seen.add(k); extras.push(k); }
-        }
-      }
-      const columns = [...firstKeys, ...extras];
-
-      return csvStringify(rows, {
-        header: true,
-        columns,
-        bom: false,
-        record_delimiter: '\n',
-        cast: { null: () => '' }
-      });
-    };
-
+    // Upload the merged CSV written by Python to GridFS for durable storage/download
     try {
       const bucket = getGridFSBucket();
-      const csvString = toCsv(mergedData); 
       const uploadStream = bucket.openUploadStream(`segmentation_merged_${new Date().toISOString()}.csv`);
-      const readable = Readable.from(csvString);
       await new Promise((resolve, reject) => {
-        readable.pipe(uploadStream)
+        fs.createReadStream(mergedPath).pipe(uploadStream)
           .on('finish', resolve)
           .on('error', reject);
       });
@@ -429,22 +161,21 @@ export const prepareSegmentationData = async (req, res) => {
       segRecord.mergedFileId = uploadStream.id;
     } catch (csvErr) {
       console.warn('Failed to store merged CSV in GridFS:', csvErr?.message);
+    } finally {
+      removeTemp([mergedPath]);
     }
     // Build recommended pairs based on available features in merged data
-    const featureSet = new Set();
-    for (const row of mergedData) {
-      Object.keys(row || {}).forEach(k => featureSet.add(k));
-    }
+    const featureSet = new Set(profileSummary.columns);
     const availablePairs = segmentationPairs.filter(p => p.features.every(({ key }) => featureSet.has(String(key))));
     // console.log('[DEBUG] Available segmentation pairs:', availablePairs);
     const summaryPayload = {
-      totalCustomers: mergedData.length,
-      totalOrders: orderRows.length,
-      customersWithOrders: Object.keys(aggregatedOrderData).length,
-      customersWithoutOrders: mergedData.length - Object.keys(aggregatedOrderData).length,
-      // Only count as having data if key exists and value is not null
-      hasAgeData: mergedData.some(c => ('age' in c) && c.age !== null),
-      hasGenderData: mergedData.some(c => ('gender' in c) && c.gender !== null),
+      totalCustomers: profileSummary.totalCustomers,
+      totalOrders: profileSummary.totalOrders,
+      customersWithOrders: profileSummary.customersWithOrders,
+      customersWithoutOrders: profileSummary.customersWithoutOrders,
+      // Only count as having data if the column exists and at least one value is not null
+      hasAgeData: profileSummary.hasAgeData,
+      hasGenderData: profileSummary.hasGenderData,
     };
     console.log('[DEBUG] Summary payload:', summaryPayload);
     segRecord.summary = summaryPayload;
@@ -581,17 +312,17 @@ export const getMergedColumns = async (req, res) => {
 //===============================================================================================
 //WIP - Run segmentation, Do checking on the after segmentsation done, and then check does it overwrite the dataset into DB
 // Run segmentation flow
-function streamMergedToTemp(mergedFileId, tempPath) {
+function streamFileToTemp(fileId, tempPath) {
   return new Promise(async (resolve, reject) => {
     try {
       const bucket = getGridFSBucket(); // use initialized 'datasets' bucket
       // Pre-check file existence in bucket
       const filesColl = bucket.s.db.collection(`${bucket.s.options.bucketName}.files`);
-      const exists = await filesColl.findOne({ _id: mergedFileId });
+      const exists = await filesColl.findOne({ _id: fileId });
       if (!exists) {
-        return reject(new Error(`Merged file not found in bucket '${bucket.s.options.bucketName}' for id ${mergedFileId}`));
+        return reject(new Error(`File not found in bucket '${bucket.s.options.bucketName}' for id ${fileId}`));
       }
-      const readStream = bucket.openDownloadStream(mergedFileId);
+      const readStream = bucket.openDownloadStream(fileId);
       const writeStream = fs.createWriteStream(tempPath);
       readStream.pipe(writeStream);
       writeStream.on('finish', () => resolve());
@@ -603,22 +334,77 @@ function streamMergedToTemp(mergedFileId, tempPath) {
   });
 }
 
-function runSegmentationPython(csvPath, features, debugFlag) {
+// server/temp (handle if server started inside /server)
+function getServerTempDir() {
+  const cwd = process.cwd();
+  const isServerCwd = path.basename(cwd) === 'server';
+  const serverRoot = isServerCwd ? cwd : path.join(cwd, 'server');
+  const tempDir = path.join(serverRoot, 'temp');
+  if (!fs.existsSync(tempDir)) 
+    fs.mkdirSync(tempDir, { recursive: true });
+  return tempDir;
+}
+
+// Venv interpreter + a script in python/segmentationPipeline; throws if either is missing
+function resolveSegmentationPython(scriptName) {
+  // Resolve project root (handle if server started inside /server)
+  const cwd = process.cwd();
+  const candidateRoots = [cwd, path.dirname(cwd)];
+  let projectRoot = candidateRoots.find(r => fs.existsSync(path.join(r, 'venv_fyp_new', 'Scripts', 'python.exe')));
+  if (!projectRoot) projectRoot = cwd; // fallback
+
+  const pyExe = path.join(projectRoot, 'venv_fyp_new', 'Scripts', 'python.exe');
+  const script = path.join(projectRoot, 'server', 'python', 'segmentationPipeline', scriptName);
+  if (!fs.existsSync(script)) {
+    throw new Error(`${scriptName} not found in expected location.`);
+  }
+
+  if (!fs.existsSync(pyExe)) {
+    throw new Error(`Python interpreter not found at ${pyExe}. Activate venv or adjust path.`);
+  }
+  return { pyExe, script };
+}
+
+// Build the merged customer profile CSV (RFM + behaviour) from the cleaned datasets; resolves with its summary JSON
+function runProfileAggregationPython(customerPath, orderPath, mergedPath) {
   return new Promise((resolve, reject) => {
-    // Resolve project root (handle if server started inside /server)
-    const cwd = process.cwd();
-    const candidateRoots = [cwd, path.dirname(cwd)];
-    let projectRoot = candidateRoots.find(r => fs.existsSync(path.join(r, 'venv_fyp_new', 'Scripts', 'python.exe')));
-    if (!projectRoot) projectRoot = cwd; // fallback
-
-    const pyExe = path.join(projectRoot, 'venv_fyp_new', 'Scripts', 'python.exe');
-    const script = path.join(projectRoot, 'server', 'python', 'segmentationPipeline', 'segmentation.py');
-    if (!fs.existsSync(script)) {
-      return reject(new Error('Segmentation script not found in expected location.'));
+    let pyExe, script;
+    try {
+      ({ pyExe, script } = resolveSegmentationPython('customer_profiles.py'));
+    } catch (e) {
+      return reject(e);
     }
+    const summaryPath = `${mergedPath}.summary.json`;
+    const args = ['--customers', customerPath, '--orders', orderPath, '--out', mergedPath, '--summary-out', summaryPath, '--verbose'];
+    const proc = spawn(pyExe, [script, ...args], { shell: false, env: { ...process.env, PYTHONUNBUFFERED: '1' } });
+    let err = '';
+    proc.stderr.on('data', d => {
+      const chunk = d.toString();
+      err += chunk;
+      console.log('[PREPARE MERGING][PY-STDERR]', chunk.trim().slice(0, 500));
+    });
+    proc.on('error', reject);
+    proc.on('close', code => {
+      let summary = null;
+      try {
+        summary = JSON.parse(fs.readFileSync(summaryPath, 'utf-8'));
+      } catch (_) {}
+      try { fs.unlinkSync(summaryPath); } catch (_) {}
+      if (code !== 0 || !summary || summary.error) {
+        return reject(new Error(`Customer profile aggregation failed (exit ${code}): ${summary?.error || err.slice(0, 300)}`));
+      }
+      resolve(summary);
+    });
+  });
+}
 
-    if (!fs.existsSync(pyExe)) {
-      return reject(new Error(`Python interpreter not found at ${pyExe}. Activate venv or adjust path.`));
+function runSegmentationPython(csvPath, features, debugFlag) {
+  return new Promise((resolve, reject) => {
+    let pyExe, script;
+    try {
+      ({ pyExe, script } = resolveSegmentationPython('segmentation.py'));
+    } catch (e) {
+      return reject(e);
     }
 
     // Prepare temp JSON output file
@@ -701,16 +487,11 @@ export const runSegmentationFlow = async (req, res) => {
 
     // Cache disabled: always compute and overwrite single stored result
 
-    const cwd = process.cwd();
-    const isServerCwd = path.basename(cwd) === 'server';
-    const serverRoot = isServerCwd ? cwd : path.join(cwd, 'server');
-    const tempDir = path.join(serverRoot, 'temp');
-    if (!fs.existsSync(tempDir)) 
-      fs.mkdirSync(tempDir, { recursive: true });
+    const tempDir = getServerTempDir();
     const tempCsv = path.join(tempDir, `merged_${segmentationId}.csv`);
 
     try {
-      await streamMergedToTemp(segRecord.mergedFileId, tempCsv);
+      await streamFileToTemp(segRecord.mergedFileId, tempCsv);
     } catch (streamErr) {
       console.error('[SEGMENTATION RUN] Failed streaming merged file:', streamErr.message);
       return res.status(404).json({ message: 'Merged CSV file missing', error: streamErr.message, segmentationId });
@@ -0,0 +1,272 @@
+"""
+Benchmarks for the cleaning pipeline on synthetic data (no network access needed).
+
+    python benchmark.py stage5 --rows 10000 100000 1000000
+    python benchmark.py dedup --rows 20000 --dup-rates 0.01 0.1 0.5
+    python benchmark.py states --distinct 1000 10000
+    python benchmark.py categorical --rows 200000 1000000
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from geocode_cache import GeocodeCache
+from geocoding import GeocodingClient
+
+class OfflineGeocoder(GeocodingClient):
+    """Answers 'not found' for every city without touching the network"""
+
+    def resolve_cities(self, cities, valid_states, on_resolved=None):
+        return {city: (None, True) for city in cities}
+
+def synthetic_customers(rows, unknown_state_ratio=0.3, unique_cities=None, seed=0):
+    """Customer frame as it looks after STAGE 4 (city/state standardized, 'Unknown' for missing)"""
+    rng = np.random.default_rng(seed)
+    unique_cities = unique_cities or max(50, rows // 100)
+    known = np.array(["Muar", "Kluang", "Ipoh", "Kuching", "Shah Alam", "Kota Bharu"])
+    known_states = np.array(["Johor", "Johor", "Perak", "Sarawak", "Selangor", "Kelantan"])
+    pick = rng.integers(0, len(known), rows)
+    city = known[pick].astype(object)
+    state = known_states[pick].astype(object)
+    # Cities nobody can resolve offline -> exercise the fallback path
+    synthetic = rng.random(rows) < 0.5
+    city[synthetic] = np.char.add("Taman ", rng.integers(0, unique_cities, synthetic.sum()).astype(str))
+    state[rng.random(rows) < unknown_state_ratio] = "Unknown"
+    return pd.DataFrame({
+        "customerid": np.char.add("C", np.arange(rows).astype(str)),
+        "city": city,
+        "state": state,
+    })
+
+def synthetic_raw_customers(rows, dup_rate, seed=0):
+    """Raw customer rows where `dup_rate` of the rows repeat an earlier CustomerID with conflicting fields"""
+    rng = np.random.default_rng(seed)
+    n_dup = int(rows * dup_rate)
+    unique_ids = np.char.add("C", np.arange(rows - n_dup).astype(str)).astype(object)
+    ids = np.concatenate([unique_ids, rng.choice(unique_ids, n_dup)])
+    def column(choices, null_ratio):
+        values = np.array(choices, dtype=object)[rng.integers(0, len(choices), rows)]
+        values[rng.random(rows) < null_ratio] = None
+        return values
+    return pd.DataFrame({
+        "customerid": ids,
+        "gender": column(["Male", "Female", "M", "F"], 0.05),
+        "city": column(["Muar", "Ipoh", "Kuching", "Klang", "Kl"], 0.1),
+        "state": column(["Johor", "Perak", "Sarawak", "Selangor"], 0.1),
+        "date of birth": column(["12/05/2000", "1999-01-01", "Oct 15 1998"], 0.2),
+    }).sample(frac=1, random_state=seed).reset_index(drop=True)
+
+def synthetic_state_spellings(distinct, seed=0):
+    """Distinct free-text state values: canonical names/aliases with typos, case noise, punctuation and junk"""
+    from common_utils import get_country_subdivisions
+    rng = np.random.default_rng(seed)
+    bases = list(get_country_subdivisions('MY')) + ["Kl", "Penang", "Johor Bahru", "N. Sembilan", "Singapore", "Others"]
+    letters = "abcdefghijklmnopqrstuvwxyz .-"
+    values = set()
+    while len(values) < distinct:
+        chars = list(bases[rng.integers(0, len(bases))])
+        for _ in range(rng.integers(0, 4)):
+            pos = rng.integers(0, len(chars) + 1)
+            edit = rng.integers(0, 3)
+            if edit == 0:
+                chars.insert(pos, letters[rng.integers(0, len(letters))])
+            elif chars and pos < len(chars):
+                if edit == 1:
+                    del chars[pos]
+                else:
+                    chars[pos] = letters[rng.integers(0, len(letters))]
+        value = "".join(chars).title().strip()
+        if value and value != "Unknown":
+            values.add(value)
+    return sorted(values)
+
+def legacy_state_map(values):
+    """The previous per-value process.extractOne loop, used as the reference result"""
+    from fuzzywuzzy import process, fuzz
+    from common_utils import get_country_subdivisions
+    from location_reference import STATE_INPUT_ALIASES
+    malaysia_states = list(get_country_subdivisions('MY'))
+    state_map = {}
+    for s in values:
+        if s in STATE_INPUT_ALIASES:
+            state_map[s] = STATE_INPUT_ALIASES[s]
+        else:
+            match, score = process.extractOne(s, malaysia_states, scorer=fuzz.token_sort_ratio)
+            state_map[s] = match if score >= 80 else None
+    return state_map
+
+def synthetic_raw_orders(rows, seed=0):
+    """Raw order rows with a few hundred products and customers repeating across orders"""
+    rng = np.random.default_rng(seed)
+    items = np.char.add("product ", rng.integers(0, 500, rows).astype(str)).astype(object)
+    price = rng.integers(100, 50000, rows) / 100
+    quantity = rng.integers(1, 5, rows)
+    dates = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 365 * 24 * 60, rows), unit="min")
+    return pd.DataFrame({
+        "OrderID": np.char.add("O", np.arange(rows).astype(str)),
+        "CustomerID": np.char.add("C", rng.integers(0, max(rows // 5, 1), rows).astype(str)),
+        "Purchase Item": items,
+        "Purchase Date": dates.strftime("%d/%m/%Y %H:%M"),
+        "Item Price": price,
+        "Purchase Quantity": quantity,
+        "Total Spend": (price * quantity).round(2),
+    })
+
+def synthetic_purchase_dates(rows, seed=0):
+    """
+    Purchase date text in the shapes shop / payment exports use, including UTC 'Z' and +08:00 / -0500 offsets.
+    Returns (text values, expected naive timestamps: the wall time as written, midnight for date-only values)
+    """
+    rng = np.random.default_rng(seed)
+    stamps = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 365 * 24 * 60, rows), unit="min")
+    shapes = [
+        (stamps.strftime("%d/%m/%Y %H:%M"), stamps),
+        (stamps.strftime("%Y-%m-%dT%H:%M:%SZ"), stamps),
+        (stamps.strftime("%Y-%m-%d %H:%M:%S+08:00"), stamps),
+        (stamps.strftime("%Y-%m-%d %H:%M:%S-0500"), stamps),
+        (stamps.strftime("%Y-%m-%d"), stamps.normalize()),
+    ]
+    pick = rng.integers(0, len(shapes), rows)
+    values = np.choose(pick, [np.asarray(text, dtype=object) for text, _ in shapes])
+    expected = np.choose(pick, [np.asarray(truth) for _, truth in shapes])
+    return pd.Series(values), pd.Series(expected)
+
+def legacy_deduplicate(df):
+    """The previous groupby().agg(resolve_conflict) implementation, used as the reference result"""
+    def resolve_conflict(series):
+        vals = series.dropna().unique()
+        if len(vals) == 0:
+            return pd.NA
+        elif len(vals) == 1:
+            return vals[0]
+        else:
+            return series.mode().iloc[0]
+    return df.groupby('customerid', as_index=False).agg(resolve_conflict)
+
+def same_values(a, b):
+    """Frame equality that treats NaN / None / pd.NA alike (the legacy path mixes them)"""
+    if list(a.columns) != list(b.columns) or len(a) != len(b):
+        return False
+    normalize = lambda df: df.astype(object).where(df.notna(), None).values.tolist()
+    return normalize(a) == normalize(b)
+
+def timed(fn, *args, **kwargs):
+    """Run fn with its stdout logs suppressed; return (result, seconds)"""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def bench_stage5(sizes):
+    from customer_cleaning import handle_missing_values_customer
+    print(f"{'rows':>10} {'unresolved cities':>18} {'seconds':>9} {'rows/s':>12}")
+    for rows in sizes:
+        df = synthetic_customers(rows)
+        unresolved = df.loc[(df["state"] == "Unknown") & df["city"].str.startswith("Taman "), "city"].nunique()
+        _, seconds = timed(handle_missing_values_customer, df, geo_cache=GeocodeCache(":memory:"), geocoder=OfflineGeocoder())
+        print(f"{rows:>10} {unresolved:>18} {seconds:>9.2f} {rows / seconds:>12,.0f}")
+
+def bench_dedup(rows, dup_rates):
+    from customer_cleaning import deduplicate_customers
+    print(f"{'dup rate':>9} {'rows':>10} {'legacy s':>9} {'new s':>8} {'speedup':>8} {'identical':>10}")
+    for rate in dup_rates:
+        df = synthetic_raw_customers(rows, rate)
+        expected, legacy_seconds = timed(legacy_deduplicate, df.copy())
+        (result, _), seconds = timed(deduplicate_customers, df.copy())
+        print(f"{rate:>9.0%} {rows:>10} {legacy_seconds:>9.2f} {seconds:>8.2f} "
+              f"{legacy_seconds / seconds:>7.1f}x {str(same_values(expected, result)):>10}")
+
+def bench_states(sizes):
+    from location_reference import StateMatcher, STATE_INPUT_ALIASES, STATE_MEMO_NAMESPACE
+    from common_utils import get_country_subdivisions
+    print(f"{'distinct':>9} {'legacy s':>9} {'index s':>8} {'memo s':>7} {'speedup':>8} {'scored/value':>13} {'identical':>10}")
+    for distinct in sizes:
+        values = synthetic_state_spellings(distinct)
+        expected, legacy_seconds = timed(legacy_state_map, values)
+        matcher = StateMatcher(get_country_subdivisions('MY'), aliases=STATE_INPUT_ALIASES)
+        memo = GeocodeCache(":memory:", namespace=STATE_MEMO_NAMESPACE)
+        result, seconds = timed(matcher.match_many, values, memo=memo)
+        scored = matcher.stats["scored"] / max(matcher.stats["fuzzy"], 1)
+        # Second run (e.g. the next upload of the same tenant) is answered from the memo
+        memo_result, memo_seconds = timed(matcher.match_many, values, memo=memo)
+        print(f"{distinct:>9} {legacy_seconds:>9.2f} {seconds:>8.2f} {memo_seconds:>7.2f} "
+              f"{legacy_seconds / seconds:>7.1f}x {scored:>13.1f} {str(expected == result == memo_result):>10}")
+
+def bench_dates(sizes):
+    from common_utils import parse_datetimes
+    print(f"{'rows':>10} {'seconds':>8} {'rows/s':>12} {'formats':>8} {'identical':>10}")
+    for rows in sizes:
+        values, expected = synthetic_purchase_dates(rows)
+        (parsed, stats), seconds = timed(parse_datetimes, values)
+        print(f"{rows:>10} {seconds:>8.2f} {rows / seconds:>12,.0f} {len(stats['formats']):>8} "
+              f"{str(parsed.equals(expected)):>10}")
+
+def run_cleaning_process(dataset_type, path, categorical):
+    """cleaning_main.py in a fresh process (so peak RSS is per run); returns (report, cleaned file bytes)"""
+    args = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "cleaning_main.py"),
+            "--type", dataset_type, "--temp_file_path_with_filename", path,
+            "--original_file_name", os.path.basename(path), "--log-level", "error"]
+    if categorical:
+        args.append("--categorical")
+    subprocess.run(args, check=True, stdout=subprocess.DEVNULL)
+    base = os.path.splitext(path)[0]
+    with open(f"{base}_report.json", encoding="utf-8") as f:
+        report = json.load(f)
+    with open(f"{base}_cleaned.csv", "rb") as f:
+        return report, f.read()
+
+def bench_categorical(sizes):
+    print(f"{'dataset':>9} {'rows':>10} {'peak MB':>8} {'cat MB':>7} {'saved':>6} {'wall s':>7} {'cat s':>6} {'identical':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in sizes:
+            raw = {
+                "customer": synthetic_raw_customers(rows, dup_rate=0.05).rename(columns=str.title),
+                "order": synthetic_raw_orders(rows),
+            }
+            for dataset_type, df in raw.items():
+                path = os.path.join(tmp, f"{dataset_type}_{rows}.csv")
+                df.to_csv(path, index=False)
+                (report, expected), (cat_report, result) = (run_cleaning_process(dataset_type, path, cat) for cat in (False, True))
+                peak, cat_peak = report["performance"]["peak_rss_mb"], cat_report["performance"]["peak_rss_mb"]
+                print(f"{dataset_type:>9} {rows:>10} {peak:>8.0f} {cat_peak:>7.0f} {1 - cat_peak / peak:>6.0%} "
+                      f"{report['performance']['total_wall_s']:>7.2f} {cat_report['performance']['total_wall_s']:>6.2f} "
+                      f"{str(expected == result):>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Cleaning pipeline benchmarks on synthetic data")
+    sub = parser.add_subparsers(dest="bench", required=True)
+    p5 = sub.add_parser("stage5", help="Customer STAGE 5 missing city/state handling")
+    p5.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    pdd = sub.add_parser("dedup", help="Customer STAGE 3 duplicate CustomerID resolution")
+    pdd.add_argument("--rows", type=int, default=20000)
+    pdd.add_argument("--dup-rates", type=float, nargs="+", default=[0.01, 0.1, 0.5])
+    pst = sub.add_parser("states", help="Customer STAGE 4 free-text state matching")
+    pst.add_argument("--distinct", type=int, nargs="+", default=[1000, 10000])
+    pdt = sub.add_parser("dates", help="Order STAGE 3 purchase date parsing (mixed formats and UTC offsets)")
+    pdt.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    pcat = sub.add_parser("categorical", help="Peak RSS of whole cleaning runs with and without --categorical")
+    pcat.add_argument("--rows", type=int, nargs="+", default=[200000, 1000000])
+    args = parser.parse_args()
+
+    if args.bench == "stage5":
+        bench_stage5(args.rows)
+    elif args.bench == "dedup":
+        bench_dedup(args.rows, args.dup_rates)
+    elif args.bench == "states":
+        bench_states(args.distinct)
+    elif args.bench == "dates":
+        bench_dates(args.rows)
+    elif args.bench == "categorical":
+        bench_categorical(args.rows)
+
+if __name__ == "__main__":
+    main()
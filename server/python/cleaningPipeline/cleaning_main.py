@@ -3,48 +3,129 @@ import argparse
 import sys
 import os
 import json
-from customer_cleaning import clean_customer_dataset
-from order_cleaning import clean_order_dataset
-    
-def main():
+from common_utils import load_dataset, dataset_format, set_log_level, OUTPUT_FORMATS, FORMAT_EXTENSIONS, CSV_ENGINES, LOG_LEVELS, LOG_LEVEL
+from customer_cleaning import clean_customer_dataset, CUSTOMER_SCHEMA, CUSTOMER_STAGE_WEIGHTS
+from order_cleaning import clean_order_dataset, clean_order_dataset_streaming, DEFAULT_CHUNKSIZE, ORDER_SCHEMA, ORDER_STAGE_WEIGHTS, ORDER_STREAM_STAGE_WEIGHTS
+from stage_profiler import StageProfiler
+from progress_events import ProgressReporter, set_progress, DEFAULT_MIN_INTERVAL
+
+# Share of the overall percentage taken by reading the upload (non-streaming runs)
+LOAD_STAGE_WEIGHT = 8
+
+def build_arg_parser():
     parser = argparse.ArgumentParser(description="Data cleaning pipeline for customer and order datasets")
     parser.add_argument("--type", choices=["customer", "order"], required=True, help="Dataset type (customer or order)")
-    parser.add_argument("--temp_file_path_with_filename", required=True, help="Path to the input CSV file")
+    parser.add_argument("--temp_file_path_with_filename", required=True, help="Path to the input file (.csv, or .parquet/.pq)")
     parser.add_argument("--original_file_name", required=True, help="Original dataset name")
-    args = parser.parse_args()
+    parser.add_argument("--stream", action="store_true", help="Order datasets: clean in fixed-size chunks instead of loading the whole file")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="Rows per chunk in --stream mode")
+    parser.add_argument("--output-format", choices=OUTPUT_FORMATS, default="csv", help="File format of the cleaned dataset (csv or parquet)")
+    parser.add_argument("--keep-unknown-columns", action="store_true", help="Keep columns the pipeline does not use in the cleaned dataset (as text)")
+    parser.add_argument("--csv-engine", choices=CSV_ENGINES, default="c", help="CSV parser for the upload (pyarrow needs the pyarrow package)")
+    parser.add_argument("--log-level", choices=list(LOG_LEVELS), default=LOG_LEVEL, help="debug prints every [LOG]/[TRACE] line; info only stage banners")
+    parser.add_argument("--categorical", action="store_true", help="Keep low-cardinality text columns (city, state, gender, purchase item) as category")
+    parser.add_argument("--trace-memory", action="store_true", help="Add tracemalloc peaks per stage to report['performance'] (slower)")
+    parser.add_argument("--progress-fd", type=int, default=None, help="Write JSON-lines progress events to this inherited file descriptor")
+    parser.add_argument("--progress-file", default=None, help="Append JSON-lines progress events to this file")
+    parser.add_argument("--progress-interval", type=float, default=DEFAULT_MIN_INTERVAL, help="Minimum seconds between in-stage progress events")
+    return parser
 
+def run_cleaning_job(dataset_type, temp_file_path_with_filename, original_file_name, stream=False, chunksize=DEFAULT_CHUNKSIZE,
+                     output_format="csv", keep_unknown_columns=False, csv_engine="c", trace_memory=False,
+                     progress_fd=None, progress_file=None, progress_interval=DEFAULT_MIN_INTERVAL, categorical=False):
+    """
+    Run one cleaning job end to end: read the upload, clean it, write the cleaned file and report JSON.
+    Returns the output paths. Shared by the CLI (one process per upload) and cleaning_worker.py (daemon).
+    stream=True cleans order datasets chunk by chunk (customer cleaning needs the whole table and ignores it).
+    output_format="parquet" writes the cleaned dataset as <name>_cleaned.parquet instead of CSV.
+    Columns outside CUSTOMER_SCHEMA / ORDER_SCHEMA are dropped right after exact-duplicate removal (STAGE 2)
+    and listed in report["summary"]["dropped_unknown_columns"], unless keep_unknown_columns is set.
+    Stage timings and memory (including the load) are written to report["performance"].
+    categorical=True keeps the low-cardinality text columns as `category` from their standardization on.
+    progress_fd / progress_file receive JSON-lines progress events (stage, rows, percent, ETA; see progress_events.py)
+    ending with a "completed" or "failed" event.
+    """
+    progress = ProgressReporter.open(progress_fd, progress_file, min_interval=progress_interval)
+    if dataset_type == "order" and stream:
+        progress.set_plan(ORDER_STREAM_STAGE_WEIGHTS)
+    else:
+        weights = CUSTOMER_STAGE_WEIGHTS if dataset_type == "customer" else ORDER_STAGE_WEIGHTS
+        progress.set_plan({"LOAD Read Upload": LOAD_STAGE_WEIGHT, **weights})
+    set_progress(progress)
     try:
-        # Read CSV from file path
-        df = pd.read_csv(args.temp_file_path_with_filename)
-        
-        # Get the directory of the input file (temp directory)
-        temp_dir = os.path.dirname(args.temp_file_path_with_filename)
-        
-        # Determine the original filename to pass into the pipeline
-        original_filename = args.original_file_name 
-        
-        # Create the full path for the cleaned file in the temp directory
-        base_name, ext = os.path.splitext(original_filename)
-        cleaned_path = os.path.join(temp_dir, f"{base_name}_cleaned{ext}")
-        report_path = os.path.join(temp_dir, f"{base_name}_report.json")
-        
-        if args.type == "customer":
-            cleaned_df, report = clean_customer_dataset(df, cleaned_path)
+        outputs = clean_to_files(dataset_type, temp_file_path_with_filename, original_file_name, stream, chunksize,
+                                 output_format, keep_unknown_columns, csv_engine, StageProfiler(trace_memory, progress=progress),
+                                 categorical=categorical)
+    except Exception as e:
+        progress.failed(e)
+        raise
+    else:
+        progress.completed(**outputs)
+    finally:
+        progress.close()
+        set_progress(ProgressReporter())
+    return outputs
+
+def clean_to_files(dataset_type, temp_file_path_with_filename, original_file_name, stream, chunksize,
+                   output_format, keep_unknown_columns, csv_engine, profiler, categorical=False):
+    """The body of run_cleaning_job: pick the pipeline, run it and write the cleaned file + report JSON"""
+
+    # Get the directory of the input file (temp directory)
+    temp_dir = os.path.dirname(temp_file_path_with_filename)
+
+    # Determine the original filename to pass into the pipeline
+    original_filename = original_file_name
+
+    # Create the full path for the cleaned file in the temp directory
+    base_name, ext = os.path.splitext(original_filename)
+    if dataset_format(original_filename) != output_format:
+        ext = FORMAT_EXTENSIONS[output_format]
+    cleaned_path = os.path.join(temp_dir, f"{base_name}_cleaned{ext}")
+    report_path = os.path.join(temp_dir, f"{base_name}_report.json")
+
+    if dataset_type == "order" and stream:
+        cleaned_df, report = clean_order_dataset_streaming(temp_file_path_with_filename, cleaned_path, chunksize=chunksize,
+                                                           keep_unknown_columns=keep_unknown_columns, profiler=profiler,
+                                                           categorical=categorical)
+    else:
+        # Read CSV / Parquet from file path (explicit dtypes; non-schema columns as text so STAGE 2 sees full rows)
+        schema = CUSTOMER_SCHEMA if dataset_type == "customer" else ORDER_SCHEMA
+        profiler.start("LOAD Read Upload")
+        df = load_dataset(temp_file_path_with_filename, schema, engine=csv_engine)
+        profiler.end(rows_out=len(df))
+        if dataset_type == "customer":
+            cleaned_df, report = clean_customer_dataset(df, cleaned_path, profiler=profiler, categorical=categorical,
+                                                        keep_unknown_columns=keep_unknown_columns)
         else:
-            cleaned_df, report = clean_order_dataset(df, cleaned_path)
+            cleaned_df, report = clean_order_dataset(df, cleaned_path, profiler=profiler, categorical=categorical,
+                                                     keep_unknown_columns=keep_unknown_columns)
+
+    # The cleaning pipelines save cleaned files to disk themselves; print any messages for logging
+    # if messages:
+    #     for m in messages:
+    #         if m:
+    #             print(m)
+    # Save report json
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4, default=str)
+
+    return {"cleaned_path": cleaned_path, "report_path": report_path}
 
-        # The cleaning pipelines save cleaned files to disk themselves; print any messages for logging
-        # if messages:
-        #     for m in messages:
-        #         if m:
-        #             print(m)
-        # Save report json
-        with open(report_path, "w", encoding="utf-8") as f:
-            json.dump(report, f, indent=4, default=str)
+def main():
+    args = build_arg_parser().parse_args()
+    set_log_level(args.log_level)
+
+    try:
+        outputs = run_cleaning_job(args.type, args.temp_file_path_with_filename, args.original_file_name,
+                                   stream=args.stream, chunksize=args.chunksize, output_format=args.output_format,
+                                   keep_unknown_columns=args.keep_unknown_columns, csv_engine=args.csv_engine,
+                                   trace_memory=args.trace_memory, progress_fd=args.progress_fd,
+                                   progress_file=args.progress_file, progress_interval=args.progress_interval,
+                                   categorical=args.categorical)
 
         print(f"[COMPLETED] Cleaning pipeline run successfully")
-        print(f"[COMPLETED] Cleaned saved: {cleaned_path}")
-        print(f"[COMPLETED] Report saved: {report_path}")
+        print(f"[COMPLETED] Cleaned saved: {outputs['cleaned_path']}")
+        print(f"[COMPLETED] Report saved: {outputs['report_path']}")
         sys.stdout.flush()
         sys.exit(0)
 
@@ -55,4 +136,4 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
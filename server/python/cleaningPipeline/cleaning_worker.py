@@ -0,0 +1,103 @@
+"""
+Long-lived cleaning worker (daemon mode for cleaning_main.py).
+
+Imports pandas / pycountry / fuzzywuzzy and builds the Malaysia/Singapore state tables and the state-matching index once,
+then processes cleaning jobs from a queue (stdin, one JSON object per line). Each job writes the
+same cleaned CSV and report JSON as `cleaning_main.py` would.
+
+Job (stdin), either explicit fields or the cleaning_main.py argv:
+    {"id": "1", "type": "customer", "temp_file_path_with_filename": "...", "original_file_name": "..."}
+    {"id": "2", "argv": ["--type", "order", "--temp_file_path_with_filename", "...", "--original_file_name", "..."]}
+    {"id": "3", "type": "order", ..., "stream": true, "chunksize": 50000, "output_format": "parquet"}
+    {"id": "4", "type": "customer", ..., "progress_file": "/tmp/job4.progress.jsonl"}
+    {"id": "5", "type": "customer", ..., "categorical": true}
+    {"cmd": "shutdown"}
+
+Reply (stdout), one line per job:
+    {"id": "1", "ok": true, "cleaned_path": "...", "report_path": "..."}
+    {"id": "1", "ok": false, "error": "..."}
+
+Pipeline logs go to stderr so stdout only carries replies.
+"""
+import json
+import os
+import sys
+import time
+
+from common_utils import preload_reference_data
+from location_reference import get_city_state_index, get_state_matcher
+from cleaning_main import build_arg_parser, run_cleaning_job
+from order_cleaning import DEFAULT_CHUNKSIZE
+
+def parse_job(job):
+    """Normalize a job into run_cleaning_job keyword arguments"""
+    if "argv" in job:
+        args = build_arg_parser().parse_args(job["argv"])
+        return {
+            "dataset_type": args.type,
+            "temp_file_path_with_filename": args.temp_file_path_with_filename,
+            "original_file_name": args.original_file_name,
+            "stream": args.stream,
+            "chunksize": args.chunksize,
+            "output_format": args.output_format,
+            "keep_unknown_columns": args.keep_unknown_columns,
+            "csv_engine": args.csv_engine,
+            "trace_memory": args.trace_memory,
+            "categorical": args.categorical,
+            "progress_file": args.progress_file,
+        }
+    dataset_type = job.get("type")
+    if dataset_type not in ("customer", "order"):
+        raise ValueError(f"Job type must be 'customer' or 'order', got {dataset_type!r}")
+    for key in ("temp_file_path_with_filename", "original_file_name"):
+        if not job.get(key):
+            raise ValueError(f"Job is missing '{key}'")
+    return {
+        "dataset_type": dataset_type,
+        "temp_file_path_with_filename": job["temp_file_path_with_filename"],
+        "original_file_name": job["original_file_name"],
+        "stream": bool(job.get("stream", False)),
+        "chunksize": int(job.get("chunksize", DEFAULT_CHUNKSIZE)),
+        "output_format": job.get("output_format", "csv"),
+        "keep_unknown_columns": bool(job.get("keep_unknown_columns", False)),
+        "csv_engine": job.get("csv_engine", "c"),
+        "trace_memory": bool(job.get("trace_memory", False)),
+        "categorical": bool(job.get("categorical", False)),
+        "progress_file": job.get("progress_file"),
+    }
+
+def serve(stdin=sys.stdin, stdout=sys.stdout):
+    preload_reference_data()
+    get_city_state_index()
+    get_state_matcher('MY')
+    # The pipelines print progress to stdout; keep it off the reply stream
+    sys.stdout = sys.stderr
+
+    def reply(payload):
+        stdout.write(json.dumps(payload) + "\n")
+        stdout.flush()
+
+    reply({"event": "ready", "pid": os.getpid()})
+    for line in stdin:
+        line = line.strip()
+        if not line:
+            continue
+        job_id = None
+        try:
+            job = json.loads(line)
+            job_id = job.get("id")
+            if job.get("cmd") == "shutdown":
+                reply({"id": job_id, "ok": True, "result": "shutdown"})
+                break
+            start = time.perf_counter()
+            outputs = run_cleaning_job(**parse_job(job))
+            reply({"id": job_id, "ok": True, "elapsed_s": round(time.perf_counter() - start, 3), **outputs})
+        except SystemExit as e:
+            # argparse errors inside "argv" jobs must not stop the daemon
+            reply({"id": job_id, "ok": False, "error": f"Invalid job arguments (exit {e.code})"})
+        except Exception as e:
+            print(f"❌ Error during cleaning job {job_id}: {str(e)}", file=sys.stderr)
+            reply({"id": job_id, "ok": False, "error": str(e)})
+
+if __name__ == "__main__":
+    serve()
@@ -1,47 +1,424 @@
 # Step 1: Import libraries
-# import pandas as pd
+import pandas as pd
 import numpy as np
-# import os
-# import pycountry
-# import re
+from collections import Counter
+from functools import lru_cache
+from pandas.tseries.api import guess_datetime_format
+import os
+import re
+import pycountry
 # import requests
 # import time
 # from datetime import datetime, date
 # from fuzzywuzzy import process, fuzz
 
+# ============================================ LOGGING ============================================ #
+
+# debug: everything ([LOG]/[TRACE] details, the default) | info: stage banners and messages | warn | error
+LOG_LEVELS = {"debug": 10, "info": 20, "warn": 30, "error": 40}
+LOG_LEVEL = os.environ.get("SEGMA_LOG_LEVEL", "debug")
+
+def set_log_level(level):
+    global LOG_LEVEL
+    if level not in LOG_LEVELS:
+        raise ValueError(f"Unknown log level {level!r}, expected one of {list(LOG_LEVELS)}")
+    LOG_LEVEL = level
+
+def log(message, level="debug"):
+    """print() gated by LOG_LEVEL"""
+    if LOG_LEVELS[level] >= LOG_LEVELS.get(LOG_LEVEL, 10):
+        print(message)
+
+# ============================================ REFERENCE DATA ============================================ #
+
+@lru_cache(maxsize=None)
+def get_country_subdivisions(country_code):
+    """State/region names for a country from pycountry, built once per process (e.g. 'MY', 'SG')"""
+    return tuple(sub.name for sub in pycountry.subdivisions if sub.country_code == country_code)
+
+def preload_reference_data():
+    """Warm the reference tables used by the customer pipeline (used by the long-lived cleaning worker)"""
+    get_country_subdivisions('MY')
+    get_country_subdivisions('SG')
+
+# ============================================ DATE PARSING ENGINE ============================================ #
+
+DATE_FORMAT_SAMPLE_SIZE = 2000
+FORMAT_GUESS_SAMPLE_SIZE = 500  # guess_datetime_format is a Python call per value
+# Year-first values (2024-01-05) are always year-month-day; dayfirst would guess %Y-%d-%m for them
+YEAR_FIRST = re.compile(r"\s*\d{4}[-/.]")
+# Trailing UTC offset of a timestamp ("Z", "+08:00", "-0500"), used to parse mixed-offset columns group by group
+UTC_OFFSET_SUFFIX = r"(Z|[+-]\d{2}:?\d{2})\s*$"
+
+def to_naive_datetimes(values, fmt):
+    """
+    pd.to_datetime(values, format=fmt, errors='coerce') with timezone offsets dropped: the wall time as written
+    is kept (10:00+08:00 -> 10:00, like the original strftime output), so results fit a naive datetime column.
+    A column mixing several offsets is parsed one offset group at a time.
+    """
+    try:
+        result = pd.to_datetime(values, format=fmt, errors='coerce')
+    except ValueError:
+        offsets = values.str.extract(UTC_OFFSET_SUFFIX, expand=False).fillna('')
+        result = pd.Series(pd.NaT, index=values.index, dtype='datetime64[us]')
+        for _, group in values.groupby(offsets):
+            result[group.index] = to_naive_datetimes(group, fmt)
+        return result
+    if isinstance(result.dtype, pd.DatetimeTZDtype):
+        result = result.dt.tz_localize(None)
+    return result
+
+def detect_date_formats(values, formats, sample_size=DATE_FORMAT_SAMPLE_SIZE, seed=42):
+    """Count how many sampled values each format parses; returns {format: hits} in the given format order"""
+    if len(values) > sample_size:
+        values = values.sample(sample_size, random_state=seed)
+    return {fmt: int(to_naive_datetimes(values, fmt).notna().sum()) for fmt in formats}
+
+def parse_dates_multi_format(series, formats, sample_size=DATE_FORMAT_SAMPLE_SIZE):
+    """
+    Vectorized equivalent of trying datetime.strptime(str(x), fmt) for each fmt in `formats` (first match wins).
+    - Formats are applied as whole-column pd.to_datetime passes on the still-unparsed remainder,
+      most frequent first (frequency detected on a sample)
+    - A value that an earlier format in `formats` also accepts is re-assigned to that format,
+      so the result does not depend on the detection order
+    Returns (datetime series with NaT for unparsed values, stats dict)
+    """
+    values = series[series.notna()].astype(str)
+    sample_hits = detect_date_formats(values, formats, sample_size)
+    order = sorted(formats, key=lambda fmt: (-sample_hits[fmt], formats.index(fmt)))
+
+    parsed = pd.Series(pd.NaT, index=values.index, dtype='datetime64[us]')
+    matched_format = pd.Series(None, index=values.index, dtype=object)
+    remaining = values
+    for fmt in order:
+        if remaining.empty:
+            break
+        result = to_naive_datetimes(remaining, fmt)
+        hit = result.notna()
+        parsed[hit[hit].index] = result[hit]
+        matched_format[hit[hit].index] = fmt
+        remaining = remaining[~hit]
+
+    # Priority check: rows claimed by a format that was tried ahead of a higher-priority one
+    for position, fmt in enumerate(order):
+        for earlier in order[position + 1:]:
+            if formats.index(earlier) > formats.index(fmt):
+                continue
+            claimed = values[matched_format == fmt]
+            if claimed.empty:
+                break
+            result = to_naive_datetimes(claimed, earlier)
+            hit = result.notna()
+            parsed[hit[hit].index] = result[hit]
+            matched_format[hit[hit].index] = earlier
+
+    counts = matched_format.value_counts()
+    stats = {
+        "rows": int(len(series)),
+        "null_rows": int(len(series) - len(values)),
+        "unparsed_rows": int(matched_format.isna().sum()),
+        "format_order": order,
+        "format_counts": {fmt: int(counts.get(fmt, 0)) for fmt in formats if counts.get(fmt, 0)},
+    }
+    return parsed.reindex(series.index), stats
+
+def guess_date_formats(values, sample_size=FORMAT_GUESS_SAMPLE_SIZE, dayfirst=True, seed=42):
+    """
+    Formats of a sample of the distinct values (pandas guess_datetime_format), most frequent first.
+    Values pandas cannot guess a format for are ignored; year-first values are never guessed day first.
+    """
+    distinct = pd.Series(values.dropna().unique())
+    if len(distinct) > sample_size:
+        distinct = distinct.sample(sample_size, random_state=seed)
+    counts = Counter(
+        guess_datetime_format(str(value), dayfirst=dayfirst and not YEAR_FIRST.match(str(value))) for value in distinct
+    )
+    counts.pop(None, None)
+    return [fmt for fmt, _ in counts.most_common()]
+
+def parse_datetimes(series, formats=None, dayfirst=True, sample_size=DATE_FORMAT_SAMPLE_SIZE):
+    """
+    Parse free-text datetimes with explicit formats only (no per-element inference):
+    - formats: priority order, e.g. detected once for a whole file; default guess_date_formats() on this column
+    - whole-column passes per format via parse_dates_multi_format (an ambiguous value goes to the earlier format)
+    - values none of them parse get one more detection round on what is left
+    Returns (datetime series with NaT for unparsed / empty values, stats dict)
+    """
+    text = series.dropna().astype(str).str.strip()
+    text = text[text != '']
+    formats = list(formats) if formats else guess_date_formats(text, dayfirst=dayfirst)
+    parsed, stats = parse_dates_multi_format(text, formats, sample_size)
+    format_counts = dict(stats["format_counts"])
+    leftover = text[parsed.isna()]
+    extra = [fmt for fmt in guess_date_formats(leftover, dayfirst=dayfirst) if fmt not in formats]
+    if extra:
+        more, more_stats = parse_dates_multi_format(leftover, extra, sample_size)
+        parsed = parsed.fillna(more)
+        format_counts.update(more_stats["format_counts"])
+        formats += extra
+    stats = {
+        "rows": int(len(series)),
+        "null_rows": int(len(series) - len(text)),
+        "unparsed_rows": int(parsed.isna().sum()),
+        "formats": formats,
+        "format_counts": format_counts,
+    }
+    return parsed.reindex(series.index), stats
+
+# ============================================ FACTORIZE-THEN-MAP ENGINE ============================================ #
+
+def map_unique(series, transform, label=None, stats=None, categorical=False):
+    """
+    Run `transform` (Series -> Series, e.g. a .str chain) on the distinct values of `series` only and map
+    the results back to every row through the factorize codes. NaN is kept as one distinct value, so the
+    transform sees the same inputs as it would on the full column.
+    categorical=True returns a `category` column built straight from the codes (no per-row strings).
+    With a `stats` dict, stats[label] accumulates rows / uniques / unique_ratio (summed over calls, e.g. chunks).
+    """
+    codes, uniques = series.factorize(use_na_sentinel=False)
+    transformed = transform(pd.Series(uniques))
+    if categorical:
+        transformed = transformed.astype("category")
+    mapped = transformed.take(codes).set_axis(series.index)
+    mapped.name = series.name
+    if stats is not None and label is not None:
+        entry = stats.setdefault(label, {"rows": 0, "uniques": 0, "unique_ratio": None})
+        entry["rows"] += len(series)
+        entry["uniques"] += len(uniques)
+        entry["unique_ratio"] = round(entry["uniques"] / entry["rows"], 4) if entry["rows"] else None
+        log(f"[LOG] {label}: standardized {len(uniques)} distinct values for {len(series)} rows")
+    return mapped
+
+def ensure_categories(df, column, values):
+    """
+    Make `values` assignable to a categorical column (categories stay sorted, so mode() ties break as they
+    do on plain strings); no-op for non-categorical columns.
+    """
+    if not isinstance(df[column].dtype, pd.CategoricalDtype):
+        return
+    categories = df[column].cat.categories
+    missing = pd.Index(values).dropna().unique().difference(categories)
+    if len(missing):
+        df[column] = df[column].cat.set_categories(categories.union(missing))
+
+# ============================================ NUMERIC PARSING ENGINE ============================================ #
+
+# Everything except digits, '.' and '-': currency prefixes ("RM", "$"), thousands separators, units ("pcs")
+NUMERIC_JUNK = re.compile(r"[^\d\.\-]")
+PLAIN_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+def parse_numeric_text(series, decimals=None, integer=False, label=None, stats=None):
+    """
+    Parse free-text numbers once per distinct value (map_unique): "RM 1,234.50" -> 1234.5, "3 pcs" -> 3.
+    Plain numbers go straight to pd.to_numeric; only the others are stripped with NUMERIC_JUNK first;
+    anything still invalid becomes NaN. Already numeric columns (e.g. typed Parquet) skip the text handling.
+    decimals rounds the result; integer=True rounds to whole numbers and returns Int64 (float64 otherwise).
+    Returns (parsed series, number of non-null values that could not be parsed).
+    """
+    def parse(values):
+        if pd.api.types.is_numeric_dtype(values):
+            return pd.to_numeric(values, errors="coerce").astype(float)
+        text = values.astype(str)
+        plain = text.str.fullmatch(PLAIN_NUMBER).fillna(False).astype(bool)
+        cleaned = text.where(plain, text[~plain].str.replace(NUMERIC_JUNK, "", regex=True))
+        return pd.to_numeric(cleaned, errors="coerce").astype(float)
+
+    parsed = map_unique(series, parse, label, stats)
+    failures = int((series.notna() & parsed.isna()).sum())
+    if integer:
+        parsed = parsed.round(0).astype("Int64")
+    elif decimals is not None:
+        parsed = parsed.round(decimals)
+    return parsed, failures
+
+# ============================================ DATASET FILES (CSV / PARQUET) ============================================ #
+
+OUTPUT_FORMATS = ["csv", "parquet"]
+FORMAT_EXTENSIONS = {"csv": ".csv", "parquet": ".parquet"}
+
+def dataset_format(path):
+    """'parquet' for .parquet/.pq files, otherwise 'csv'"""
+    return "parquet" if path.lower().endswith((".parquet", ".pq")) else "csv"
+
+def import_pyarrow():
+    """pyarrow is only needed for Parquet files, so it is imported on first use"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("Parquet support needs the 'pyarrow' package (pip install pyarrow)") from e
+    return pyarrow
+
+def read_dataset(path, columns=None, **csv_kwargs):
+    """Read a CSV or Parquet file; `columns` limits what is loaded (unknown names are ignored)"""
+    if dataset_format(path) == "parquet":
+        pa = import_pyarrow()
+        if columns is not None:
+            available = set(pa.parquet.read_schema(path).names)
+            columns = [c for c in columns if c in available]
+        return pd.read_parquet(path, columns=columns)
+    if columns is not None:
+        wanted = set(columns)
+        csv_kwargs["usecols"] = lambda c: c in wanted
+    return pd.read_csv(path, **csv_kwargs)
+
+CSV_ENGINES = ["c", "pyarrow"]
+
+def read_header(path):
+    """Raw column names of a CSV / Parquet file (only the header is read)"""
+    if dataset_format(path) == "parquet":
+        return list(import_pyarrow().parquet.read_schema(path).names)
+    return list(pd.read_csv(path, nrows=0).columns)
+
+def schema_read_options(raw_columns, schema, schema_only=False):
+    """
+    Match raw header names against a {normalized name: dtype} schema (names normalized like normalize_columns_name).
+    Returns (usecols, dtype): schema columns get their dtype; other columns are read as plain text
+    (no type inference), or skipped when schema_only is set.
+    """
+    usecols, dtype = [], {}
+    for raw in raw_columns:
+        name = str(raw).strip().lower()
+        if name in schema:
+            usecols.append(raw)
+            dtype[raw] = schema[name]
+        elif not schema_only:
+            usecols.append(raw)
+            dtype[raw] = str
+    return usecols, dtype
+
+def load_dataset(path, schema, schema_only=False, engine="c", chunksize=None):
+    """
+    Explicit-dtype loader for uploads: sniffs the header, gives schema columns their schema dtype and reads
+    every other column as text, so nothing goes through type inference. The cleaning passes load every column
+    (STAGE 2 compares full rows; the pipelines drop non-schema columns after it).
+    - schema_only: skip the non-schema columns (for passes that never need them, e.g. the streaming profile)
+    - engine: CSV parser ("c" or "pyarrow"; chunked reads always use "c")
+    - chunksize: return an iterator of DataFrames instead of one DataFrame
+    Parquet files are already typed, so only the column selection applies to them.
+    """
+    raw_columns = read_header(path)
+    usecols, dtype = schema_read_options(raw_columns, schema, schema_only)
+    skipped = [c for c in raw_columns if c not in usecols]
+    log(f"[LOG - STAGE 0] Loading {len(usecols)} of {len(raw_columns)} columns" + (f", skipped: {skipped}" if skipped else ""))
+    if dataset_format(path) == "parquet":
+        if chunksize:
+            batches = import_pyarrow().parquet.ParquetFile(path).iter_batches(batch_size=chunksize, columns=usecols)
+            return (batch.to_pandas() for batch in batches)
+        return read_dataset(path, columns=usecols)
+    if chunksize:
+        return pd.read_csv(path, usecols=usecols, dtype=dtype, chunksize=chunksize)
+    if engine == "pyarrow":
+        import_pyarrow()
+    return pd.read_csv(path, usecols=usecols, dtype=dtype, engine=engine)
+
+def render_unknown_values(df, columns, placeholder="Unknown"):
+    """Copy of df for saving: missing values in `columns` (nullable / categorical) become `placeholder`"""
+    rendered = {}
+    for col in columns:
+        if col in df.columns and df[col].isna().any():
+            rendered[col] = df[col].astype(object).where(df[col].notna(), placeholder)
+    return df.assign(**rendered) if rendered else df
+
+def render_datetime_values(df, text_formats):
+    """Copy of df for saving: datetime / timedelta columns in `text_formats` ({column: strftime format}) become text"""
+    rendered = {}
+    for col, fmt in (text_formats or {}).items():
+        if col in df.columns:
+            values = df[col]
+            if pd.api.types.is_timedelta64_dtype(values):
+                values = pd.Timestamp(0) + values  # time of day -> strftime-able
+            if pd.api.types.is_datetime64_any_dtype(values):
+                rendered[col] = values.dt.strftime(fmt)
+    return df.assign(**rendered) if rendered else df
+
+def write_dataset(df, path, unknown_columns=(), text_formats=None):
+    """
+    Write df as CSV or Parquet (picked from the file extension).
+    CSV gets the "Unknown" text for missing values in `unknown_columns` and datetimes formatted with
+    `text_formats`; Parquet keeps the typed nulls, timestamps and durations.
+    """
+    if dataset_format(path) == "parquet":
+        import_pyarrow()
+        df.to_parquet(path, index=False)
+    else:
+        render_datetime_values(render_unknown_values(df, unknown_columns), text_formats).to_csv(path, index=False)
+
+class DatasetWriter:
+    """Appends DataFrame chunks to one CSV or Parquet file (streaming mode); text_formats as in write_dataset"""
+
+    def __init__(self, path, text_formats=None):
+        self.path = path
+        self.text_formats = text_formats
+        self.format = dataset_format(path)
+        self.rows = 0
+        self.columns = None
+        self._parquet = None
+        self._schema = None
+
+    def write(self, df):
+        if self.format == "parquet":
+            pa = import_pyarrow()
+            if self._parquet is None:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                # A column that is all null in the first chunk has no type yet; store it as text
+                # Categorical columns: later chunks can have more categories, so use 32-bit dictionary indices
+                self._schema = pa.schema([
+                    field.with_type(pa.string()) if pa.types.is_null(field.type)
+                    else field.with_type(pa.dictionary(pa.int32(), field.type.value_type)) if pa.types.is_dictionary(field.type)
+                    else field
+                    for field in table.schema
+                ])
+                self._parquet = pa.parquet.ParquetWriter(self.path, self._schema)
+            self._parquet.write_table(pa.Table.from_pandas(df, schema=self._schema, preserve_index=False))
+        else:
+            render_datetime_values(df, self.text_formats).to_csv(self.path, mode="w" if self.columns is None else "a",
+                                                                 header=self.columns is None, index=False)
+        self.columns = list(df.columns)
+        self.rows += len(df)
+
+    def close(self, empty_columns=()):
+        """Finish the file; if nothing was written, leave an empty file with `empty_columns`"""
+        if self.columns is None:
+            self.write(pd.DataFrame(columns=list(empty_columns)))
+        if self._parquet is not None:
+            self._parquet.close()
+            self._parquet = None
+
 # ============================================ GENERIC FUNCTIONS ============================================ #
 
 def normalize_columns_name(df):
     """Normalize column names: lowercase, strip spaces"""
-    print("[LOG - STAGE 0] Running normalize_columns_name...")
+    log("[LOG - STAGE 0] Running normalize_columns_name...")
     df.columns = df.columns.str.strip().str.lower()
-    print(f"[LOG - STAGE 0] Columns after normalization: {list(df.columns)}")
+    log(f"[LOG - STAGE 0] Columns after normalization: {list(df.columns)}")
     return df
 
-def check_mandatory_columns(df, dataset_type, mandatory_columns, threshold=0.9):
+def check_mandatory_columns(df, dataset_type, mandatory_columns, threshold=0.9, fill_ratios=None):
     """
     Generic function to check mandatory columns for both Customer and Order datasets.
     - dataset_type: 'customer' or 'order'
     - mandatory_columns: list of required columns for that dataset
     - threshold: minimum acceptable fill ratio (default 0.8)
+    - fill_ratios: precomputed {column: fill ratio} for the whole file (streaming mode, df is then only one chunk)
     """
-    print(f"[LOG - STAGE 1] Running check_mandatory_columns for {dataset_type} dataset...")
+    log(f"[LOG - STAGE 1] Running check_mandatory_columns for {dataset_type} dataset...")
 
     missing_report = []
     warning_columns = []
 
     # Step 1: Check each mandatory column
     for col in mandatory_columns:
-        if col in df.columns:
-            fill_ratio = df[col].notna().mean()
-            print(f"[LOG - STAGE 1] Mandatory column '{col}' fill ratio: {fill_ratio:.2f}")
+        if col in (fill_ratios if fill_ratios is not None else df.columns):
+            fill_ratio = fill_ratios[col] if fill_ratios is not None else df[col].notna().mean()
+            log(f"[LOG - STAGE 1] Mandatory column '{col}' fill ratio: {fill_ratio:.2f}")
             missing_percent = (1 - fill_ratio) * 100
             missing_report.append(f"{col}: {missing_percent:.1f}% missing")
 
             if fill_ratio < threshold:
                 warning_columns.append(col)
         else:
-            print(f"[LOG - STAGE 1] Mandatory column '{col}' not found")
+            log(f"[LOG - STAGE 1] Mandatory column '{col}' not found")
             missing_report.append(f"{col}: column not found (100% missing)")
             warning_columns.append(col)
 
@@ -76,27 +453,41 @@ def check_mandatory_columns(df, dataset_type, mandatory_columns, threshold=0.9):
 
 def remove_duplicate_entries(df):
     """Remove duplicate rows, keeping the first occurrence"""
-    print("[LOG - STAGE 2] Running remove_duplicate_entries...")
+    log("[LOG - STAGE 2] Running remove_duplicate_entries...")
     initial_len = len(df)
     df = df.drop_duplicates(keep='first', ignore_index=True)
     removed_dup = initial_len - len(df)
-    print(f"[LOG - STAGE 2] Removed {removed_dup} duplicate rows.")
+    log(f"[LOG - STAGE 2] Removed {removed_dup} duplicate rows.")
     return df
 
-def standardize_customer_id(df):
+def drop_unknown_columns(df, schema):
+    """
+    Drop the columns outside a {normalized name: dtype} schema. Runs after STAGE 2 so exact duplicates
+    are still judged on the full uploaded row. Returns (df, dropped column names, message).
+    """
+    dropped = [col for col in df.columns if col not in schema]
+    if not dropped:
+        return df, dropped, None
+    df = df.drop(columns=dropped)
+    log(f"[LOG - STAGE 2] Dropped {len(dropped)} column(s) not used by the pipeline: {dropped}")
+    formatted = ", ".join(f"**{' '.join(w.capitalize() for w in str(col).split())}**" for col in dropped)
+    message = f"({formatted}) are not used for segmentation, so they were removed from the cleaned dataset."
+    return df, dropped, message
+
+def standardize_customer_id(df, factorize_stats=None):
     """Standardize CustomerID format and keep null as NaN"""
-    print("[LOG - STAGE 4] Running standardize_customer_id...")
+    log("[LOG - STAGE 4] Running standardize_customer_id...")
 
     if 'customerid' in df.columns:
-        # Convert to string, strip spaces
-        df.loc[:, 'customerid'] = df['customerid'].astype(str).str.strip().str.upper()
-
-        # Convert empty string back to NaN
-        df.loc[df['customerid'] == '', 'customerid'] = np.nan
+        # Convert to string, strip spaces; empty string back to NaN (once per distinct ID)
+        df.loc[:, 'customerid'] = map_unique(
+            df['customerid'], lambda ids: ids.astype(str).str.strip().str.upper().replace('', np.nan),
+            'customerid', factorize_stats,
+        )
 
-        print("[LOG - STAGE 4] CustomerID column standardized (empty -> NaN)")
+        log("[LOG - STAGE 4] CustomerID column standardized (empty -> NaN)")
     else:
-        print("[LOG - STAGE 4] CustomerID column not found, skipping")
+        log("[LOG - STAGE 4] CustomerID column not found, skipping")
 
     return df
 # Might have special case of dirty data exist such as "****", "1234....", "annbwbciwbciowb"
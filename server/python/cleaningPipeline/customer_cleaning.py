@@ -1,14 +1,37 @@
 # Step 1: Import libraries
-from common_utils import normalize_columns_name, check_mandatory_columns, remove_duplicate_entries, standardize_customer_id; 
+from common_utils import normalize_columns_name, check_mandatory_columns, remove_duplicate_entries, drop_unknown_columns, standardize_customer_id, get_country_subdivisions, parse_dates_multi_format, map_unique, ensure_categories, write_dataset, log; 
+from location_reference import get_city_state_index, get_state_matcher, normalize_city_key, STATE_MEMO_NAMESPACE
+from geocode_cache import GeocodeCache
+from geocoding import GeocodingClient
+from stage_profiler import StageProfiler
+from progress_events import get_progress
 import pandas as pd
 import numpy as np
 import os
-import pycountry
 import re
-import requests
-import time
-from datetime import datetime, date
-from fuzzywuzzy import process, fuzz
+from datetime import date
+
+# Columns the customer pipeline reads (normalized name -> dtype): mandatory customerid/city/state and
+# optional date of birth/gender; gender has only a handful of distinct values, so it is loaded as category
+CUSTOMER_SCHEMA = {
+    "customerid": str,
+    "city": str,
+    "state": str,
+    "date of birth": str,
+    "gender": "category",
+}
+
+# Relative cost of each profiled stage, used to turn stage progress into an overall percentage;
+# STAGE 5 dominates whenever cities have to go to the geocoding API
+CUSTOMER_STAGE_WEIGHTS = {
+    "STAGE 0 Normalize Column Names": 1,
+    "STAGE 1 Schema & Column Validation": 2,
+    "STAGE 2 Remove Duplicate Entry Rows": 5,
+    "STAGE 3 Deduplication": 10,
+    "STAGE 4 Standardization & Normalization": 25,
+    "STAGE 5 Missing Value Handling": 40,
+    "FINAL STAGE Save Cleaned Dataset": 7,
+}
 
 # ============================================= (CUSTOMER DATASET) STAGE 0: NORMALIZE COLUMN NAMES =============================================
 # From Generic function: normalize_columns_name
@@ -20,7 +43,7 @@ def customer_check_optional_columns(df, threshold=0.9):
     Check optional columns for fill percentage and drop columns that are mostly empty.
     Returns the modified DataFrame and a friendly message.
     """
-    print("[LOG - STAGE 1] Running customer_check_optional_columns...")
+    log("[LOG - STAGE 1] Running customer_check_optional_columns...")
     optional_columns = ["date of birth", "gender"]
     dropped_columns = []
     missing_report = []
@@ -30,16 +53,16 @@ def customer_check_optional_columns(df, threshold=0.9):
             fill_ratio = df[col].notna().mean()
             missing_percent = (1 - fill_ratio) * 100
             missing_report.append(f"{col}: {missing_percent:.1f}% missing")
-            print(f"[LOG - STAGE 1] Optional column '{col}' fill ratio: {fill_ratio:.2f}")
+            log(f"[LOG - STAGE 1] Optional column '{col}' fill ratio: {fill_ratio:.2f}")
             if fill_ratio < threshold:
                 dropped_columns.append(col)
                 df.drop(columns=[col], inplace=True)  # Drop the column immediately
                 # df[col].count(): This counts the number of non-missing (non-null/non-NaN) values in the current column (col).
                 # len(df): This gives the total number of rows in the DataFrame.
                 # fill_ratio: The division calculates the proportion of filled (non-missing) values in that column. A ratio of 1.0 means the column is entirely filled; a ratio of 0.1 means 90% of the values are missing.
-                print(f"[LOG - STAGE 1] Dropped optional column '{col}' due to too many missing values")
+                log(f"[LOG - STAGE 1] Dropped optional column '{col}' due to too many missing values")
         else:
-            print(f"[LOG - STAGE 1] Optional column '{col}' not found")
+            log(f"[LOG - STAGE 1] Optional column '{col}' not found")
             missing_report.append(f"{col}: column not found (100% missing)")
             dropped_columns.append(col)
 
@@ -68,64 +91,76 @@ def customer_check_optional_columns(df, threshold=0.9):
 # From Generic function: remove_duplicate_entries
 
 # ============================================= (CUSTOMER DATASET) STAGE 3: DEDUPLICATE =================================================
+def resolve_column_modes(ids, values):
+    """
+    Most frequent non-null value per id (ties -> smallest value, like Series.mode().iloc[0]).
+    Ids whose values are all null are left out. Returns a Series indexed by id.
+    """
+    valid = values.notna()
+    counts = (
+        pd.DataFrame({'id': ids[valid].to_numpy(), 'value': values[valid].to_numpy()})
+        .groupby(['id', 'value'], sort=True).size()
+        .reset_index(name='n')
+    )
+    # Rows are sorted by (id, value), so idxmax picks the smallest value among the tied counts
+    best = counts.loc[counts.groupby('id', sort=False)['n'].idxmax()]
+    return best.set_index('id')['value']
+
 def deduplicate_customers(df):
-    print("[LOG - STAGE 3] Running deduplicate_customers...")
+    log("[LOG - STAGE 3] Running deduplicate_customers...")
+    message = "No duplicate CustomerIDs found."
     if 'customerid' not in df.columns:
-        print("[LOG - STAGE 3] 'customerid' column missing, skipping deduplication")
-        return df
+        log("[LOG - STAGE 3] 'customerid' column missing, skipping deduplication")
+        return df, message
 
     before_dup_id = len(df)
-    def resolve_conflict(series):
-        vals = series.dropna().unique()
-        if len(vals) == 0:
-            return pd.NA
-        elif len(vals) == 1:
-            return vals[0]
-        else:
-            return series.mode().iloc[0]
-
-    # Vectorized groupby instead of per-group loop
-    df = df.groupby('customerid', as_index=False).agg(resolve_conflict)
+    # Rows without an ID are dropped (as groupby would)
+    df = df[df['customerid'].notna()]
+    dup_mask = df['customerid'].duplicated(keep=False)
+
+    # Singleton IDs pass through untouched; only duplicated IDs are resolved, one column at a time:
+    # most frequent non-null value, ties -> smallest, all null -> null
+    singles = df[~dup_mask]
+    dups = df[dup_mask]
+    resolved = pd.DataFrame({'customerid': np.sort(dups['customerid'].unique())})
+    if not dups.empty:
+        for col in df.columns.drop('customerid'):
+            resolved[col] = resolved['customerid'].map(resolve_column_modes(dups['customerid'], dups[col]))
+        df = pd.concat([singles, resolved[df.columns]], ignore_index=True)
+    df = df.sort_values('customerid', kind='stable').reset_index(drop=True)
     
     removed_dup_id = before_dup_id - len(df)
     if removed_dup_id > 0:
         message = (f"{removed_dup_id} duplicate CustomerIDs removed.")
-    else:
-        message = "No duplicate CustomerIDs found."
-    print("[LOG - STAGE 3] Deduplication complete (vectorized)")
+    log(f"[LOG - STAGE 3] Deduplication complete ({len(resolved)} duplicated IDs resolved, {len(singles)} unique IDs kept as is)")
     return df, message
 
 # ============================================= (CUSTOMER DATASET) STAGE 4: STANDARDIZATION & NORMALIZATION =============================================
 # From Generic function: standardize_customer_id
 
+DOB_FORMATS = ("%d/%m/%Y", "%m-%d-%y", "%Y-%m-%d", "%d-%b-%Y", "%d-%m-%Y", "%d %B %Y", "%B %d, %Y", "%b %d %Y")
+
 def standardize_dob(df):
     """Standardize Date of Birth column and convert to YYYY-MM-DD"""
-    print("[LOG - STAGE 4] Running standardize_dob...")
+    log("[LOG - STAGE 4] Running standardize_dob...")
     # Rename only 'date of birth' to 'dob'
     message = None
+    dob_stats = None
     df = df.rename(columns={'date of birth': 'dob'})  
     if 'dob' in df.columns:
-        print("[LOG - STAGE 4] DOB column found, parsing dates...")
-        def parse_date(x):
-            if pd.isnull(x):
-                return pd.NaT
-            for format in ("%d/%m/%Y", "%m-%d-%y", "%Y-%m-%d", "%d-%b-%Y", "%d-%m-%Y", "%d %B %Y", "%B %d, %Y", "%b %d %Y"):    
-                try:
-                    return datetime.strptime(str(x), format).date() # Final format: YYYY-MM-DD | 2025-10-15
-                except Exception:
-                    continue
-            return pd.NaT  # If no valid format found
-        df['dob'] = df['dob'].apply(parse_date)
-        df['dob'] = pd.to_datetime(df['dob'])
+        log("[LOG - STAGE 4] DOB column found, parsing dates...")
+        # Same result as trying datetime.strptime with each of DOB_FORMATS per row, one column pass per format
+        df['dob'], dob_stats = parse_dates_multi_format(df['dob'], DOB_FORMATS)
         # Keep NaT as is - don't fill with "Unknown" string (causes issues with .year/.month/.day)
-        print("[LOG - STAGE 4] DOB parsing complete. Invalid dates kept as NaT")
+        log(f"[LOG - STAGE 4] DOB formats detected: {dob_stats['format_counts']}")
+        log("[LOG - STAGE 4] DOB parsing complete. Invalid dates kept as NaT")
         message = (
             "Since your dataset includes a Date of Birth information, we derived two useful fields "
             "'Age' and 'Age Group' for segmentation purposes, and the original 'Date of Birth' column will be remove."
         )
     else:
-        print("[LOG - STAGE 4] DOB column not found, skipping")
-    return df, message
+        log("[LOG - STAGE 4] DOB column not found, skipping")
+    return df, message, dob_stats
 
     # %d/%m/%Y → 12/05/2000
     # %m-%d-%y → 05-12-00
@@ -140,21 +175,18 @@ def standardize_dob(df):
 
 def derive_age_features(df):
     """Derive Age from DOB"""
-    print("[LOG - STAGE 4] Running derive_age_features...")
+    log("[LOG - STAGE 4] Running derive_age_features...")
     if 'dob' in df.columns:
         today = date.today()
-        df['age'] = df['dob'].apply(
-            lambda x: today.year - x.year - ((today.month, today.day) < (x.month, x.day))
-            if pd.notnull(x) else None
-        )
-        df['age'] = pd.to_numeric(df['age'], errors='coerce')
-        # Replace NaN with "Unknown" and ensure no empty strings
-        df['age'] = df['age'].fillna("Unknown")
-        df['age'] = df['age'].replace('', 'Unknown')  # Handle empty strings
-        print("[LOG - STAGE 4] Age derived from DOB, null age marked as Unknown")
+        dob = df['dob']
+        # Birthday not reached yet this year -> one year younger
+        before_birthday = (dob.dt.month > today.month) | ((dob.dt.month == today.month) & (dob.dt.day > today.day))
+        # Nullable integer: missing DOB stays <NA> and is written as "Unknown" when the file is saved
+        df['age'] = (today.year - dob.dt.year - before_birthday.astype(int)).astype('Int64')
+        log("[LOG - STAGE 4] Age derived from DOB, null age marked as Unknown")
     else:
         # If DOB column doesn't exist, skip age creation
-        print("[LOG - STAGE 4] DOB column not found, skipping age creation")
+        log("[LOG - STAGE 4] DOB column not found, skipping age creation")
     return df
     # Example: ((today.month, today.day) < (x.month, x.day))
     # (10,15) < (12,1) → True (birthday in Dec is after Oct 15)
@@ -165,81 +197,72 @@ def derive_age_features(df):
 
 # ===============================================================================
 
+AGE_GROUP_BINS = [-np.inf, 17, 24, 34, 44, 54, 64, np.inf]
+AGE_GROUP_LABELS = ['Below 18', '18-24', '25-34', '35-44', '45-54', '55-64', 'Above 65']
+
 def derive_age_group(df):
     """Derive Age Group based on defined buckets"""
-    print("[LOG - STAGE 4] Running derive_age_group...")
+    log("[LOG - STAGE 4] Running derive_age_group...")
     if 'age' in df.columns:
-        def categorize_age(age):
-            if pd.isnull(age) or age == "Unknown" or age == '':
-                return 'Unknown'
-            # Convert to numeric if string (safety check)
-            if isinstance(age, str):
-                try:
-                    age = float(age)
-                except:
-                    return 'Unknown'
-            if age < 18: return 'Below 18'
-            elif 18 <= age <= 24: return '18-24'
-            elif 25 <= age <= 34: return '25-34'
-            elif 35 <= age <= 44: return '35-44'
-            elif 45 <= age <= 54: return '45-54'
-            elif 55 <= age <= 64: return '55-64'
-            else: return 'Above 65'
-        df['age group'] = df['age'].apply(categorize_age)
-        # Clean up any remaining empty strings or NaN
-        df['age group'] = df['age group'].fillna("Unknown")
-        df['age group'] = df['age group'].replace('', 'Unknown')
-        print("[LOG - STAGE 4] Age groups derived, null age_group marked as Unknown")
+        # Bins are right-inclusive on whole ages: <18, 18-24, ..., 55-64, 65+
+        age = pd.to_numeric(df['age'], errors='coerce')
+        df['age group'] = pd.cut(age, bins=AGE_GROUP_BINS, labels=AGE_GROUP_LABELS)
+        log("[LOG - STAGE 4] Age groups derived, null age_group marked as Unknown")
     else:
-        print("[LOG - STAGE 4] Age column not found, skipping age_group creation")
+        log("[LOG - STAGE 4] Age column not found, skipping age_group creation")
     return df
 
 # ===============================================================================
 
 def drop_dob_after_age_derived(df):
     """Drop DOB column after deriving age and age_group"""
-    print("[LOG - STAGE 4] Running drop_dob_after_age_derived...")
+    log("[LOG - STAGE 4] Running drop_dob_after_age_derived...")
     if 'dob' in df.columns:
         df = df.drop(columns=['dob'])
-        print("[LOG - STAGE 4] Dropped DOB column")
+        log("[LOG - STAGE 4] Dropped DOB column")
     else:
-        print("[LOG - STAGE 4] DOB column not found, skipping")
+        log("[LOG - STAGE 4] DOB column not found, skipping")
     return df
 
+# Missing values in these columns are kept as NA in memory and written out as "Unknown" in CSV output
+UNKNOWN_ON_SAVE_COLUMNS = ['age', 'age group']
+
 # Column	    Value when original DOB is null
 # =============================================
 # dob	        "Unknown" 
-# age	        "Unknown" 
-# age_group	    "Unknown" 
+# age	        "Unknown" (<NA> in memory, Int64)
+# age_group	    "Unknown" (NaN in memory, categorical)
 # =================================================================================
 
-def standardize_gender(df):
-    """Clean and standardize gender values"""
-    print("[LOG - STAGE 4] Running standardize_gender...")
+def standardize_gender(df, factorize_stats=None, categorical=False):
+    """Clean and standardize gender values (categorical=True keeps the column as `category`)"""
+    log("[LOG - STAGE 4] Running standardize_gender...")
     if 'gender' in df.columns:
-        # Normalize to lowercase for mapping
-        gender_norm = df['gender'].astype(str).str.strip().str.lower()
-
         # Map common variants to canonical labels
         mapping = {
             'm': 'Male', 'male': 'Male', 'man': 'Male', 'boy': 'Male',
             'f': 'Female', 'female': 'Female', 'woman': 'Female', 'girl': 'Female'
         }
-        gender_norm = gender_norm.replace(mapping)
-
-        # Anything not exactly 'Male' or 'Female' becomes Unknown (e.g., other/others/na/null/empty)
-        df['gender'] = gender_norm
-        df.loc[~df['gender'].isin(['Male', 'Female']), 'gender'] = 'Unknown'
-        print("[LOG - STAGE 4] Gender standardized (vectorized)")
+        def clean_gender(values):
+            # Normalize to lowercase for mapping
+            gender_norm = values.astype(str).str.strip().str.lower().replace(mapping)
+            # Anything not exactly 'Male' or 'Female' becomes Unknown (e.g., other/others/na/null/empty)
+            return gender_norm.where(gender_norm.isin(['Male', 'Female']), 'Unknown')
+        df['gender'] = map_unique(df['gender'], clean_gender, 'gender', factorize_stats, categorical)
+        log("[LOG - STAGE 4] Gender standardized (vectorized)")
     else:
-        print("[LOG - STAGE 4] Gender column not found, skipping")
+        log("[LOG - STAGE 4] Gender column not found, skipping")
     return df
 
 # ==================================================================================
 
-def standardize_location(df):
-    """Standardize City, and State fields"""
-    print("[LOG - STAGE 4] Running standardize_location...")
+def standardize_location(df, state_memo=None, factorize_stats=None, categorical=False):
+    """
+    Standardize City, and State fields
+    state_memo: GeocodeCache of past state-match decisions (default: the shared on-disk memo, opened and closed here;
+    a memo passed in is left open); categorical=True keeps both columns as `category`
+    """
+    log("[LOG - STAGE 4] Running standardize_location...")
         
     # Helper function: detect suspicious city names
     def is_suspicious_city(name):
@@ -259,76 +282,76 @@ def standardize_location(df):
 
     # --- City ---
     if 'city' in df.columns:
-        df['city'] = df['city'].fillna('').astype(str).str.title().str.strip()
         # Common city aliases (short forms, local spellings, etc.)
         city_alias_map = {
             "Kl": "Kuala Lumpur",
             "PJ": "Petaling Jaya",
         }
         # Apply alias replacements first
-        df['city'] = df['city'].replace(city_alias_map)
+        df['city'] = map_unique(
+            df['city'], lambda cities: cities.fillna('').astype(str).str.title().str.strip().replace(city_alias_map),
+            'city', factorize_stats, categorical,
+        )
         
-        suspicious_mask = df['city'].apply(lambda x: is_suspicious_city(x) or x.lower() in ['others', 'other'])
+        suspicious_mask = map_unique(df['city'], lambda cities: cities.map(lambda x: is_suspicious_city(x) or x.lower() in ['others', 'other']))
         suspicious_count = suspicious_mask.sum()
+        ensure_categories(df, 'city', ['Unknown'])
         df.loc[suspicious_mask, 'city'] = 'Unknown'
         
-        print(f"[LOG - STAGE 4] Standardized 'city'. Suspicious/unknown entries set to 'Unknown': {suspicious_count}")
+        log(f"[LOG - STAGE 4] Standardized 'city'. Suspicious/unknown entries set to 'Unknown': {suspicious_count}")
     else:
-        print("[LOG - STAGE 4] 'city' column not found, skipping city standardization")
+        log("[LOG - STAGE 4] 'city' column not found, skipping city standardization")
     
     # --- State ---
     if 'state' in df.columns:
-        # malaysia_states = ["Johor", "Kedah", "Kelantan", "Melaka", "Negeri Sembilan","Pahang", "Perak", "Perlis", "Pulau Pinang", "Sabah", "Sarawak", "Selangor", "Terengganu", "Kuala Lumpur", "Labuan", "Putrajaya"]
-        malaysia_states = [sub.name for sub in pycountry.subdivisions if sub.country_code == 'MY']
-        alias_map = {
-            "Kuala Lumpur": "Wilayah Persekutuan Kuala Lumpur",
-            "Kl": "Wilayah Persekutuan Kuala Lumpur",
-            "Labuan": "Wilayah Persekutuan Labuan",
-            "Putrajaya": "Wilayah Persekutuan Putrajaya"
-        }
-
-        df['state'] = df['state'].fillna('').astype(str).str.title().str.strip()
-        # Match only unique states once
-        unique_states = df['state'].unique()
-        state_map = {}
-        for s in unique_states:
-            s_clean = s.strip().title()
-
-            if not s_clean or s_clean == 'Unknown':
-                state_map[s] = 'Unknown'
-
-            elif s_clean in alias_map:   # Check alias first
-                state_map[s] = alias_map[s_clean]
-
-            else:
-                match, score = process.extractOne(s_clean, malaysia_states, scorer=fuzz.token_sort_ratio)
-                state_map[s] = match if score >= 80 else 'Unknown'
+        # Canonical names come from pycountry (get_country_subdivisions('MY')); the matcher is built once per process
+        matcher = get_state_matcher('MY')
+        owns_state_memo = state_memo is None  # opened here -> closed once the column is matched
+        if owns_state_memo:
+            state_memo = GeocodeCache(namespace=STATE_MEMO_NAMESPACE)
+        matcher.reset_stats()
+
+        def match_states(states):
+            states = states.fillna('').astype(str).str.title().str.strip()
+            # Match only unique states once (spellings can still collide after cleaning)
+            unique_states = [s for s in states.unique() if s and s != 'Unknown']
+            state_map = {s: (state or 'Unknown') for s, state in matcher.match_many(unique_states, memo=state_memo).items()}
+            state_map.update({'': 'Unknown', 'Unknown': 'Unknown'})
+            return states.map(state_map)
 
         # Apply mapping to the dataframe
-        df['state'] = df['state'].map(state_map)
-        print("[LOG - STAGE 4] State standardized (cached fuzzy matching)")
+        try:
+            df['state'] = map_unique(df['state'], match_states, 'state', factorize_stats, categorical)
+        finally:
+            if owns_state_memo:
+                state_memo.close()
+        log(f"[LOG - STAGE 4] States matched: {matcher.stats['alias']} alias, {matcher.stats['exact']} exact, "
+            f"{matcher.stats['memo']} memo, {matcher.stats['fuzzy']} fuzzy ({matcher.stats['scored']} candidates scored)")
+        log("[LOG - STAGE 4] State standardized (cached fuzzy matching)")
     else:
-        print("[LOG - STAGE 4] 'state' column not found, skipping state standardization")
+        log("[LOG - STAGE 4] 'state' column not found, skipping state standardization")
 
     return df
 
 # ============================================= (CUSTOMER DATASET) STAGE 5: MISSING VALUE HANDLING =============================================
 # Only handle for customerid and location fields
-def handle_missing_values_customer(df):
-    print("[LOG - STAGE 5] Running handle_missing_values...")
-    # moe acc geoAPI: 68f8ce9a38c3f632237334dyiedb96e
-    # siswa acc geoAPI(Currently use this): 69512949ee2fd401068815gcid6e3dd
-    API_KEY = "69512949ee2fd401068815gcid6e3dd"
-    GEOCODE_URL = "https://geocode.maps.co/search"
-    SLEEP_TIME = 1.2
+def handle_missing_values_customer(df, geo_cache=None, geocoder=None):
+    """
+    Drop rows without CustomerID and fill missing city/state.
+    City -> state lookups go: offline reference -> persistent geocode cache -> geocoding API.
+    Returns (df, stats); stats include the geocode cache hit/miss counters.
+    """
+    log("[LOG - STAGE 5] Running handle_missing_values...")
     cache = {}  # ⚡ moved outside loops
     
     stats = {
         "customerid_removed": 0,
+        "case1_offline_filled": 0,
         "case1_api_filled": 0,
         "case1_unknown_filled": 0,
         "case2_unknown_filled": 0,
-        "case3_unknown_filled": 0
+        "case3_unknown_filled": 0,
+        "geocode_cache": {"hits": 0, "negative_hits": 0, "misses": 0, "writes": 0}
     }
 
     # --- Drop rows without ID ---
@@ -337,129 +360,131 @@ def handle_missing_values_customer(df):
         df = df[df['customerid'].notna()].copy()
         rows_removed = before_drop - len(df)
         stats["customerid_removed"] = rows_removed
-        print(f"[LOG - STAGE 5] Dropped {rows_removed} rows without CustomerID")
+        log(f"[LOG - STAGE 5] Dropped {rows_removed} rows without CustomerID")
     else:
-        print("[LOG - STAGE 5] 'customerid' column missing, skipping drop")
+        log("[LOG - STAGE 5] 'customerid' column missing, skipping drop")
 
     # --- City & State handling ---
     if {'city', 'state'}.issubset(df.columns):
-        print("\n[LOG - STAGE 5] Handling missing city/state values...")
+        log("\n[LOG - STAGE 5] Handling missing city/state values...")
         # Get Malaysia and Singapore states/regions
-        malaysia_states = [sub.name for sub in pycountry.subdivisions if sub.country_code == 'MY']
-        singapore_states = [sub.name for sub in pycountry.subdivisions if sub.country_code == 'SG']
+        malaysia_states = list(get_country_subdivisions('MY'))
+        singapore_states = list(get_country_subdivisions('SG'))
         valid_states = malaysia_states + singapore_states
         cache = {}  # city -> validated state
-        SLEEP_TIME = 1.2
         
         # Case 1: missing state but city known → fill via geocoding API
-        print("\n[LOG - STAGE 5] Case 1: Filling missing state where city is known...")
+        log("\n[LOG - STAGE 5] Case 1: Filling missing state where city is known...")
         # Get rows needing state fill (city known, state unknown)
         mask_case1 = (df['city'] != 'Unknown') & (df['state'] == 'Unknown')
         cities_to_query = df.loc[mask_case1, 'city'].unique().tolist()
 
-        print(f"[LOG - STAGE 5] {len(cities_to_query)} unique cities need state lookup")
-        
-        for city in cities_to_query:
-            if city not in cache:
-                # Call API - try Malaysia first, then Singapore
-                try:
-                    resp = requests.get(GEOCODE_URL, params={"q": f"{city}, Malaysia", "api_key": API_KEY}, timeout=10)
-                    if resp.status_code == 200:
-                        data = resp.json()
-                        if isinstance(data, list) and data:
-                            state_name = data[0].get("address", {}).get("state")
-                            if state_name and state_name in valid_states:
-                                cache[city] = state_name
-                            else:
-                                # Try Singapore
-                                cache[city] = None
-                        else:
-                            cache[city] = None
-                    else:
-                        cache[city] = None
-                    time.sleep(SLEEP_TIME)
-                except Exception as e:
-                    print(f"[WARN - STAGE 5] Failed to get state for city '{city}': {e}")
-                    cache[city] = None
-
-                # Try Singapore if Malaysia query failed
-                if cache.get(city) is None:
-                    try:
-                        resp = requests.get(GEOCODE_URL, params={"q": f"{city}, Singapore", "api_key": API_KEY}, timeout=10)
-                        if resp.status_code == 200:
-                            data = resp.json()
-                            if isinstance(data, list) and data:
-                                state_name = data[0].get("address", {}).get("state")
-                                if state_name and state_name in valid_states:
-                                    cache[city] = state_name
-                                else:
-                                    cache[city] = None
-                            else:
-                                cache[city] = None
-                        else:
-                            cache[city] = None
-                        time.sleep(SLEEP_TIME)
-                    except Exception as e:
-                        print(f"[WARN - STAGE 5] Failed to get state for city '{city}' in Singapore: {e}")
-                        cache[city] = None
-
-            # Fill values
-            fill_state = cache.get(city)
-            if fill_state:
-                filled_count = ((df['city'] == city) & (df['state'] == 'Unknown')).sum()
-                df.loc[(df['city'] == city) & (df['state'] == 'Unknown'), 'state'] = fill_state
-                stats["case1_api_filled"] += filled_count
-                print(f"[TRACE - STAGE 5] Filled {filled_count} → {city} → state='{fill_state}' (API valid)")
-            else:
-                # Fallback: use mode state & mode city for that state
-                # The API fails to find the city || The response doesn’t contain a valid "state" field || Or the returned "state" isn’t in the official Malaysia subdivision list.
-                valid_states = df[df['state'] != 'Unknown']['state']
-                mode_state = valid_states.mode()[0] if not valid_states.empty else 'Unknown'
-
-                # Compute mode city per state
-                mode_city_per_state = (
-                    df[df['city'] != 'Unknown'].groupby('state')['city']
-                    .agg(lambda x: x.mode().iloc[0] if not x.mode().empty else 'Unknown')
-                    .to_dict()
-                )
-                mode_city = mode_city_per_state.get(mode_state, 'Unknown')
+        log(f"[LOG - STAGE 5] {len(cities_to_query)} unique cities need state lookup")
 
-                mask_fill = (df['city'] == city) & (df['state'] == 'Unknown')
-                filled_count = mask_fill.sum()
-                df.loc[mask_fill, 'state'] = mode_state
-                df.loc[mask_fill, 'city'] = mode_city
-                stats["case1_unknown_filled"] += filled_count
-                print(f"[TRACE - STAGE 5] Filled {filled_count} row(s) → city='{city}' → state='Unknown' (API invalid)")
+        # Offline lookup first (MYCitiesWithState.json); only the misses go to the geocoding API
+        city_index = get_city_state_index()
+        offline_cities = set()
+        for city in cities_to_query:
+            offline_state = city_index.lookup(city)
+            if offline_state:
+                cache[city] = offline_state
+                offline_cities.add(city)
+        log(f"[LOG - STAGE 5] {len(offline_cities)} cities resolved offline, {len(cities_to_query) - len(offline_cities)} need API lookup")
+
+        # Persistent cache next (shared across runs/tenants); negative answers skip the API too
+        remaining = [city for city in cities_to_query if city not in cache]
+        owns_geo_cache = bool(remaining) and geo_cache is None  # opened here -> closed at the end of the lookup
+        if owns_geo_cache:
+            geo_cache = GeocodeCache()
+        try:
+            if remaining:
+                for city in remaining:
+                    found, cached_state = geo_cache.get(normalize_city_key(city))
+                    if found:
+                        cache[city] = cached_state
+                stats["geocode_cache"] = geo_cache.stats()
+                log(f"[LOG - STAGE 5] Geocode cache: {stats['geocode_cache']['hits']} hits, "
+                      f"{stats['geocode_cache']['negative_hits']} negative hits, {stats['geocode_cache']['misses']} misses")
+        
+            # Geocoding API last, only for what is still unresolved (concurrent + rate limited)
+            to_query = [city for city in cities_to_query if city not in cache]
+            if to_query:
+                if geocoder is None:
+                    geocoder = GeocodingClient()
+                log(f"[LOG - STAGE 5] Querying geocoding API for {len(to_query)} cities "
+                      f"({geocoder.bucket.rate:g} req/s, {geocoder.max_workers} workers)")
+                progress = get_progress()
+                on_resolved = lambda done, total: progress.update(rows=done, total=total)
+                for city, (state_name, definitive) in geocoder.resolve_cities(to_query, valid_states, on_resolved).items():
+                    cache[city] = state_name
+                    # Only definitive answers are written to the persistent cache
+                    if definitive or state_name:
+                        geo_cache.set(normalize_city_key(city), state_name)
+                stats["geocode_cache"] = geo_cache.stats()
+                log(f"[LOG - STAGE 5] Geocoding API done: {geocoder.requests_sent} requests sent")
+        finally:
+            if owns_geo_cache:
+                geo_cache.close()
+
+        # Fill values: one vectorized map over the Case 1 rows instead of a mask per city
+        resolved = {city: state for city, state in cache.items() if state}
+        case1_cities = df.loc[mask_case1, 'city']
+        fill_states = case1_cities.map(resolved)
+        filled = fill_states.notna()
+        ensure_categories(df, 'state', resolved.values())
+        df.loc[fill_states.index[filled], 'state'] = fill_states[filled]
+        from_offline = case1_cities[filled].isin(offline_cities)
+        stats["case1_offline_filled"] = int(from_offline.sum())
+        stats["case1_api_filled"] = int((~from_offline).sum())
+        log(f"[TRACE - STAGE 5] Filled {stats['case1_offline_filled']} row(s) from the offline reference, "
+              f"{stats['case1_api_filled']} row(s) from geocoding (cache/API)")
+
+        # Fallback for the rest: mode state & mode city for that state, computed once after the fills above
+        # The API fails to find the city || The response doesn’t contain a valid "state" field || Or the returned "state" isn’t in the official Malaysia subdivision list.
+        unresolved_index = fill_states.index[~filled]
+        if len(unresolved_index) > 0:
+            known_states = df.loc[df['state'] != 'Unknown', 'state']
+            mode_state = known_states.mode()[0] if not known_states.empty else 'Unknown'
+            mode_state_cities = df.loc[(df['state'] == mode_state) & (df['city'] != 'Unknown'), 'city'].mode()
+            mode_city = mode_state_cities.iloc[0] if not mode_state_cities.empty else 'Unknown'
+
+            ensure_categories(df, 'state', [mode_state])
+            ensure_categories(df, 'city', [mode_city])
+            df.loc[unresolved_index, 'state'] = mode_state
+            df.loc[unresolved_index, 'city'] = mode_city
+            stats["case1_unknown_filled"] = int(len(unresolved_index))
+            log(f"[TRACE - STAGE 5] Filled {len(unresolved_index)} row(s) from {case1_cities[~filled].nunique()} unresolved "
+                  f"cities → city='{mode_city}', state='{mode_state}' (mode fallback)")
 
         # Case 2: missing city but state known → fill with Unknown
-        print("\n[LOG - STAGE 5] Case 2: Filling missing city where state is known...")
+        log("\n[LOG - STAGE 5] Case 2: Filling missing city where state is known...")
         mask_case2 = (df['city'] == 'Unknown') & (df['state'] != 'Unknown')
         if mask_case2.any():
             filled_count = mask_case2.sum()
             df.loc[mask_case2, 'city'] = 'Unknown'
             stats["case2_unknown_filled"] = filled_count
-            print(f"[TRACE - STAGE 5] Filled {filled_count} row(s) → missing city → city='Unknown'")
+            log(f"[TRACE - STAGE 5] Filled {filled_count} row(s) → missing city → city='Unknown'")
 
         # Case 3: both missing → fill with Unknown
-        print("\n[LOG - STAGE 5] Case 3: Filling missing city and state...")
+        log("\n[LOG - STAGE 5] Case 3: Filling missing city and state...")
         mask_case3 = (df['city'] == 'Unknown') & (df['state'] == 'Unknown')
         if mask_case3.any():
             filled_count = mask_case3.sum()
             df.loc[mask_case3, ['city', 'state']] = 'Unknown'
             stats["case3_unknown_filled"] = filled_count
-            print(f"[TRACE - STAGE 5] Filled {filled_count} row(s) → missing city/state → city='Unknown', state='Unknown'")
-    return df
+            log(f"[TRACE - STAGE 5] Filled {filled_count} row(s) → missing city/state → city='Unknown', state='Unknown'")
+    return df, stats
 
 # ============================================= (CUSTOMER DATASET) STAGE 6: OUTLIER DETECTION =============================================
 def customer_detect_outliers(df):
     """Adaptive outlier detection (flag instead of replace)."""
-    print("[LOG - STAGE 6] Running detect_outliers...")
+    log("[LOG - STAGE 6] Running detect_outliers...")
     message = None
     if 'age' in df.columns:
         # Work on a temporary numeric copy to avoid mutating the displayed 'age' values (keep 'Unknown' text)
         age_num = pd.to_numeric(df['age'], errors='coerce')
         n = len(df)
-        print(f"[LOG - STAGE 6] Dataset has {n} rows")
+        log(f"[LOG - STAGE 6] Dataset has {n} rows")
 
         # Initialize flag column
         df['is_age_outlier'] = False
@@ -478,7 +503,7 @@ def customer_detect_outliers(df):
             df.loc[outlier_mask, 'is_age_outlier'] = True
             outlier_count = outlier_mask.sum()
 
-            print(f"[LOG - STAGE 6] IQR Applied for {n} rows. Range: [{lower_bound:.1f}, {upper_bound:.1f}] "
+            log(f"[LOG - STAGE 6] IQR Applied for {n} rows. Range: [{lower_bound:.1f}, {upper_bound:.1f}] "
                   f"Outliers flagged: {outlier_count}")
             
             if outlier_count > 0:
@@ -508,7 +533,7 @@ def customer_detect_outliers(df):
             df.loc[outlier_mask, 'is_age_outlier'] = True
             outlier_count = outlier_mask.sum()
 
-            print(f"[LOG - STAGE 6] Percentile method applied for {n} rows. Range: [{lower_bound:.1f}, {upper_bound:.1f}] "
+            log(f"[LOG - STAGE 6] Percentile method applied for {n} rows. Range: [{lower_bound:.1f}, {upper_bound:.1f}] "
                   f"Outliers flagged: {outlier_count}")
             
             if outlier_count > 0:
@@ -529,13 +554,13 @@ def customer_detect_outliers(df):
                 )
 
     else:
-        print("[LOG - STAGE 6] 'age' column missing, skipping outlier detection")
+        log("[LOG - STAGE 6] 'age' column missing, skipping outlier detection")
         message = "Age information was not provided, so age-based checks were skipped."
 
     return df, message
 
 # ============================================= (CUSTOMER DATASET) DATASET CLEANING PIPELINE =============================================
-def clean_customer_dataset(df, cleaned_output_path):
+def clean_customer_dataset(df, cleaned_output_path, profiler=None, categorical=False, keep_unknown_columns=False):
     """
     Main cleaning pipeline for customer dataset.
     Executes all stages in proper order:
@@ -547,8 +572,15 @@ def clean_customer_dataset(df, cleaned_output_path):
     5. Outlier Detection
     6. Deduplication
     Finally, saves the cleaned dataset to the specified path and returns it.
+    profiler (StageProfiler) times each stage; the numbers go to report["performance"].
+    categorical=True turns gender / city / state into `category` columns as soon as they are standardized,
+    so STAGE 5 compares and fills integer codes instead of strings (age group is categorical either way).
+    Columns outside CUSTOMER_SCHEMA are dropped after STAGE 2 (listed in report["summary"]["dropped_unknown_columns"])
+    unless keep_unknown_columns is set.
     """
-    print(">>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Starting customer data cleaning pipeline...>>>>>>>>>>>>>>>>>>>>>>>>>\n", flush=True)
+    if profiler is None:
+        profiler = StageProfiler()
+    log(">>>>>>>>>>>>>>>>>>>>>>>>>>>>>> Starting customer data cleaning pipeline...>>>>>>>>>>>>>>>>>>>>>>>>>\n", "info")
     messages = [] 
     report = {"summary": {}, "detailed_messages": {}}
     
@@ -559,14 +591,17 @@ def clean_customer_dataset(df, cleaned_output_path):
     # =======================================================
     # STAGE 0: NORMALIZE COLUMN NAMES (FROM GENERIC FUNCTION)
     # =======================================================
-    print("=============== [STAGE 0 START] Normalize Column Names ===============")
+    log("=============== [STAGE 0 START] Normalize Column Names ===============", "info")
+    profiler.start("STAGE 0 Normalize Column Names", rows_in=len(df))
     df = normalize_columns_name(df)
-    print("✅ [STAGE 0 COMPLETE] Column names normalized.\n")
+    profiler.end(rows_out=len(df))
+    log("✅ [STAGE 0 COMPLETE] Column names normalized.\n", "info")
 
     # =============================================
     # STAGE 1: SCHEMA & COLUMN VALIDATION
     # =============================================
-    print("=============== [STAGE 1 START] Schema & Column Validation ===============")
+    log("=============== [STAGE 1 START] Schema & Column Validation ===============", "info")
+    profiler.start("STAGE 1 Schema & Column Validation", rows_in=len(df))
     df, optional_msg = customer_check_optional_columns(df)
     messages.append(optional_msg)
     report["detailed_messages"]["customer_check_optional_columns"] = optional_msg
@@ -577,49 +612,67 @@ def clean_customer_dataset(df, cleaned_output_path):
     messages.append(mandatory_msg)
     report["detailed_messages"]["check_mandatory_columns"] = mandatory_msg
     
-    print(optional_msg)
-    print(mandatory_msg)
-    print("✅ [STAGE 1 COMPLETE] Schema validation done.\n")
+    profiler.end(rows_out=len(df))
+    log(optional_msg, "info")
+    log(mandatory_msg, "info")
+    log("✅ [STAGE 1 COMPLETE] Schema validation done.\n", "info")
 
     # ============================================================
     # STAGE 2: REMOVE DUPLICATE ENTRY ROWS (FROM GENERIC FUNCTION)
     # ============================================================
-    print("========== [STAGE 2 START] Remove Duplicate Entry Rows ==========")
+    log("========== [STAGE 2 START] Remove Duplicate Entry Rows ==========", "info")
+    profiler.start("STAGE 2 Remove Duplicate Entry Rows", rows_in=len(df))
     initial_rows = len(df)
     df = remove_duplicate_entries(df)
     report["summary"]["duplicates_removed_rows"] = initial_rows - len(df)
-    print("✅ [STAGE 2 COMPLETE] Duplicate entries removed.\n")
+    if not keep_unknown_columns:
+        df, dropped_columns, dropped_msg = drop_unknown_columns(df, CUSTOMER_SCHEMA)
+        messages.append(dropped_msg)
+        report["summary"]["dropped_unknown_columns"] = dropped_columns
+        report["detailed_messages"]["drop_unknown_columns"] = dropped_msg
+    profiler.end(rows_out=len(df))
+    log("✅ [STAGE 2 COMPLETE] Duplicate entries removed.\n", "info")
 
     # =============================================
     # STAGE 3: DEDUPLICATION
     # =============================================
-    print("========== [STAGE 3 START] Deduplication ==========")
+    log("========== [STAGE 3 START] Deduplication ==========", "info")
+    profiler.start("STAGE 3 Deduplication", rows_in=len(df))
     df, message = deduplicate_customers(df)
     messages.append(message)
     report["summary"]["rows_after_deduplication"] = len(df)
-    print("✅ [STAGE 3 COMPLETE] Duplicate CustomerIDs deduplicated.\n")
+    profiler.end(rows_out=len(df))
+    log("✅ [STAGE 3 COMPLETE] Duplicate CustomerIDs deduplicated.\n", "info")
 
     # =============================================
     # STAGE 4: STANDARDIZATION & NORMALIZATION
     # =============================================
-    print("========== [STAGE 4 START] Standardization & Normalization ==========")
-    df = standardize_customer_id(df)
-    df, dob_msg = standardize_dob(df)
+    log("========== [STAGE 4 START] Standardization & Normalization ==========", "info")
+    profiler.start("STAGE 4 Standardization & Normalization", rows_in=len(df))
+    factorize_stats = report["summary"]["factorized_columns"] = {}
+    df = standardize_customer_id(df, factorize_stats)
+    df, dob_msg, dob_stats = standardize_dob(df)
     messages.append(dob_msg)
     report["detailed_messages"]["standardize_dob"] = dob_msg
+    report["summary"]["dob_formats"] = dob_stats
     df = derive_age_features(df)
     df = derive_age_group(df)
     df = drop_dob_after_age_derived(df)
-    df = standardize_gender(df)
-    df = standardize_location(df)
-    print("✅ [STAGE 4 COMPLETE] Standardization and normalization finished.\n")
+    df = standardize_gender(df, factorize_stats, categorical)
+    df = standardize_location(df, factorize_stats=factorize_stats, categorical=categorical)
+    profiler.end(rows_out=len(df))
+    log("✅ [STAGE 4 COMPLETE] Standardization and normalization finished.\n", "info")
     
     # =============================================
     # STAGE 5: MISSING VALUE HANDLING
     # =============================================
-    print("========== [STAGE 5 START] Missing Value Handling ==========")
-    df = handle_missing_values_customer(df)
-    print("✅ [STAGE 5 COMPLETE] Missing values handled.\n")
+    log("========== [STAGE 5 START] Missing Value Handling ==========", "info")
+    profiler.start("STAGE 5 Missing Value Handling", rows_in=len(df))
+    df, missing_value_stats = handle_missing_values_customer(df)
+    report["summary"]["geocode_cache_hits"] = missing_value_stats["geocode_cache"]["hits"] + missing_value_stats["geocode_cache"]["negative_hits"]
+    report["summary"]["geocode_cache_misses"] = missing_value_stats["geocode_cache"]["misses"]
+    profiler.end(rows_out=len(df))
+    log("✅ [STAGE 5 COMPLETE] Missing values handled.\n", "info")
 
     # =============================================
     # STAGE 6: OUTLIER DETECTION (Not Implement)
@@ -639,10 +692,13 @@ def clean_customer_dataset(df, cleaned_output_path):
     # =============================================
     # SAVE CLEANED DATASET
     # =============================================
-    print("========== [FINAL STAGE START] Save Cleaned Dataset ==========")
-    df.to_csv(cleaned_output_path, index=False)
-    print(f"✅ [FINAL STAGE COMPLETE] Cleaned dataset saved at: {cleaned_output_path}\n")
-    print("==========================================================")
-    print("🎉 Data cleaning pipeline completed successfully!\n")
+    log("========== [FINAL STAGE START] Save Cleaned Dataset ==========", "info")
+    profiler.start("FINAL STAGE Save Cleaned Dataset", rows_in=len(df))
+    write_dataset(df, cleaned_output_path, unknown_columns=UNKNOWN_ON_SAVE_COLUMNS)
+    profiler.end(rows_out=len(df))
+    log(f"✅ [FINAL STAGE COMPLETE] Cleaned dataset saved at: {cleaned_output_path}\n", "info")
+    log("==========================================================", "info")
+    log("🎉 Data cleaning pipeline completed successfully!\n", "info")
+    report["performance"] = profiler.summary()
     
     return df, report # the messages can modify later if needed (now only handle neccessary part), but no return for now, we try return report first
\ No newline at end of file
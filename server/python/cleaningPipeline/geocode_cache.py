@@ -0,0 +1,132 @@
+# Persistent geocoding cache (city -> state, plus the STAGE 4 state-match memo) shared by every cleaning run / tenant on this machine
+import os
+import sqlite3
+import time
+
+from common_utils import log
+
+DEFAULT_CACHE_PATH = os.environ.get(
+    "SEGMA_GEOCODE_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "temp", "geocode_cache.sqlite3"),
+)
+DEFAULT_TTL_DAYS = 90           # positive answers (city found in a valid state)
+DEFAULT_NEGATIVE_TTL_DAYS = 7   # "not found" answers, retried sooner
+DEFAULT_MAX_ENTRIES = 50000     # LRU cap per database
+TOUCH_INTERVAL_SECONDS = 3600   # last_access is refreshed at most hourly to keep reads cheap
+
+class GeocodeCache:
+    """
+    SQLite-backed key/value cache with TTL, negative-result caching and LRU eviction.
+    WAL mode + busy timeout make it safe for several cleaning processes at once.
+    A value of None means "looked up, nothing valid found" (negative entry).
+    Falls back to an in-memory database if the file cannot be opened.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, namespace="city_state", ttl_days=DEFAULT_TTL_DAYS,
+                 negative_ttl_days=DEFAULT_NEGATIVE_TTL_DAYS, max_entries=DEFAULT_MAX_ENTRIES):
+        self.namespace = namespace
+        self.ttl = ttl_days * 86400
+        self.negative_ttl = negative_ttl_days * 86400
+        self.max_entries = max_entries
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.writes = 0
+        try:
+            if path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.conn = self._connect(path)
+            self.path = path
+        except (OSError, sqlite3.Error) as e:
+            log(f"[WARN - STAGE 5] Geocode cache unavailable at '{path}' ({e}); using in-memory cache", "warn")
+            self.conn = self._connect(":memory:")
+            self.path = ":memory:"
+
+    @staticmethod
+    def _connect(path):
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        if path != ":memory:":
+            conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT,"
+            " created_at REAL NOT NULL, last_access REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_lru ON cache (namespace, last_access)")
+        return conn
+
+    def get(self, key):
+        """Return (found, value). Expired entries count as misses."""
+        now = time.time()
+        row = self.conn.execute(
+            "SELECT value, created_at, last_access FROM cache WHERE namespace = ? AND key = ?",
+            (self.namespace, key),
+        ).fetchone()
+        if row is not None:
+            value, created_at, last_access = row
+            ttl = self.ttl if value is not None else self.negative_ttl
+            if now - created_at <= ttl:
+                if now - last_access > TOUCH_INTERVAL_SECONDS:
+                    self.conn.execute(
+                        "UPDATE cache SET last_access = ? WHERE namespace = ? AND key = ?",
+                        (now, self.namespace, key),
+                    )
+                if value is None:
+                    self.negative_hits += 1
+                else:
+                    self.hits += 1
+                return True, value
+        self.misses += 1
+        return False, None
+
+    def set(self, key, value):
+        """Store a positive (str) or negative (None) answer, then enforce the LRU cap"""
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+            (self.namespace, key, value, now, now),
+        )
+        self.writes += 1
+        self._evict()
+
+    def set_many(self, items):
+        """Store several (key, value) answers in one transaction, then enforce the LRU cap once"""
+        now = time.time()
+        rows = [(self.namespace, key, value, now, now) for key, value in items]
+        if not rows:
+            return
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self.conn.execute("COMMIT")
+        except sqlite3.Error:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.writes += len(rows)
+        self._evict()
+
+    def _evict(self):
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)).fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self.conn.execute(
+                "DELETE FROM cache WHERE rowid IN ("
+                " SELECT rowid FROM cache WHERE namespace = ? ORDER BY last_access ASC LIMIT ?)",
+                (self.namespace, overflow),
+            )
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "writes": self.writes,
+        }
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,139 @@
+# Geocoding client for STAGE 5 (city -> state): concurrent, rate limited, with retries
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from common_utils import log
+
+# moe acc geoAPI: 68f8ce9a38c3f632237334dyiedb96e
+# siswa acc geoAPI(Currently use this): 69512949ee2fd401068815gcid6e3dd
+API_KEY = os.environ.get("SEGMA_GEOCODE_API_KEY", "69512949ee2fd401068815gcid6e3dd")
+# Point at a local stub server for testing, e.g. http://127.0.0.1:8765/search
+GEOCODE_URL = os.environ.get("SEGMA_GEOCODE_URL", "https://geocode.maps.co/search")
+# Request budget shared by all threads (replaces the old fixed SLEEP_TIME = 1.2 between calls)
+DEFAULT_REQUESTS_PER_SECOND = float(os.environ.get("SEGMA_GEOCODE_RPS", "1.0"))
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_SECONDS = 0.5
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+COUNTRIES = ["Malaysia", "Singapore"]
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts up to `capacity`"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class GeocodingClient:
+    """
+    Resolves cities to states through the geocoding API.
+    - All requests share one token bucket (requests_per_second)
+    - Retries on network errors / 429 / 5xx with exponential backoff (Retry-After honoured)
+    - The Malaysia and Singapore queries for a city run in parallel; Malaysia wins if both are valid
+    Results are (state or None, definitive); definitive=False means the API never gave a usable answer.
+    """
+
+    def __init__(self, base_url=GEOCODE_URL, api_key=API_KEY, requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+                 max_workers=DEFAULT_MAX_WORKERS, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_seconds=DEFAULT_BACKOFF_SECONDS, timeout=10, countries=COUNTRIES):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.bucket = TokenBucket(requests_per_second, capacity=max(1, int(requests_per_second)))
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+        self.countries = list(countries)
+        self.requests_sent = 0
+        self._local = threading.local()
+        self._count_lock = threading.Lock()
+
+    def _session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def query_state(self, query):
+        """One geocoding query with retries. Returns (state name or None, definitive)"""
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            with self._count_lock:
+                self.requests_sent += 1
+            delay = self.backoff_seconds * (2 ** attempt) * (1 + random.random() * 0.25)
+            try:
+                resp = self._session().get(self.base_url, params={"q": query, "api_key": self.api_key}, timeout=self.timeout)
+            except requests.RequestException as e:
+                log(f"[WARN - STAGE 5] Geocoding '{query}' failed (attempt {attempt + 1}): {e}", "warn")
+                time.sleep(delay)
+                continue
+            if resp.status_code == 200:
+                try:
+                    data = resp.json()
+                    if isinstance(data, list) and data:
+                        state = data[0].get("address", {}).get("state")
+                        return (state if isinstance(state, str) else None), True
+                    return None, True
+                except (ValueError, AttributeError) as e:
+                    # Non-JSON body or unexpected shape: not a definitive "not found", just this city unresolved
+                    log(f"[WARN - STAGE 5] Geocoding '{query}' returned an unreadable response: {e}", "warn")
+                    return None, False
+            if resp.status_code in RETRY_STATUS_CODES:
+                retry_after = resp.headers.get("Retry-After")
+                if retry_after and retry_after.isdigit():
+                    delay = max(delay, float(retry_after))
+                time.sleep(delay)
+                continue
+            return None, False
+        return None, False
+
+    def resolve_city(self, city, valid_states, pool=None):
+        """Query every country for one city (in parallel when a pool is given)"""
+        queries = [f"{city}, {country}" for country in self.countries]
+        if pool is not None:
+            answers = list(pool.map(self.query_state, queries))
+        else:
+            answers = [self.query_state(q) for q in queries]
+        definitive = True
+        for state_name, ok in answers:
+            if state_name and state_name in valid_states:
+                return state_name, True
+            definitive = definitive and ok
+        return None, definitive
+
+    def resolve_cities(self, cities, valid_states, on_resolved=None):
+        """
+        Resolve many cities concurrently. Returns {city: (state or None, definitive)}
+        on_resolved(done, total) is called after each city (in input order), e.g. for progress events.
+        """
+        if not cities:
+            return {}
+        resolved = {}
+        # Inner pool runs the per-country queries; outer pool spreads the cities
+        with ThreadPoolExecutor(max_workers=self.max_workers * len(self.countries)) as query_pool, \
+                ThreadPoolExecutor(max_workers=self.max_workers) as city_pool:
+            results = city_pool.map(lambda c: self.resolve_city(c, valid_states, query_pool), cities)
+            for city, result in zip(cities, results):
+                resolved[city] = result
+                if on_resolved is not None:
+                    on_resolved(len(resolved), len(cities))
+        return resolved
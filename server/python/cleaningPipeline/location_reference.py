@@ -0,0 +1,242 @@
+# Offline location reference data for the customer pipeline (STAGE 4 state matching, STAGE 5 city -> state lookup)
+import json
+import os
+import re
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+from fuzzywuzzy import fuzz, utils
+
+from common_utils import get_country_subdivisions
+
+CITIES_WITH_STATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dataCleaning", "MYCitiesWithState.json")
+
+# State names used in MYCitiesWithState.json / common spellings -> pycountry subdivision names
+STATE_NAME_ALIASES = {
+    "Penang": "Pulau Pinang",
+    "Kuala Lumpur": "Wilayah Persekutuan Kuala Lumpur",
+    "Labuan": "Wilayah Persekutuan Labuan",
+    "Putrajaya": "Wilayah Persekutuan Putrajaya",
+}
+
+# Cities missing from the JSON (Selangor / federal territories) or listed under more than one
+# state there; these win over the JSON entries
+CITY_STATE_OVERRIDES = {
+    "Kuala Lumpur": "Wilayah Persekutuan Kuala Lumpur",
+    "Putrajaya": "Wilayah Persekutuan Putrajaya",
+    "Labuan": "Wilayah Persekutuan Labuan",
+    "Shah Alam": "Selangor",
+    "Petaling Jaya": "Selangor",
+    "Subang Jaya": "Selangor",
+    "Klang": "Selangor",
+    "Kajang": "Selangor",
+    "Cyberjaya": "Selangor",
+    "Puchong": "Selangor",
+    "Rawang": "Selangor",
+    "Selayang": "Selangor",
+    "Sepang": "Selangor",
+    "Bangi": "Selangor",
+    "Seri Kembangan": "Selangor",
+    "Johor Bahru": "Johor",
+    "Ipoh": "Perak",
+    "Georgetown": "Pulau Pinang",
+    "Seberang Perai": "Pulau Pinang",
+    "Kota Kinabalu": "Sabah",
+    "Melaka": "Melaka",
+    "Kangar": "Perlis",
+    "Kuantan": "Pahang",
+    "Sungai Lembing": "Pahang",
+    "Gua Musang": "Kelantan",
+    "Pasir Puteh": "Kelantan",
+    "Sipitang": "Sabah",
+}
+
+# Free-text state spellings resolved before fuzzy matching (compared after .title())
+STATE_INPUT_ALIASES = {
+    "Kuala Lumpur": "Wilayah Persekutuan Kuala Lumpur",
+    "Kl": "Wilayah Persekutuan Kuala Lumpur",
+    "Labuan": "Wilayah Persekutuan Labuan",
+    "Putrajaya": "Wilayah Persekutuan Putrajaya",
+}
+
+STATE_MATCH_THRESHOLD = 80           # minimum fuzz.token_sort_ratio for a fuzzy state match
+STATE_MATCH_NGRAM = 2                # character n-gram size used for candidate blocking
+STATE_MEMO_NAMESPACE = "state_match" # GeocodeCache namespace of past raw -> canonical decisions
+
+# Local abbreviations expanded before matching ("Kg Baru" == "Kampung Baru")
+TOKEN_ALIASES = {
+    "kg": "kampung", "kpg": "kampung",
+    "sg": "sungai", "sungei": "sungai",
+    "bt": "batu",
+    "tg": "tanjung", "tanjong": "tanjung",
+    "bdr": "bandar",
+    "tmn": "taman",
+    "pt": "parit",
+    "bkt": "bukit",
+    "jln": "jalan",
+    "ayer": "air",
+}
+
+def normalize_city_key(name):
+    """Lowercase, punctuation -> space, collapse spaces, expand local abbreviations"""
+    if name is None:
+        return ""
+    tokens = re.sub(r"[^a-z0-9]+", " ", str(name).lower()).split()
+    return " ".join(TOKEN_ALIASES.get(t, t) for t in tokens)
+
+class CityStateIndex:
+    """
+    In-memory inverted index city -> state built from MYCitiesWithState.json.
+    Keys are normalized (see normalize_city_key); a city listed under several states is
+    treated as ambiguous and not resolved offline unless it has an override.
+    """
+
+    def __init__(self, state_to_cities, overrides=None, valid_states=None):
+        valid = set(valid_states) if valid_states is not None else None
+        index = {}
+        ambiguous = set()
+        for state, cities in state_to_cities.items():
+            canonical = STATE_NAME_ALIASES.get(state, state)
+            if valid is not None and canonical not in valid:
+                continue
+            for city in cities:
+                key = normalize_city_key(city)
+                if not key:
+                    continue
+                if key in index and index[key] != canonical:
+                    ambiguous.add(key)
+                index.setdefault(key, canonical)
+        for key in ambiguous:
+            index.pop(key, None)
+        for city, state in (overrides or {}).items():
+            key = normalize_city_key(city)
+            index[key] = state
+            ambiguous.discard(key)
+        self._index = index
+        self.ambiguous = ambiguous
+
+    def __len__(self):
+        return len(self._index)
+
+    def lookup(self, city):
+        """Return the canonical state for a city, or None when unknown/ambiguous"""
+        return self._index.get(normalize_city_key(city))
+
+@lru_cache(maxsize=None)
+def get_city_state_index(path=CITIES_WITH_STATE_PATH):
+    """Load the city -> state index once per process (empty index if the file is missing)"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            state_to_cities = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[WARN - STAGE 5] City reference file unavailable ({e}); offline lookup disabled")
+        state_to_cities = {}
+    valid_states = get_country_subdivisions('MY') + get_country_subdivisions('SG')
+    return CityStateIndex(state_to_cities, overrides=CITY_STATE_OVERRIDES, valid_states=valid_states)
+
+# ============================================ STATE MATCHING ============================================ #
+
+def state_match_key(name):
+    """The form process.extractOne(..., scorer=fuzz.token_sort_ratio) compares: alphanumeric, lowercase, ascii, tokens sorted"""
+    processed = utils.full_process(utils.full_process(str(name)), force_ascii=True)
+    return " ".join(sorted(processed.split()))
+
+def char_ngrams(text, n=STATE_MATCH_NGRAM):
+    padded = f" {text} "
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+class StateMatcher:
+    """
+    Index over the canonical state names that gives the same answer as
+        process.extractOne(value, states, scorer=fuzz.token_sort_ratio) with score >= threshold
+    without scoring every state for every value:
+    - alias / exact token-sorted hits are dictionary lookups
+    - character n-gram blocking picks the states sharing at least one n-gram with the value
+    - a state is only scored if its shared character counts can still reach the threshold
+      (and beat the best score so far)
+    match_many() also consults a persistent memo (GeocodeCache, STATE_MEMO_NAMESPACE) for values
+    that needed fuzzy scoring in earlier runs.
+    """
+
+    def __init__(self, states, aliases=None, threshold=STATE_MATCH_THRESHOLD):
+        self.states = list(states)
+        self.aliases = dict(aliases or {})
+        self.threshold = threshold
+        self._keys = [state_match_key(state) for state in self.states]
+        self._counts = [Counter(key) for key in self._keys]
+        self._exact = {}
+        for state, key in zip(self.states, self._keys):
+            self._exact.setdefault(key, state)  # first state wins a tie, as in extractOne
+        self._blocks = defaultdict(set)
+        for i, key in enumerate(self._keys):
+            for gram in char_ngrams(key):
+                self._blocks[gram].add(i)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {"alias": 0, "exact": 0, "memo": 0, "fuzzy": 0, "scored": 0}
+
+    def score(self, key):
+        """Best canonical state for a state_match_key (None below the threshold)"""
+        if not key:
+            return None
+        counts = Counter(key)
+        candidates = sorted(set().union(*(self._blocks.get(gram, ()) for gram in char_ngrams(key))))
+        best, best_score = None, -1
+        for i in candidates:
+            other = self._keys[i]
+            # Matching characters can never exceed the shared character counts -> upper bound on the ratio
+            shared = sum((counts & self._counts[i]).values())
+            bound = utils.intr(200 * shared / (len(key) + len(other)))
+            if bound < self.threshold or bound <= best_score:
+                continue
+            self.stats["scored"] += 1
+            score = fuzz.ratio(key, other)
+            if score > best_score:
+                best, best_score = self.states[i], score
+        return best if best_score >= self.threshold else None
+
+    def match(self, value):
+        """Canonical state for one raw (stripped, title-cased) value, None when nothing matches"""
+        return self.match_many([value])[value]
+
+    def match_many(self, values, memo=None):
+        """
+        {raw value: canonical state or None} for distinct raw values.
+        `memo` is an optional GeocodeCache; fuzzy decisions are read from and written back to it.
+        """
+        result = {}
+        pending = defaultdict(list)  # state_match_key -> raw values that need fuzzy matching
+        for value in values:
+            if value in self.aliases:
+                result[value] = self.aliases[value]
+                self.stats["alias"] += 1
+                continue
+            key = state_match_key(value)
+            if key in self._exact:
+                result[value] = self._exact[key]
+                self.stats["exact"] += 1
+            else:
+                pending[key].append(value)
+
+        decided = []
+        valid = set(self.states)
+        for key, raws in pending.items():
+            found, state = memo.get(key) if memo is not None and key else (False, None)
+            if found and (state is None or state in valid):
+                self.stats["memo"] += 1
+            else:
+                state = self.score(key)
+                self.stats["fuzzy"] += 1
+                if key:
+                    decided.append((key, state))
+            for raw in raws:
+                result[raw] = state
+        if memo is not None and decided:
+            memo.set_many(decided)
+        return result
+
+@lru_cache(maxsize=None)
+def get_state_matcher(country_code='MY'):
+    """StateMatcher over a country's pycountry subdivisions, built once per process"""
+    return StateMatcher(get_country_subdivisions(country_code), aliases=STATE_INPUT_ALIASES)
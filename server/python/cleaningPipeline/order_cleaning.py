@@ -1,10 +1,40 @@
 # Step 1: Import libraries
-from common_utils import normalize_columns_name, check_mandatory_columns, remove_duplicate_entries, standardize_customer_id;
+from common_utils import normalize_columns_name, check_mandatory_columns, remove_duplicate_entries, drop_unknown_columns, standardize_customer_id, map_unique, parse_numeric_text, parse_datetimes, guess_date_formats, write_dataset, DatasetWriter, load_dataset, DATE_FORMAT_SAMPLE_SIZE, log;
 import pandas as pd
 import numpy as np
+from stage_profiler import StageProfiler
+from progress_events import get_progress
 from datetime import datetime, date
 from fuzzywuzzy import process, fuzz
 
+# Columns the order pipeline reads (normalized name -> dtype); everything is parsed from text in STAGE 3
+ORDER_SCHEMA = {
+    "orderid": str,
+    "customerid": str,
+    "purchase item": str,
+    "purchase date": str,
+    "item price": str,
+    "purchase quantity": str,
+    "total spend": str,
+}
+
+# Typed purchase date / time columns are written to CSV in these formats (Parquet keeps them typed)
+DATETIME_TEXT_FORMATS = {"purchase date": "%Y-%m-%d", "purchase time": "%H:%M:%S"}
+
+# Relative cost of each profiled stage (overall percentage in progress events)
+ORDER_STAGE_WEIGHTS = {
+    "STAGE 0 Normalize Column Names": 1,
+    "STAGE 1 Schema & Column Validation": 2,
+    "STAGE 2 Remove Duplicate Entry Rows": 7,
+    "STAGE 3 Standardization & Normalization": 55,
+    "STAGE 4 Missing Value Handling": 15,
+    "FINAL STAGE Save Cleaned Dataset": 10,
+}
+ORDER_STREAM_STAGE_WEIGHTS = {
+    "PASS 1 Profile File": 15,
+    "STAGE 2-4 Chunked Clean & Save": 85,
+}
+
 # ============================================= (ORDER DATASET) STAGE 0: NORMALIZE COLUMN NAMES =============================================
 # From Generic function: normalize_columns_name
 
@@ -17,138 +47,105 @@ from fuzzywuzzy import process, fuzz
 # ============================================= (ORDER DATASET) STAGE 3: STANDARDIZATION & NORMALIZATION =============================================
 # From Generic function: standardize_customer_id
 
-def standardized_order_id(df):
+def standardized_order_id(df, factorize_stats=None):
     """Standardize OrderID format (null is '')"""
-    print("[LOG - STAGE 3] Running standardize_order_id...")
+    log("[LOG - STAGE 3] Running standardize_order_id...")
     if 'orderid' in df.columns:
-        # Fill '' with empty string before converting to string
-        df.loc[:, 'orderid'] = df['orderid'].astype(str).str.strip().str.upper()
-        
-        # Convert empty string back to NaN
-        df.loc[df['orderid'] == '', 'orderid'] = np.nan
+        # Convert to string, strip spaces; empty string back to NaN (once per distinct ID)
+        df.loc[:, 'orderid'] = map_unique(
+            df['orderid'], lambda ids: ids.astype(str).str.strip().str.upper().replace('', np.nan),
+            'orderid', factorize_stats,
+        )
         
-        print("[LOG - STAGE 3] OrderID column standardized (empty -> NaN)")
+        log("[LOG - STAGE 3] OrderID column standardized (empty -> NaN)")
     else:
-        print("[LOG - STAGE 3] OrderID column not found, skipping")
+        log("[LOG - STAGE 3] OrderID column not found, skipping")
     return df
 
-def standardize_purchase_item(df):
-    """"Standardize Purchase Item names (NaN preserved)"""
-    print("[LOG - STAGE 3] Running standardized_purchase_item...")
+def standardize_purchase_item(df, factorize_stats=None, categorical=False):
+    """"Standardize Purchase Item names (NaN preserved; categorical=True keeps the column as `category`)"""
+    log("[LOG - STAGE 3] Running standardized_purchase_item...")
     if "purchase item" in df.columns:
-        mask = df["purchase item"].notna()
-        df.loc[mask, "purchase item"] = (
-            df.loc[mask, "purchase item"]
-            .astype(str)
-            .str.strip()
-            .str.title()
-        )
-        df.loc[df["purchase item"].str.strip() == "", "purchase item"] = np.nan
-        print("[LOG - STAGE 3] Purchase Item standardized, NaN preserved")
+        def clean_items(items):
+            cleaned = items.astype(str).str.strip().str.title().where(items.notna())
+            return cleaned.mask(cleaned == "")
+        df["purchase item"] = map_unique(df["purchase item"], clean_items, "purchase item", factorize_stats, categorical)
+        log("[LOG - STAGE 3] Purchase Item standardized, NaN preserved")
     else:
-        print("[LOG - STAGE 3] 'purchase item' column not found, skipping")
+        log("[LOG - STAGE 3] 'purchase item' column not found, skipping")
     return df
 
-def standardize_purchase_date(df):
-    """Standardize Purchase Date into separate date and time columns(NaT preserved)"""
-    print("[LOG - STAGE 3] Running standardize_purchase_date...")
+def purchase_time_message(has_time):
+    """Report message for a derived 'purchase time' column (None when there is none)"""
+    if not has_time:
+        return None
+    return (
+        "Since your Purchase Date information have include time information, "
+        "so a separate 'purchase time' column has been derived to be used for segmentation later."
+    )
+
+def standardize_purchase_date(df, date_formats=None, has_time=None):
+    """
+    Standardize Purchase Date into separate date and time columns(NaT preserved)
+    - purchase date: datetime64 at midnight; purchase time: timedelta64 since midnight (NaT without time info).
+      Both stay typed in memory and are only formatted as text when a CSV is written (DATETIME_TEXT_FORMATS)
+    - formats are detected from a sample and parsed with explicit formats (common_utils.parse_datetimes)
+    - date_formats / has_time: decided once for the whole file in streaming mode so every chunk
+      parses the same way and gets the same columns (default: inferred from df)
+    Returns (df, message, stats)
+    """
+    log("[LOG - STAGE 3] Running standardize_purchase_date...")
     message = None
+    stats = {}
     if "purchase date" in df.columns:
         # Ensure df is a deep copy (prevents SettingWithCopyWarning)
         df = df.copy()
-        
-        # Clean values
-        df.loc[df["purchase date"].notna(), "purchase date"] = df.loc[df["purchase date"].notna(), "purchase date"].astype(str).str.strip()
 
-        # Convert to datetime
-        df.loc[:, "purchase datetime"] = pd.to_datetime(
-            df["purchase date"], errors="coerce", dayfirst=True
-        )
+        # Convert to datetime (day first, like the previous dayfirst=True inference)
+        purchase_datetime, stats = parse_datetimes(df["purchase date"], formats=date_formats, dayfirst=True)
 
         # Detect which rows have time info
-        has_time_mask = df["purchase date"].notna() & df["purchase date"].str.contains(":", regex=False)
-        
+        has_time_mask = df["purchase date"].fillna("").astype(str).str.contains(":", regex=False)
+
         # Create standardized columns
-        df.loc[:, "purchase date"] = df["purchase datetime"].dt.strftime("%Y-%m-%d")
-        df.loc[:, "purchase date"] = df["purchase date"].replace("NaT", pd.NA)
-        
+        purchase_day = purchase_datetime.dt.normalize()
+        df["purchase date"] = purchase_day
+
         # Only create purchase time column if at least one row has time info
-        if has_time_mask.any():
-            df.loc[:, "purchase time"] = None
-            df.loc[has_time_mask, "purchase time"] = (
-                df.loc[has_time_mask, "purchase datetime"].dt.strftime("%H:%M:%S")
-            )
-            message = (
-                "Since your Purchase Date information have include time information, "
-                "so a separate 'purchase time' column has been derived to be used for segmentation later."
-            )
-        
-        # Drop intermediate column
-        df.drop(columns=["purchase datetime"], inplace=True, errors="ignore")
+        if has_time_mask.any() if has_time is None else has_time:
+            df["purchase time"] = (purchase_datetime - purchase_day).where(has_time_mask)
+            message = purchase_time_message(True)
+        log(f"[LOG - STAGE 3] Purchase date formats: {stats['format_counts']}, unparsed: {stats['unparsed_rows']}")
     else:
-        print("[WARN - STAGE 3] 'purchase date' column not found, skipping.")
-    print("[LOG - STAGE 3] Purchase date standardization complete, NaN preserved.")
-    return df, message
+        log("[WARN - STAGE 3] 'purchase date' column not found, skipping.", "warn")
+    log("[LOG - STAGE 3] Purchase date standardization complete, NaN preserved.")
+    return df, message, stats
+
+# Free-text numeric columns -> decimals kept (0 = whole numbers, stored as Int64)
+NUMERIC_COLUMNS = {"item price": 2, "total spend": 2, "purchase quantity": 0}
 
-def standardized_item_price_and_total_spend(df):
+def standardize_numeric_columns(df, factorize_stats=None):
     """
-    Standardize 'item price' and 'total spend' columns in the dataset.
+    Parse 'item price' / 'total spend' (float64, 2 decimal places) and 'purchase quantity' (Int64) once.
 
-    Steps performed for each column:
+    For each column (common_utils.parse_numeric_text):
     1. Remove all non-numeric characters except digits, decimal points, and negative signs
-    (e.g., currency symbols like RM, $, MYR are removed)
+    (e.g., currency symbols like RM, $, MYR, thousands separators and units like "pcs" are removed)
     2. Convert the resulting strings to numeric values; invalid or non-convertible entries are set to NaN
-    3. Round numeric values to 2 decimal places
+    3. Round to 2 decimal places (price / spend) or to whole numbers (quantity, e.g. 2.5 -> 2)
 
-    This ensures the columns are clean, numeric, and ready for analysis.
+    Later stages only work on these typed columns. Returns (df, {column: values that failed to parse}).
     """
-
-    print("[LOG - STAGE 3] Running standardized_item_price_and_total_spend...")
-
-    for col in ["item price", "total spend"]:
+    log("[LOG - STAGE 3] Running standardize_numeric_columns...")
+    failures = {}
+    for col, decimals in NUMERIC_COLUMNS.items():
         if col in df.columns:
-            # Step 1: Remove currency symbols and text
-            df[col] = (
-                df[col]
-                .astype(str)
-                .str.replace(r"[^\d\.\-]", "", regex=True)
-            )
-
-            # Step 2: Convert to numeric, coercing invalid values to NaN
-            df[col] = pd.to_numeric(df[col], errors="coerce")
-
-            # Step 3: Round to 2 decimal places
-            df[col] = df[col].round(2)
-
-            print(f"[LOG - STAGE 3] {col} standardized: numeric, 2 decimal places, NaN preserved")
+            df[col], failures[col] = parse_numeric_text(df[col], decimals=decimals, integer=decimals == 0,
+                                                        label=col, stats=factorize_stats)
+            log(f"[LOG - STAGE 3] {col} standardized: numeric, {failures[col]} unparseable value(s) set to NaN, NaN preserved")
         else:
-            print(f"[LOG - STAGE 3] '{col}' column not found, skipping")
-
-    return df
-
-def standardize_purchase_quantity(df):
-    """Standardize Purchase Quantity to integer (NaN preserved)"""
-    print("[LOG - STAGE 3] Running standardize_purchase_quantity...")
-
-    if "purchase quantity" in df.columns:
-        # Remove non-numeric characters (like pcs, x, units, etc.)
-        df["purchase quantity"] = (
-            df["purchase quantity"]
-            .astype(str)
-            .str.replace(r"[^\d\.\-]", "", regex=True)  # keep digits only
-        )
-
-        # Convert to numeric (NaN for invalid)
-        df["purchase quantity"] = pd.to_numeric(df["purchase quantity"], errors="coerce")
-
-        # Round any decimals (e.g. 2.5 → 2)
-        df["purchase quantity"] = df["purchase quantity"].round(0).astype("Int64")
-
-        print("[LOG - STAGE 3] Purchase quantity standardized to integer format, NaN preserved")
-    else:
-        print("[LOG - STAGE 3] 'purchase quantity' column not found, skipping")
-
-    return df
+            log(f"[LOG - STAGE 3] '{col}' column not found, skipping")
+    return df, failures
 
 # ============================================= (ORDER DATASET) STAGE 4: MISSING VALUE HANDLING =============================================
 def handle_missing_values_order(df):
@@ -181,24 +178,22 @@ def handle_missing_values_order(df):
     before_critical = len(df)
     df = df.dropna(subset=existing_critical)
     stats["critical_ids_removed"] = before_critical - len(df)
-    print(f"[LOG - STAGE 4] Dropped {stats['critical_ids_removed']} rows with missing critical identifiers (OrderID, CustomerID, Purchase Date, Purchase Item)")
+    log(f"[LOG - STAGE 4] Dropped {stats['critical_ids_removed']} rows with missing critical identifiers (OrderID, CustomerID, Purchase Date, Purchase Item)")
     
     # Drop rows missing both financial info
     before_financial = len(df)
     df = df.dropna(subset=["item price", "total spend"], how="all")
     stats["no_financial_removed"] = before_financial - len(df)
-    print(f"[LOG - STAGE 4] Dropped {stats['no_financial_removed']} rows with no financial info")
+    log(f"[LOG - STAGE 4] Dropped {stats['no_financial_removed']} rows with no financial info")
 
+    # item price / total spend are already float64 (STAGE 3 standardize_numeric_columns)
     for col in ["item price", "total spend"]:
         if col in df.columns:
-            df[col] = df[col].astype(str).str.replace(r"[^\d\.\-]", "", regex=True)
-            df[col] = pd.to_numeric(df[col], errors="coerce").round(2)
-            
             # Remove zero or negative values that are logically impossible
             df.loc[df[col] <= 0, col] = np.nan
             zero_count = df[col].isna().sum()
             if zero_count > 0:
-                print(f"[WARN - STAGE 4] {zero_count} rows in '{col}' are zero or invalid and set to NaN")
+                log(f"[WARN - STAGE 4] {zero_count} rows in '{col}' are zero or invalid and set to NaN", "warn")
 
     # Handle purchase quantity: calculate if possible
     if "purchase quantity" in df.columns:
@@ -214,7 +209,7 @@ def handle_missing_values_order(df):
         before_drop = len(df)
         df = df.dropna(subset=["item price"])
         stats["item_price_removed"] = before_drop - len(df)
-        print(f"[LOG - STAGE 4] Dropped {stats['item_price_removed']} rows with missing 'item price' (critical for calculations)")
+        log(f"[LOG - STAGE 4] Dropped {stats['item_price_removed']} rows with missing 'item price' (critical for calculations)")
 
     # Handle total spend
     if {"item price", "purchase quantity", "total spend"}.issubset(df.columns):
@@ -228,15 +223,15 @@ def handle_missing_values_order(df):
         before_drop = len(df)
         df = df.dropna(subset=["total spend"])
         stats["total_spend_removed"] = before_drop - len(df)
-        print(f"[LOG - STAGE 4] Dropped {stats['total_spend_removed']} rows with missing 'total spend' after calculation")
+        log(f"[LOG - STAGE 4] Dropped {stats['total_spend_removed']} rows with missing 'total spend' after calculation")
 
     # Build message
     dropped_total = initial_count - len(df)
     stats["dropped_total"] = dropped_total
     
     # Final summary
-    print(f"[LOG - STAGE 4] Dropped total {dropped_total} rows ({dropped_total/initial_count:.2%}) due to missing critical data")
-    print(f"[LOG - STAGE 4] Dataset now has {len(df)} rows after missing value handling")
+    log(f"[LOG - STAGE 4] Dropped total {dropped_total} rows ({dropped_total/initial_count:.2%}) due to missing critical data")
+    log(f"[LOG - STAGE 4] Dataset now has {len(df)} rows after missing value handling")
 
     return df, stats
 
@@ -249,7 +244,7 @@ def order_detect_outliers(df):
     - Columns: purchase quantity, total spend.
     - Outliers are FLAGGED only, original values preserved.
     """
-    print(f"[LOG - STAGE 5] Dataset has {len(df)} rows")
+    log(f"[LOG - STAGE 5] Dataset has {len(df)} rows")
 
     numeric_cols = ["purchase quantity", "total spend"]
     df = df.copy()
@@ -265,7 +260,7 @@ def order_detect_outliers(df):
             continue
 
         if df[col].dropna().empty:
-            print(f"[WARN - STAGE 5] {col} is empty or missing, skipping.")
+            log(f"[WARN - STAGE 5] {col} is empty or missing, skipping.", "warn")
             continue
 
         if len(df) < 500:
@@ -292,7 +287,7 @@ def order_detect_outliers(df):
         elif col == "total spend":
             df.loc[outlier_mask, 'is_spend_outlier'] = True
         
-        print(f"[LOG - STAGE 5] {method} applied on '{col}'. Range: [{lower:.2f}, {upper:.2f}]. Outliers flagged: {outliers_count}")
+        log(f"[LOG - STAGE 5] {method} applied on '{col}'. Range: [{lower:.2f}, {upper:.2f}]. Outliers flagged: {outliers_count}")
         
         if outliers_count > 0:
             col_display = col.replace('_', ' ').title()
@@ -311,12 +306,19 @@ def order_detect_outliers(df):
         messages.append("\nAll order values (quantities and amounts) appear normal and consistent. No unusual values detected.")
 
     final_message = "\n".join(messages)
-    print("✅ [STAGE 5 COMPLETE] Outliers flagged successfully (values preserved).")
+    log("✅ [STAGE 5 COMPLETE] Outliers flagged successfully (values preserved).", "info")
     return df, final_message
 
 # ============================================= (ORDER DATASET) DATASET CLEANING PIPELINE =============================================
-def clean_order_dataset(df, cleaned_output_path):
-    print("🚀 Starting order data cleaning pipeline...\n")
+def clean_order_dataset(df, cleaned_output_path, profiler=None, categorical=False, keep_unknown_columns=False):
+    """
+    Main cleaning pipeline for order dataset; profiler (StageProfiler) times each stage into report["performance"].
+    categorical=True keeps purchase item as a `category` column from STAGE 3 on.
+    Columns outside ORDER_SCHEMA are dropped after STAGE 2 unless keep_unknown_columns is set.
+    """
+    if profiler is None:
+        profiler = StageProfiler()
+    log("🚀 Starting order data cleaning pipeline...\n", "info")
     messages = [] 
     report = {"summary": {}, "detailed_messages": {}}
     
@@ -327,51 +329,68 @@ def clean_order_dataset(df, cleaned_output_path):
     # =======================================================
     # STAGE 0: NORMALIZE COLUMN NAMES (FROM GENERIC FUNCTION)
     # =======================================================
-    print("========== [STAGE 0 START] Normalize Column Names ==========")
+    log("========== [STAGE 0 START] Normalize Column Names ==========", "info")
+    profiler.start("STAGE 0 Normalize Column Names", rows_in=len(df))
     df = normalize_columns_name(df)
-    print("✅ [STAGE 0 COMPLETE] Column names normalized.\n")
+    profiler.end(rows_out=len(df))
+    log("✅ [STAGE 0 COMPLETE] Column names normalized.\n", "info")
     
     # =============================================
     # STAGE 1: SCHEMA & COLUMN VALIDATION
     # =============================================
-    print("========== [STAGE 1 START] Schema & Column Validation ==========")
+    log("========== [STAGE 1 START] Schema & Column Validation ==========", "info")
+    profiler.start("STAGE 1 Schema & Column Validation", rows_in=len(df))
     order_mandatory = ["orderid", "customerid", "purchase item", "purchase date", "item price", "purchase quantity", "total spend"]
     df, mandatory_msg = check_mandatory_columns(df, dataset_type="order", mandatory_columns=order_mandatory)
     messages.append(mandatory_msg)
     report["detailed_messages"]["check_mandatory_columns"] = mandatory_msg
-    print(mandatory_msg)
-    print("✅ [STAGE 1 COMPLETE] Schema validation done.\n")
+    profiler.end(rows_out=len(df))
+    log(mandatory_msg, "info")
+    log("✅ [STAGE 1 COMPLETE] Schema validation done.\n", "info")
     
     # ============================================================
     # STAGE 2: REMOVE DUPLICATE ENTRY ROWS (FROM GENERIC FUNCTION)
     # ============================================================
-    print("========== [STAGE 2 START] Remove Duplicate Entry Rows ==========")
+    log("========== [STAGE 2 START] Remove Duplicate Entry Rows ==========", "info")
+    profiler.start("STAGE 2 Remove Duplicate Entry Rows", rows_in=len(df))
     initial_rows = len(df)
     df = remove_duplicate_entries(df)
     report["summary"]["duplicates_removed_rows"] = initial_rows - len(df)
-    print("✅ [STAGE 2 COMPLETE] Duplicate entries removed.\n")
+    if not keep_unknown_columns:
+        df, dropped_columns, dropped_msg = drop_unknown_columns(df, ORDER_SCHEMA)
+        messages.append(dropped_msg)
+        report["summary"]["dropped_unknown_columns"] = dropped_columns
+        report["detailed_messages"]["drop_unknown_columns"] = dropped_msg
+    profiler.end(rows_out=len(df))
+    log("✅ [STAGE 2 COMPLETE] Duplicate entries removed.\n", "info")
     
     # =============================================
     # STAGE 3: STANDARDIZATION & NORMALIZATION
     # =============================================
-    print("========== [STAGE 3 START] Standardization & Normalization ==========")
-    df = standardized_order_id(df)
-    df = standardize_customer_id(df)
-    df = standardize_purchase_item(df)
-    df, standardize_purchaseDateMessage = standardize_purchase_date(df)
+    log("========== [STAGE 3 START] Standardization & Normalization ==========", "info")
+    profiler.start("STAGE 3 Standardization & Normalization", rows_in=len(df))
+    factorize_stats = report["summary"]["factorized_columns"] = {}
+    df = standardized_order_id(df, factorize_stats)
+    df = standardize_customer_id(df, factorize_stats)
+    df = standardize_purchase_item(df, factorize_stats, categorical)
+    df, standardize_purchaseDateMessage, purchase_date_stats = standardize_purchase_date(df)
+    report["summary"]["purchase_date_formats"] = purchase_date_stats
     messages.append(standardize_purchaseDateMessage)
     report["detailed_messages"]["standardize_purchase_date"] = standardize_purchaseDateMessage
-    df = standardized_item_price_and_total_spend(df)
-    df = standardize_purchase_quantity(df)
-    print("✅ [STAGE 3 COMPLETE] Standardization and normalization finished.\n")
+    df, numeric_failures = standardize_numeric_columns(df, factorize_stats)
+    report["summary"]["numeric_parse_failures"] = numeric_failures
+    profiler.end(rows_out=len(df))
+    log("✅ [STAGE 3 COMPLETE] Standardization and normalization finished.\n", "info")
 
     # ===============================================
     # STAGE 4: MISSING VALUE HANDLING
     # ===============================================
-    print("========== [STAGE 4 START] Missing Value Handling ==========")
+    log("========== [STAGE 4 START] Missing Value Handling ==========", "info")
+    profiler.start("STAGE 4 Missing Value Handling", rows_in=len(df))
     df, missing_value_stats = handle_missing_values_order(df)
     report["summary"]["rows_removed_during_missing_value_handling"] = missing_value_stats["dropped_total"]
-    print("✅ [STAGE 4 COMPLETE] Missing values handled.\n")
+    profiler.end(rows_out=len(df))
+    log("✅ [STAGE 4 COMPLETE] Missing values handled.\n", "info")
     
     # =============================================
     # STAGE 5: OUTLIER DETECTION (Not implement)
@@ -389,12 +408,185 @@ def clean_order_dataset(df, cleaned_output_path):
     # =============================================
     # SAVE CLEANED DATASET
     # =============================================
-    print("========== [FINAL STAGE START] Save Cleaned Dataset ==========")
+    log("========== [FINAL STAGE START] Save Cleaned Dataset ==========", "info")
+    profiler.start("FINAL STAGE Save Cleaned Dataset", rows_in=len(df))
     # base_name, ext = os.path.splitext(original_order_dataset_name)
-    df.to_csv(cleaned_output_path, index=False)
-    print(f"✅ [FINAL STAGE COMPLETE] Cleaned dataset saved at: {cleaned_output_path}\n")
+    write_dataset(df, cleaned_output_path, text_formats=DATETIME_TEXT_FORMATS)
+    profiler.end(rows_out=len(df))
+    log(f"✅ [FINAL STAGE COMPLETE] Cleaned dataset saved at: {cleaned_output_path}\n", "info")
 
-    print("==========================================================")
-    print("🎉 Data cleaning pipeline completed successfully!\n")
+    log("==========================================================", "info")
+    log("🎉 Data cleaning pipeline completed successfully!\n", "info")
+    report["performance"] = profiler.summary()
     return df, report
-    # later add on return clean file name
\ No newline at end of file
+    # later add on return clean file name
+
+# ============================================= (ORDER DATASET) STREAMING PIPELINE =============================================
+DEFAULT_CHUNKSIZE = 100000
+
+def read_order_chunks(csv_path, chunksize, schema_only=False):
+    """
+    Read the upload in chunks with normalized column names. CSV columns are all read as text so every
+    chunk is typed the same; Parquet files are already typed consistently and are read batch by batch.
+    """
+    chunks = load_dataset(csv_path, ORDER_SCHEMA, schema_only=schema_only, chunksize=chunksize)
+    columns = None
+    for chunk in chunks:
+        if columns is None:
+            columns = normalize_columns_name(chunk).columns
+        chunk.columns = columns
+        yield chunk
+
+def profile_order_file(csv_path, chunksize, keep_unknown_columns=False):
+    """
+    Pass 1 over the file: the dataset-wide facts the chunked pass needs up front.
+    - fill ratio per column (STAGE 1)
+    - purchase date formats, detected from a sample of distinct values across the file (STAGE 3)
+    - whether any purchase date carries a time, which decides the 'purchase time' column (STAGE 3)
+    """
+    rows = 0
+    filled = None
+    date_sample = set()
+    has_time = False
+    # Pruned on purpose: the profile only looks at schema columns, and non-schema columns only reach the
+    # output (whose header-only fallback uses these fill ratios) when keep_unknown_columns is set
+    for chunk in read_order_chunks(csv_path, chunksize, schema_only=not keep_unknown_columns):
+        rows += len(chunk)
+        counts = chunk.notna().sum()
+        filled = counts if filled is None else filled + counts
+        if "purchase date" in chunk.columns:
+            dates = chunk["purchase date"].dropna().str.strip()
+            dates = dates[dates != ""]
+            if len(date_sample) < DATE_FORMAT_SAMPLE_SIZE:
+                date_sample.update(dates.unique()[:DATE_FORMAT_SAMPLE_SIZE - len(date_sample)])
+            has_time = has_time or bool(dates.str.contains(":", regex=False).any())
+    date_formats = guess_date_formats(pd.Series(sorted(date_sample), dtype=object))
+    fill_ratios = {col: (int(n) / rows if rows else 0.0) for col, n in (filled.items() if filled is not None else [])}
+    return {"rows": rows, "fill_ratios": fill_ratios, "date_formats": date_formats, "has_time": has_time}
+
+def merge_date_stats(total, chunk_stats):
+    """Add one chunk's standardize_purchase_date stats to the file-wide totals"""
+    for key in ("rows", "null_rows", "unparsed_rows"):
+        total[key] += chunk_stats.get(key, 0)
+    for fmt in chunk_stats.get("formats", []):
+        if fmt not in total["formats"]:
+            total["formats"].append(fmt)
+    for fmt, count in chunk_stats.get("format_counts", {}).items():
+        total["format_counts"][fmt] = total["format_counts"].get(fmt, 0) + count
+
+def drop_seen_rows(chunk, seen):
+    """
+    Drop rows whose full-row hash was already seen in this or an earlier chunk (keeps the first occurrence).
+    `seen` is a list of pd.Index runs of kept hashes: each run's hash table is built once and probed per chunk,
+    and runs are merged geometrically so only a few exist. No per-row Python work, and 8 bytes per hash
+    instead of a Python int in a set.
+    """
+    hashes = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+    keep = ~pd.Index(hashes).duplicated()
+    for run in seen:
+        keep &= run.get_indexer(hashes) < 0
+    new = hashes[keep]
+    while seen and len(seen[-1]) <= 2 * len(new):
+        new = np.concatenate([seen.pop().to_numpy(), new])
+    if len(new):
+        seen.append(pd.Index(new))
+    return chunk[keep].reset_index(drop=True)
+
+def clean_order_dataset_streaming(csv_path, cleaned_output_path, chunksize=DEFAULT_CHUNKSIZE, keep_unknown_columns=False,
+                                  profiler=None, categorical=False):
+    """
+    Streaming variant of clean_order_dataset for large uploads: memory stays around one chunk.
+    - Pass 1 (profile_order_file): fill ratios, purchase date formats, time column decision
+    - Pass 2: per chunk, exact-duplicate removal against a seen-set of full-row hashes (STAGE 2), dropping the
+      columns outside ORDER_SCHEMA (unless keep_unknown_columns), then the row-local STAGE 3 standardization
+      and STAGE 4 missing value handling; cleaned rows are appended to the output file
+    Outlier detection (STAGE 5) is disabled in the regular pipeline as well, so it has no pass here.
+    categorical: as in clean_order_dataset (categories are per chunk).
+    Returns (None, report); the cleaned rows only exist on disk.
+    """
+    if profiler is None:
+        profiler = StageProfiler()
+    log("🚀 Starting order data cleaning pipeline (streaming)...\n", "info")
+    messages = []
+    report = {"summary": {}, "detailed_messages": {}}
+
+    log("========== [STAGE 0 START] Normalize Column Names & Profile File ==========", "info")
+    profiler.start("PASS 1 Profile File")
+    profile = profile_order_file(csv_path, chunksize, keep_unknown_columns)
+    profiler.end(rows_out=profile["rows"])
+    report["summary"]["initial_rows"] = profile["rows"]
+    log(f"[LOG - STREAM] {profile['rows']} rows, purchase date formats: {profile['date_formats']}, time info: {profile['has_time']}")
+    log("✅ [STAGE 0 COMPLETE] Column names normalized.\n", "info")
+
+    log("========== [STAGE 1 START] Schema & Column Validation ==========", "info")
+    order_mandatory = ["orderid", "customerid", "purchase item", "purchase date", "item price", "purchase quantity", "total spend"]
+    _, mandatory_msg = check_mandatory_columns(None, dataset_type="order", mandatory_columns=order_mandatory, fill_ratios=profile["fill_ratios"])
+    messages.append(mandatory_msg)
+    report["detailed_messages"]["check_mandatory_columns"] = mandatory_msg
+    log(mandatory_msg, "info")
+    log("✅ [STAGE 1 COMPLETE] Schema validation done.\n", "info")
+
+    log("========== [STAGE 2-4 START] Deduplicate, Standardize & Handle Missing Values (chunked) ==========", "info")
+    profiler.start("STAGE 2-4 Chunked Clean & Save", rows_in=profile["rows"])
+    seen = []
+    rows_after_dedup = 0
+    dropped_columns, dropped_msg = [], None
+    missing_value_stats = {}
+    factorize_stats = report["summary"]["factorized_columns"] = {}
+    numeric_failures = report["summary"]["numeric_parse_failures"] = {}
+    date_stats = report["summary"]["purchase_date_formats"] = {
+        "rows": 0, "null_rows": 0, "unparsed_rows": 0, "formats": list(profile["date_formats"]), "format_counts": {},
+    }
+    rows_read = 0
+    progress = get_progress()
+    writer = DatasetWriter(cleaned_output_path, text_formats=DATETIME_TEXT_FORMATS)
+    # Every column is read so duplicates are judged on the full row, as in clean_order_dataset
+    for number, chunk in enumerate(read_order_chunks(csv_path, chunksize), start=1):
+        log(f"[LOG - STREAM] Chunk {number}: {len(chunk)} rows")
+        rows_read += len(chunk)
+        chunk = drop_seen_rows(chunk, seen)
+        if not keep_unknown_columns:
+            chunk, dropped_columns, dropped_msg = drop_unknown_columns(chunk, ORDER_SCHEMA)
+        rows_after_dedup += len(chunk)
+        if chunk.empty:
+            continue
+
+        chunk = standardized_order_id(chunk, factorize_stats)
+        chunk = standardize_customer_id(chunk, factorize_stats)
+        chunk = standardize_purchase_item(chunk, factorize_stats, categorical)
+        chunk, _, chunk_date_stats = standardize_purchase_date(chunk, date_formats=profile["date_formats"], has_time=profile["has_time"])
+        merge_date_stats(date_stats, chunk_date_stats)
+        chunk, chunk_failures = standardize_numeric_columns(chunk, factorize_stats)
+        for key, value in chunk_failures.items():
+            numeric_failures[key] = numeric_failures.get(key, 0) + value
+        chunk, chunk_stats = handle_missing_values_order(chunk)
+        for key, value in chunk_stats.items():
+            missing_value_stats[key] = missing_value_stats.get(key, 0) + int(value)
+        writer.write(chunk)
+        progress.update(rows=rows_read, total=profile["rows"])
+
+    # Nothing survived: still leave a valid (header only) file behind
+    writer.close(empty_columns=profile["fill_ratios"])
+    profiler.end(rows_out=writer.rows)
+    # Built once for the whole file (like the format counts), not taken from whichever chunk came last
+    purchase_date_message = purchase_time_message(profile["has_time"] and date_stats["rows"] > 0)
+    messages.append(purchase_date_message)
+    report["detailed_messages"]["standardize_purchase_date"] = purchase_date_message
+    report["summary"]["duplicates_removed_rows"] = profile["rows"] - rows_after_dedup
+    if not keep_unknown_columns:
+        messages.append(dropped_msg)
+        report["summary"]["dropped_unknown_columns"] = dropped_columns
+        report["detailed_messages"]["drop_unknown_columns"] = dropped_msg
+    report["summary"]["rows_removed_during_missing_value_handling"] = missing_value_stats.get("dropped_total", 0)
+    log("✅ [STAGE 2-4 COMPLETE] Chunks cleaned.\n", "info")
+
+    report["summary"].update({
+        "total_rows_final": writer.rows,
+        "total_columns_final": len(writer.columns),
+    })
+    log(f"✅ [FINAL STAGE COMPLETE] Cleaned dataset saved at: {cleaned_output_path}\n", "info")
+
+    log("==========================================================", "info")
+    log("🎉 Data cleaning pipeline completed successfully!\n", "info")
+    report["performance"] = profiler.summary()
+    return None, report
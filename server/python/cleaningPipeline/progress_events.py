@@ -0,0 +1,114 @@
+# Machine-readable progress events for cleaning runs (JSON lines on a dedicated fd / file)
+import json
+import os
+import time
+
+from common_utils import log
+
+DEFAULT_MIN_INTERVAL = 0.5  # seconds between throttled "progress" events
+
+class ProgressReporter:
+    """
+    Writes one JSON object per line, e.g.
+        {"event": "stage", "stage": "STAGE 5 Missing Value Handling", "percent": 40.0, ...}
+        {"event": "progress", "stage": "...", "rows": 1200, "total": 5000, "percent": 52.3, "eta_s": 31.0, ...}
+        {"event": "completed", "percent": 100.0, ...}  /  {"event": "failed", "error": "...", ...}
+    "stage" / "completed" / "failed" events are always written; "progress" events at most every
+    min_interval seconds. Percent is weighted by the stage plan (stage name -> relative cost).
+    Each stage change is also logged as a "[STAGE] <stage>::started" line next to the existing
+    [STAGE] / [COMPLETED] markers. Without a stream the reporter only does that logging.
+    """
+
+    def __init__(self, stream=None, min_interval=DEFAULT_MIN_INTERVAL):
+        self.stream = stream
+        self.min_interval = min_interval
+        self.plan = {}
+        self.done_weight = 0.0
+        self.stage = None
+        self.started = time.monotonic()
+        self.last_emit = 0.0
+
+    @classmethod
+    def open(cls, progress_fd=None, progress_file=None, min_interval=DEFAULT_MIN_INTERVAL):
+        """Reporter writing to an inherited file descriptor or an (appended) file; no-op if neither is given"""
+        if progress_fd is not None:
+            return cls(os.fdopen(progress_fd, "w", buffering=1, encoding="utf-8", closefd=False), min_interval)
+        if progress_file:
+            return cls(open(progress_file, "a", buffering=1, encoding="utf-8"), min_interval)
+        return cls(None, min_interval)
+
+    def set_plan(self, weights):
+        """Relative cost of each stage name; stages outside the plan do not move the percentage"""
+        self.plan = dict(weights)
+        self.done_weight = 0.0
+
+    def percent(self, fraction=0.0):
+        total = sum(self.plan.values())
+        if not total:
+            return None
+        current = self.plan.get(self.stage, 0.0) * min(max(fraction, 0.0), 1.0)
+        return round(min(100.0, 100.0 * (self.done_weight + current) / total), 1)
+
+    def eta(self, percent):
+        """Seconds left, extrapolated from the elapsed time and the overall percentage"""
+        if not percent:
+            return None
+        elapsed = time.monotonic() - self.started
+        return round(elapsed * (100.0 - percent) / percent, 1)
+
+    def write(self, payload):
+        if self.stream is None:
+            return
+        payload["elapsed_s"] = round(time.monotonic() - self.started, 2)
+        try:
+            self.stream.write(json.dumps(payload) + "\n")
+            self.stream.flush()
+        except (OSError, ValueError):
+            # A closed pipe must never fail the cleaning run itself
+            self.stream = None
+
+    def start_stage(self, name, rows=None):
+        if self.stage is not None:
+            self.end_stage()
+        self.stage = name
+        log(f"[STAGE] {name}::started", "info")
+        percent = self.percent()
+        self.write({"event": "stage", "stage": name, "rows": rows, "percent": percent, "eta_s": self.eta(percent)})
+        self.last_emit = time.monotonic()
+
+    def end_stage(self):
+        if self.stage is not None:
+            self.done_weight += self.plan.get(self.stage, 0.0)
+        self.stage = None
+
+    def update(self, rows=None, total=None, force=False):
+        """Progress inside the current stage (throttled)"""
+        now = time.monotonic()
+        if self.stream is None or (not force and now - self.last_emit < self.min_interval):
+            return
+        self.last_emit = now
+        fraction = rows / total if rows is not None and total else 0.0
+        percent = self.percent(fraction)
+        self.write({"event": "progress", "stage": self.stage, "rows": rows, "total": total, "percent": percent, "eta_s": self.eta(percent)})
+
+    def completed(self, **outputs):
+        self.end_stage()
+        self.write({"event": "completed", "percent": 100.0, **outputs})
+
+    def failed(self, error):
+        self.write({"event": "failed", "stage": self.stage, "error": str(error)})
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+# Reporter used by the pipeline functions (replaced by cleaning_main / the worker for each job)
+PROGRESS = ProgressReporter()
+
+def set_progress(reporter):
+    global PROGRESS
+    PROGRESS = reporter
+
+def get_progress():
+    return PROGRESS
@@ -0,0 +1,112 @@
+# Per-stage timing / memory instrumentation for the cleaning pipelines (ends up in report["performance"])
+import os
+import sys
+import time
+import tracemalloc
+
+from common_utils import log
+from progress_events import get_progress
+
+def current_rss_mb():
+    """Resident memory of this process in MB (Linux /proc; None where unavailable, e.g. Windows)"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far in MB (None on Windows, which has no `resource` module)"""
+    # Linux: VmHWM restarts at exec, unlike ru_maxrss, which keeps the forking parent's peak
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB on Linux
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+def rounded(value, digits=3):
+    return None if value is None else round(value, digits)
+
+class StageProfiler:
+    """
+    Records wall time, CPU time, RSS and rows in/out for each pipeline stage:
+        profiler.start("STAGE 3 Deduplication", rows_in=len(df))
+        ...
+        profiler.end(rows_out=len(df))
+    trace_memory=True also records the tracemalloc peak of Python/numpy allocations per stage
+    (slower, so it is off by default). Stage changes are forwarded to the progress reporter
+    (progress_events.ProgressReporter, the module-wide one by default).
+    """
+
+    def __init__(self, trace_memory=False, progress=None):
+        self.trace_memory = trace_memory
+        self.progress = progress if progress is not None else get_progress()
+        self.stages = []
+        self._current = None
+        self._started = time.perf_counter()
+        self._started_cpu = time.process_time()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def start(self, name, rows_in=None):
+        if self._current is not None:
+            self.end()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        self._current = {
+            "name": name,
+            "rows_in": rows_in,
+            "wall": time.perf_counter(),
+            "cpu": time.process_time(),
+            "rss": current_rss_mb(),
+            "peak_rss": peak_rss_mb(),
+            "traced": tracemalloc.get_traced_memory()[0] if self.trace_memory else None,
+        }
+        self.progress.start_stage(name, rows=rows_in)
+
+    def end(self, rows_out=None):
+        current, self._current = self._current, None
+        if current is None:
+            return None
+        self.progress.end_stage()
+        rss, peak = current_rss_mb(), peak_rss_mb()
+        record = {
+            "stage": current["name"],
+            "wall_s": rounded(time.perf_counter() - current["wall"]),
+            "cpu_s": rounded(time.process_time() - current["cpu"]),
+            "rows_in": current["rows_in"],
+            "rows_out": rows_out,
+            "rss_mb": rounded(rss, 1),
+            "rss_delta_mb": rounded(rss - current["rss"], 1) if rss is not None and current["rss"] is not None else None,
+            "peak_rss_mb": rounded(peak, 1),
+            "peak_rss_growth_mb": rounded(peak - current["peak_rss"], 1) if peak is not None else None,
+        }
+        if self.trace_memory:
+            traced_peak = tracemalloc.get_traced_memory()[1]
+            record["tracemalloc_peak_delta_mb"] = rounded((traced_peak - current["traced"]) / 2**20, 1)
+        self.stages.append(record)
+        log(f"[PERF] {record['stage']}: {record['wall_s']}s wall, {record['cpu_s']}s cpu, "
+            f"rows {record['rows_in']} -> {record['rows_out']}, rss {record['rss_mb']} MB", "debug")
+        return record
+
+    def summary(self):
+        """JSON-friendly block for report["performance"]"""
+        if self._current is not None:
+            self.end()
+        return {
+            "total_wall_s": rounded(time.perf_counter() - self._started),
+            "total_cpu_s": rounded(time.process_time() - self._started_cpu),
+            "peak_rss_mb": rounded(peak_rss_mb(), 1),
+            "trace_memory": self.trace_memory,
+            "stages": self.stages,
+        }
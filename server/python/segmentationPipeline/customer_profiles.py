@@ -0,0 +1,360 @@
+"""Per-customer profile / RFM aggregation (the merged table the segmentation step clusters).
+
+Vectorized replacement for aggregateOrderData + mergeCustomerAndOrderData in
+segmentationController.js: the cleaned order file is grouped with numpy/pandas instead of a
+row-by-row loop in the Node heap, and the result can go straight into run_segmentation.
+The output is meant to match the JavaScript version value for value:
+  - recency: whole days since the last purchase date (dates are UTC midnights); 0 is written as empty.
+    Unparseable purchase dates are skipped (cleaned order files do not contain any)
+  - customerLifetimeMonths: max(1, floor(days between first and last purchase / 30)), 0 without dates
+  - frequency: the order count (as the JS version produced it)
+  - avgOrderValue / monetary: rounded like Number(x.toFixed(2))
+  - favoriteItem / favoritePurchaseHour / favoriteDayPart: most frequent value; ties go to the
+    value JavaScript iterates last (first-seen order for items, ascending hours, Night..Evening)
+
+CLI:
+    python customer_profiles.py --customers customers_cleaned.csv --orders orders_cleaned.csv --out merged.csv
+    python customer_profiles.py ... --out merged.parquet --summary-out summary.json
+    python customer_profiles.py ... --features Recency,Frequency,Monetary --segment-out result.json
+"""
+import json
+import sys
+import time
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Columns read from the cleaned files (anything else is never loaded)
+ORDER_COLUMNS = ['customerid', 'total spend', 'purchase date', 'purchase item', 'purchase time']
+CUSTOMER_COLUMNS = ['customerid', 'city', 'state', 'age', 'age group', 'gender']
+DAY_PARTS = ['Night', 'Morning', 'Afternoon', 'Evening']  # hours 0-5, 6-11, 12-17, 18-23
+MS_PER_DAY = 24 * 60 * 60 * 1000
+# Leading number the way JavaScript parseFloat / parseInt read it ('12.5abc' -> 12.5, '09:30' -> 9)
+JS_FLOAT_PATTERN = r'^\s*([+-]?(?:Infinity|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?))'
+JS_INT_PATTERN = r'^\s*([+-]?\d+)'
+# Values that are nothing but a number / start with a two-digit hour take the vectorized path;
+# only the rest goes through the (per value) regex extraction above
+PLAIN_FLOAT_PATTERN = r'[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?'
+PLAIN_HOUR_PATTERN = r'\d\d(?::.*)?'
+# Integer-like object keys, which JavaScript iterates first and in ascending order
+JS_INDEX_KEY_PATTERN = r'^(?:0|[1-9]\d{0,9})$'
+
+VERBOSE = False
+def vlog(msg: str):
+    if VERBOSE:
+        print(f"[PROFILE][STEP] {msg}", file=sys.stderr)
+
+
+def is_parquet_path(path: str) -> bool:
+    return path.lower().endswith(('.parquet', '.pq'))
+
+
+def read_text_columns(path: str, wanted: List[str]) -> pd.DataFrame:
+    """Read the wanted columns that exist in a cleaned CSV / Parquet file.
+    Text columns come back as str with '' for empty cells (what csv-parser hands the Node side);
+    typed Parquet columns (numbers, datetimes, times of day as durations) are kept as they are."""
+    if is_parquet_path(path):
+        import pyarrow.parquet as pq  # only needed for Parquet input
+        available = pq.read_schema(path).names
+        df = pd.read_parquet(path, columns=[c for c in wanted if c in available])
+    else:
+        available = pd.read_csv(path, nrows=0).columns
+        df = pd.read_csv(path, usecols=[c for c in wanted if c in available], dtype=str, keep_default_na=False)
+    for col in df.columns:
+        values = df[col]
+        if (pd.api.types.is_numeric_dtype(values) or pd.api.types.is_datetime64_any_dtype(values)
+                or pd.api.types.is_timedelta64_dtype(values)):
+            continue
+        if not isinstance(values.dtype, pd.StringDtype):
+            values = values.astype(str)
+        df[col] = values.fillna('') if values.hasnans else values
+    return df
+
+
+def js_leading_number(values: pd.Series, plain_pattern: str, plain_chars: Optional[int], lead_pattern: str) -> np.ndarray:
+    """Leading number of every text value (NaN where there is none).
+    Values matching plain_pattern are converted in bulk (their first plain_chars characters, or all of it)."""
+    numbers = np.full(len(values), np.nan)
+    plain = values.str.fullmatch(plain_pattern).to_numpy(dtype=bool)
+    head = values[plain] if plain_chars is None else values[plain].str.slice(0, plain_chars)
+    numbers[plain] = head.astype(float).to_numpy()
+    rest = ~plain & (values != '').to_numpy()
+    if rest.any():
+        numbers[rest] = values[rest].str.extract(lead_pattern, expand=False).astype(float).to_numpy()
+    return numbers
+
+
+def js_parse_float(values: pd.Series) -> np.ndarray:
+    """parseFloat(x) || 0 for every value"""
+    if pd.api.types.is_numeric_dtype(values):
+        numbers = values.astype(float).to_numpy()
+    else:
+        numbers = js_leading_number(values, PLAIN_FLOAT_PATTERN, None, JS_FLOAT_PATTERN)
+    return np.where(np.isnan(numbers), 0.0, numbers)
+
+
+def js_round2(values) -> np.ndarray:
+    """Number(x.toFixed(2)): round half away from zero on the exact binary value of x"""
+    x = np.asarray(values, dtype=float)
+    scaled = np.abs(x) * 100
+    out = np.rint(scaled)
+    # x * 100 is itself rounded, so values within a hair of .5 are settled exactly with Decimal
+    for i in np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6):
+        out[i] = float(Decimal(float(abs(x[i]))).quantize(Decimal('0.01'), ROUND_HALF_UP) * 100)
+    return np.where(np.isnan(x), np.nan, np.copysign(out / 100, x) + 0.0)
+
+
+def to_utc_ms(values: pd.Series) -> np.ndarray:
+    """Dates as milliseconds since the epoch (NaN where missing); text is read the way new Date() reads YYYY-MM-DD, as UTC"""
+    if not pd.api.types.is_datetime64_any_dtype(values):
+        values = pd.to_datetime(values.where(values != '', None), format='ISO8601', errors='coerce')
+    if getattr(values.dt, 'tz', None) is not None:
+        values = values.dt.tz_convert('UTC').dt.tz_localize(None)
+    ms = values.to_numpy(dtype='datetime64[ms]').astype(np.int64).astype(float)
+    ms[values.isna().to_numpy()] = np.nan
+    return ms
+
+
+def last_most_frequent(codes: np.ndarray, values: pd.Series, order_key: np.ndarray, n: int) -> np.ndarray:
+    """Per code, the most frequent value; ties go to the value with the largest order_key.
+    (JavaScript `keys.reduce((a, b) => counts[a] > counts[b] ? a : b)` keeps the later key on ties.)"""
+    result = np.full(n, None, dtype=object)
+    if len(codes) == 0:
+        return result
+    pairs = pd.DataFrame({'code': codes, 'value': values.to_numpy(), 'key': order_key})
+    counted = pairs.groupby(['code', 'value'], sort=False).agg(count=('key', 'size'), key=('key', 'min')).reset_index()
+    best = counted.sort_values(['code', 'count', 'key'], kind='stable').drop_duplicates('code', keep='last')
+    result[best['code'].to_numpy()] = best['value'].to_numpy()
+    return result
+
+
+def item_order_keys(items: pd.Series, positions: np.ndarray) -> np.ndarray:
+    """Iteration order of JavaScript object keys: integer-like keys ascending first, then first-seen order"""
+    index_like = items.str.fullmatch(JS_INDEX_KEY_PATTERN).to_numpy(dtype=bool, copy=True)
+    keys = positions.astype(float) + 2.0 ** 53  # every string key sorts after every index key
+    if index_like.any():
+        numbers = items[index_like].astype(float).to_numpy()
+        index_like[index_like] = numbers < 2 ** 32 - 1
+        keys[index_like] = numbers[numbers < 2 ** 32 - 1]
+    return keys
+
+
+def aggregate_order_data(orders: pd.DataFrame, now_ms: Optional[float] = None) -> pd.DataFrame:
+    """Group the cleaned order rows by customerid. One row per customer, in first-seen order, with
+    totalOrders, avgOrderValue, customerLifetimeMonths, favoriteItem, favoritePurchaseHour,
+    favoriteDayPart, recency, frequency and monetary (null where the JS version gives null)."""
+    if now_ms is None:
+        now_ms = time.time() * 1000
+    codes, customer_ids = pd.factorize(orders['customerid'], sort=False)
+    n = len(customer_ids)
+    vlog(f"Aggregating {len(orders)} orders for {n} customers")
+
+    total_orders = np.bincount(codes, minlength=n)
+    # bincount adds the weights in row order, the same running sum the JS loop builds
+    total_spend = np.bincount(codes, weights=js_parse_float(orders['total spend']), minlength=n) if n else np.zeros(0)
+
+    # Recency / lifetime from the first and last purchase date
+    recency = np.full(n, np.nan)
+    lifetime = np.zeros(n, dtype=np.int64)
+    if 'purchase date' in orders.columns and n:
+        ms = to_utc_ms(orders['purchase date'])
+        dated = ~np.isnan(ms)
+        by_customer = pd.Series(ms[dated]).groupby(codes[dated]).agg(['min', 'max'])
+        idx = by_customer.index.to_numpy()
+        first, last = by_customer['min'].to_numpy(), by_customer['max'].to_numpy()
+        recency[idx] = np.floor((now_ms - last) / MS_PER_DAY)
+        lifetime[idx] = np.maximum(1, np.floor((last - first) / (MS_PER_DAY * 30))).astype(np.int64)
+
+    favorite_item = np.full(n, None, dtype=object)
+    if 'purchase item' in orders.columns:
+        has_item = (orders['purchase item'] != '').to_numpy()
+        items = orders['purchase item'][has_item]
+        positions = np.flatnonzero(has_item)
+        favorite_item = last_most_frequent(codes[has_item], items, item_order_keys(items, positions), n)
+
+    favorite_hour = np.full(n, np.nan)
+    favorite_day_part = np.full(n, None, dtype=object)
+    if 'purchase time' in orders.columns:
+        times = orders['purchase time']
+        if pd.api.types.is_timedelta64_dtype(times):
+            # Typed Parquet column (time since midnight): whole hours directly, NaT = no time
+            has_time = times.notna().to_numpy()
+            hours = (times // pd.Timedelta(hours=1)).to_numpy(dtype=float, na_value=np.nan)
+        else:
+            times = times.astype(str)
+            has_time = (times != '').to_numpy()
+            hours = js_leading_number(times, PLAIN_HOUR_PATTERN, 2, JS_INT_PATTERN)
+        valid = has_time & (hours >= 0) & (hours <= 23)
+        valid_hours = hours[valid].astype(np.int64)
+        best_hour = last_most_frequent(codes[valid], pd.Series(valid_hours), valid_hours.astype(float), n)
+        known = best_hour != None  # noqa: E711 (elementwise over an object array)
+        favorite_hour[known] = best_hour[known].astype(float)
+        # Day part counts start at 0 for every part, so customers whose times never parse still get
+        # the last part (Evening), exactly like the JS reduce over {Night: 0, ..., Evening: 0}
+        part = np.digitize(valid_hours, [6, 12, 18])
+        part_counts = np.bincount(codes[valid] * 4 + part, minlength=n * 4).reshape(n, 4)
+        last_max = 3 - np.argmax(part_counts[:, ::-1], axis=1)
+        customers_with_times = np.zeros(n, dtype=bool)
+        customers_with_times[codes[has_time]] = True
+        favorite_day_part[customers_with_times] = np.array(DAY_PARTS, dtype=object)[last_max[customers_with_times]]
+
+    return pd.DataFrame({
+        'customerid': customer_ids,
+        'totalOrders': total_orders,
+        'avgOrderValue': js_round2(np.divide(total_spend, total_orders, out=np.zeros(n), where=total_orders > 0)),
+        'customerLifetimeMonths': lifetime,
+        'favoriteItem': favorite_item,
+        'favoritePurchaseHour': favorite_hour,
+        'favoriteDayPart': favorite_day_part,
+        'recency': recency,
+        'frequency': total_orders,
+        'monetary': js_round2(total_spend),
+    })
+
+
+def optional_text(values: pd.Series) -> pd.Series:
+    """Customer value, or null when it is empty or 'Unknown'"""
+    return values.where((values != '') & (values != 'Unknown'), None)
+
+
+def merge_customer_and_order_data(customers: pd.DataFrame, aggregated: pd.DataFrame) -> pd.DataFrame:
+    """One merged profile per customer row (customers without orders get zero / null behaviour columns).
+    AgeGroup / Gender are only added when the cleaned customer file has those columns."""
+    row = pd.Index(aggregated['customerid']).get_indexer(customers['customerid'])
+    found = row >= 0
+
+    def take(column, fill, zero_is_missing=True):
+        values = aggregated[column].to_numpy()[np.where(found, row, 0)] if len(aggregated) else np.full(len(row), fill)
+        values = np.where(found, values, fill)
+        if zero_is_missing:
+            # The JS merge reads these with `value || fallback`: 0 and NaN fall back as well
+            values = np.where(pd.isna(values) | (values == 0), fill, values)
+        return values
+
+    merged = pd.DataFrame({
+        'CustomerId': customers['customerid'].to_numpy(),
+        'City': customers['city'].where(customers['city'] != '', None).to_numpy(),
+        'State': customers['state'].where(customers['state'] != '', None).to_numpy(),
+        'TotalOrders': take('totalOrders', 0).astype(np.int64),
+        'AvgOrderValue': take('avgOrderValue', 0.0).astype(float),
+        'CustomerLifetimeMonths': take('customerLifetimeMonths', 0).astype(np.int64),
+        'FavoriteItem': take('favoriteItem', None, zero_is_missing=False),
+        'FavoritePurchaseHour': take('favoritePurchaseHour', np.nan, zero_is_missing=False).astype(float),
+        'FavoriteDayPart': take('favoriteDayPart', None, zero_is_missing=False),
+        'Recency': take('recency', np.nan).astype(float),
+        'Frequency': take('frequency', 0).astype(np.int64),
+        'Monetary': take('monetary', 0.0).astype(float),
+    })
+    if 'age group' in customers.columns:
+        merged['AgeGroup'] = optional_text(customers['age group']).to_numpy()
+    if 'gender' in customers.columns:
+        merged['Gender'] = optional_text(customers['gender']).to_numpy()
+    return merged
+
+
+def build_merged_table(customer_path: str, order_path: str, now_ms: Optional[float] = None):
+    """Read the cleaned customer and order files and build the merged profile table.
+    Returns (merged_df, summary) where summary carries the counts the /prepare route reports."""
+    orders = read_text_columns(order_path, ORDER_COLUMNS)
+    customers = read_text_columns(customer_path, CUSTOMER_COLUMNS)
+    vlog(f"Loaded {len(customers)} customers and {len(orders)} orders")
+    aggregated = aggregate_order_data(orders, now_ms=now_ms)
+    merged = merge_customer_and_order_data(customers, aggregated)
+    summary = {
+        'totalCustomers': int(len(merged)),
+        'totalOrders': int(len(orders)),
+        'customersWithOrders': int(len(aggregated)),
+        'customersWithoutOrders': int(len(merged) - len(aggregated)),
+        'hasAgeData': bool('AgeGroup' in merged.columns and merged['AgeGroup'].notna().any()),
+        'hasGenderData': bool('Gender' in merged.columns and merged['Gender'].notna().any()),
+        'columns': list(merged.columns),
+    }
+    vlog(f"Merged {len(merged)} customer profiles")
+    return merged, summary
+
+
+def js_number_text(values: pd.Series) -> pd.Series:
+    """Numbers as JavaScript String(n) writes them: 12 (not 12.0), 12.5; empty for null"""
+    numbers = values.astype(float)
+    text = numbers.astype(str)
+    integral = numbers.notna() & (numbers == np.floor(numbers)) & (numbers.abs() < 2 ** 53)
+    text[integral] = numbers[integral].astype(np.int64).astype(str)
+    return text.where(numbers.notna(), '')
+
+
+def write_merged_table(merged: pd.DataFrame, path: str):
+    """Parquet keeps the column types; CSV is written like the csv-stringify output of the Node merge"""
+    if is_parquet_path(path):
+        merged.to_parquet(path, index=False)
+        return
+    out = merged.copy()
+    for col in out.columns:
+        if pd.api.types.is_numeric_dtype(out[col]):
+            out[col] = js_number_text(out[col])
+        else:
+            out[col] = out[col].where(out[col].notna(), '')
+    out.to_csv(path, index=False, lineterminator='\n')
+
+
+def run_segmentation_from_datasets(customer_path: str, order_path: str, selected_features: List[str],
+                                   now_ms: Optional[float] = None, **options) -> Dict[str, Any]:
+    """Merge the cleaned datasets in memory and segment the result (no merged file round trip)."""
+    import segmentation
+    merged, _ = build_merged_table(customer_path, order_path, now_ms=now_ms)
+    df, existing = segmentation.prepare_segmentation_frame(merged, selected_features)
+    return segmentation.run_segmentation(df, existing, **options)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Build the merged customer profile (RFM) table from cleaned datasets.')
+    parser.add_argument('--customers', required=True, help='Cleaned customer CSV or Parquet file')
+    parser.add_argument('--orders', required=True, help='Cleaned order CSV or Parquet file')
+    parser.add_argument('--out', help='Write the merged table here (.csv, or .parquet/.pq)')
+    parser.add_argument('--summary-out', help='Write the summary JSON here instead of stdout')
+    parser.add_argument('--features', help='Comma-separated features: also run segmentation on the merged table')
+    parser.add_argument('--segment-out', help='Write the segmentation JSON here instead of stdout (with --features)')
+    parser.add_argument('--now', help='Reference time for recency (ISO date/time, UTC); defaults to the current time')
+    parser.add_argument('--verbose', action='store_true', help='Emit progress logs to stderr')
+    args = parser.parse_args()
+
+    if args.verbose:
+        VERBOSE = True
+    now_ms = pd.Timestamp(args.now).timestamp() * 1000 if args.now else None
+
+    try:
+        merged, summary = build_merged_table(args.customers, args.orders, now_ms=now_ms)
+        if args.out:
+            write_merged_table(merged, args.out)
+            vlog(f"Merged table written to {args.out}")
+        if args.summary_out:
+            with open(args.summary_out, 'w', encoding='utf-8') as f:
+                json.dump(summary, f)
+        elif not args.features:
+            print(json.dumps(summary))
+
+        if args.features:
+            import segmentation
+            segmentation.VERBOSE = VERBOSE
+            features = [x.strip() for x in args.features.split(',') if x.strip()]
+            df, existing = segmentation.prepare_segmentation_frame(merged, features)
+            payload = json.dumps(segmentation.run_segmentation(df, existing))
+            if args.segment_out:
+                with open(args.segment_out, 'w', encoding='utf-8') as f:
+                    f.write(payload)
+            else:
+                print(payload)
+    except Exception as e:
+        vlog(f"ERROR building merged table: {e}")
+        err_payload = json.dumps({'error': str(e)})
+        for out_path in (args.summary_out, args.segment_out):
+            if out_path:
+                try:
+                    with open(out_path, 'w', encoding='utf-8') as f:
+                        f.write(err_payload)
+                except OSError:
+                    pass
+        print(err_payload)
+        sys.exit(1)
@@ -1,12 +1,13 @@
 import json
 import warnings
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import sys
 
 import numpy as np
 import pandas as pd
+from joblib import Parallel, delayed
 from sklearn.compose import ColumnTransformer
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.metrics import silhouette_score, davies_bouldin_score
 from sklearn.preprocessing import StandardScaler, RobustScaler, OneHotEncoder, OrdinalEncoder, MinMaxScaler
 
@@ -24,50 +25,395 @@ def vlog(msg: str):
 # Numeric scaling strategy:
 #   RobustScaler: RFM
 
-def run_segmentation(df: pd.DataFrame, selected_features: List[str]) -> Dict[str, Any]:
-    """Run segmentation with fixed encoding/scaling rules.
-    Returns a JSON-friendly dict with best_k, evaluation metrics, assignments, and summary.
+# ====================================================
+#  SILHOUETTE SCORING (used in the K evaluation loop)
+# ====================================================
+# full       : sklearn silhouette_score on every row -> O(n^2) memory and time
+# sampled    : stratified sample (per cluster, proportional), exact silhouette on the sample
+# simplified : centroid-based simplified silhouette on every row -> O(n*k), no pairwise matrix
+# auto       : full while n <= sample size, sampled above it
+SILHOUETTE_METHODS = ['auto', 'full', 'sampled', 'simplified']
+DEFAULT_SILHOUETTE_SAMPLE_SIZE = 10000
+DEFAULT_SILHOUETTE_SEED = 42
+
+def stratified_sample_indices(labels: np.ndarray, sample_size: int, seed: int) -> np.ndarray:
+    """Pick about sample_size row indices, keeping each cluster's share of the data.
+    Every cluster keeps at least 2 members so its silhouette stays defined.
     """
+    n = len(labels)
+    if sample_size >= n:
+        return np.arange(n)
+    rng = np.random.default_rng(seed)
+    clusters, counts = np.unique(labels, return_counts=True)
+    alloc = np.minimum(counts, np.maximum(2, np.floor(counts * sample_size / n).astype(int)))
+    picked = [rng.choice(np.flatnonzero(labels == c), size=take, replace=False) for c, take in zip(clusters, alloc)]
+    return np.sort(np.concatenate(picked))
+
+
+def simplified_silhouette(X: np.ndarray, labels: np.ndarray, centers: np.ndarray) -> float:
+    """Simplified silhouette: a = distance to own centroid, b = distance to nearest other centroid."""
+    # One column per centroid keeps memory at n*k instead of n*k*features
+    dist = np.column_stack([np.sqrt(((X - c) ** 2).sum(axis=1)) for c in centers])
+    rows = np.arange(len(labels))
+    a = dist[rows, labels]
+    dist[rows, labels] = np.inf
+    b = dist.min(axis=1)
+    denom = np.maximum(a, b)
+    s = np.where(denom > 0, (b - a) / np.where(denom > 0, denom, 1.0), 0.0)
+    # Same convention as sklearn: members of singleton clusters score 0
+    sizes = np.bincount(labels, minlength=len(centers))
+    s[sizes[labels] <= 1] = 0.0
+    return float(s.mean())
+
+
+def compute_silhouette(X: np.ndarray, labels: np.ndarray, centers: np.ndarray,
+                       method: str = 'auto',
+                       sample_size: int = DEFAULT_SILHOUETTE_SAMPLE_SIZE,
+                       seed: int = DEFAULT_SILHOUETTE_SEED) -> Dict[str, Any]:
+    """Score one clustering with the requested silhouette method.
+    Returns {'score', 'method', 'rows_scored'} so the caller can report what was actually used.
+    """
+    if method not in SILHOUETTE_METHODS:
+        raise ValueError(f"Unknown silhouette method '{method}'. Expected one of {SILHOUETTE_METHODS}")
+    n = len(labels)
+    if method == 'auto':
+        method = 'full' if n <= sample_size else 'sampled'
 
-    vlog(f"===========================Start run_segmentation with features={selected_features}")
-    usable_df = df[selected_features].copy()
+    if method == 'simplified':
+        return {'score': simplified_silhouette(X, labels, centers), 'method': method, 'rows_scored': int(n)}
+    if method == 'sampled':
+        idx = stratified_sample_indices(labels, sample_size, seed)
+        return {'score': float(silhouette_score(X[idx], labels[idx])), 'method': method, 'rows_scored': int(len(idx))}
+    return {'score': float(silhouette_score(X, labels)), 'method': method, 'rows_scored': int(n)}
 
-    # RFM-only fast path: skip all categorical/frequency encoding; scale numerics only
-    vlog("Using RFM-only encoding path (RobustScaler on recency, frequency, monetary)")
-    #NEW========== Add on invert Recency and log-transform Frequency & Monetary
-    # Transform RFM
-    rfm_df = usable_df[selected_features].copy()
 
-    # Invert Recency
+# ====================================================
+#  CANDIDATE MODEL REGISTRY (results of the K sweep)
+# ====================================================
+class KCandidateRegistry:
+    """Keeps what the K sweep already fitted (labels, centers, inertia) keyed by k,
+    so the selected model and any other candidate can be reused without refitting.
+    """
+
+    def __init__(self):
+        self._models: Dict[int, Dict[str, Any]] = {}
+
+    def add(self, k: int, labels: np.ndarray, centers: np.ndarray, inertia: float):
+        self._models[int(k)] = {'labels': labels, 'centers': centers, 'inertia': float(inertia)}
+
+    def __contains__(self, k) -> bool:
+        return int(k) in self._models
+
+    def ks(self) -> List[int]:
+        return sorted(self._models)
+
+    def get(self, k: int) -> Dict[str, Any]:
+        if int(k) not in self._models:
+            raise KeyError(f"k={k} was not evaluated. Available: {self.ks()}")
+        return self._models[int(k)]
+
+    def labels(self, k: int) -> np.ndarray:
+        return self.get(k)['labels']
+
+    def centers(self, k: int) -> np.ndarray:
+        return self.get(k)['centers']
+
+    def inertia(self, k: int) -> float:
+        return self.get(k)['inertia']
+
+
+def build_candidate_result(df: pd.DataFrame, selected_features: List[str], registry: KCandidateRegistry, k: int) -> Dict[str, Any]:
+    """Assignments + summary for any evaluated k, straight from the registry (no refit)."""
+    df = df.copy()
+    df['Cluster'] = registry.labels(k)
+    return {
+        'k': int(k),
+        'inertia': registry.inertia(k),
+        'cluster_assignments': df[['CustomerId', 'Cluster']].to_dict(orient='records'),
+        'cluster_summary': generate_cluster_summary(df, selected_features),
+    }
+
+
+# ====================================================
+#  CLUSTERING ENGINE
+# ====================================================
+# kmeans    : full Lloyd KMeans, n_init=10 (original behaviour)
+# minibatch : MiniBatchKMeans, much cheaper per fit on large customer tables
+# auto      : kmeans below the row threshold, minibatch at or above it
+ENGINES = ['auto', 'kmeans', 'minibatch']
+DEFAULT_MINIBATCH_THRESHOLD = 100000
+DEFAULT_MINIBATCH_BATCH_SIZE = 4096
+DEFAULT_MINIBATCH_N_INIT = 3
+# Quality guard: MiniBatch vs full KMeans on a sample at the selected k
+GUARD_SAMPLE_SIZE = 20000
+GUARD_MAX_INERTIA_RATIO = 1.05
+GUARD_MAX_SILHOUETTE_DROP = 0.02
+
+def resolve_engine(engine: str, n_rows: int,
+                   minibatch_threshold: int = DEFAULT_MINIBATCH_THRESHOLD,
+                   batch_size: int = DEFAULT_MINIBATCH_BATCH_SIZE,
+                   minibatch_n_init: int = DEFAULT_MINIBATCH_N_INIT) -> Dict[str, Any]:
+    """Turn the requested engine into the concrete config used for every fit (reported in feature_info)."""
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown clustering engine '{engine}'. Expected one of {ENGINES}")
+    chosen = engine
+    if engine == 'auto':
+        chosen = 'minibatch' if n_rows >= minibatch_threshold else 'kmeans'
+    cfg = {'requested': engine, 'engine': chosen, 'minibatch_threshold': int(minibatch_threshold)}
+    if chosen == 'minibatch':
+        cfg.update({'algorithm': 'MiniBatchKMeans', 'batch_size': int(batch_size), 'n_init': int(minibatch_n_init)})
+    else:
+        cfg.update({'algorithm': 'KMeans', 'n_init': 10})
+    return cfg
+
+
+def make_clusterer(k: int, engine_cfg: Optional[Dict[str, Any]] = None):
+    if engine_cfg is not None and engine_cfg['engine'] == 'minibatch':
+        return MiniBatchKMeans(n_clusters=k, random_state=42, batch_size=engine_cfg['batch_size'], n_init=engine_cfg['n_init'])
+    return KMeans(n_clusters=k, random_state=42, n_init=10)
+
+
+def minibatch_quality_guard(X: np.ndarray, k: int, engine_cfg: Dict[str, Any],
+                            sample_size: int = GUARD_SAMPLE_SIZE, seed: int = DEFAULT_SILHOUETTE_SEED,
+                            silhouette_method: str = 'auto',
+                            silhouette_sample_size: int = DEFAULT_SILHOUETTE_SAMPLE_SIZE) -> Dict[str, Any]:
+    """Fit MiniBatchKMeans and full KMeans on the same sample and compare inertia and silhouette.
+    Passes when MiniBatch inertia is within GUARD_MAX_INERTIA_RATIO of KMeans and its silhouette
+    does not drop by more than GUARD_MAX_SILHOUETTE_DROP. Silhouette is scored the same way as the K sweep.
+    """
+    rng = np.random.default_rng(seed)
+    idx = np.sort(rng.choice(len(X), size=sample_size, replace=False)) if len(X) > sample_size else np.arange(len(X))
+    Xs = X[idx]
+    full = KMeans(n_clusters=k, random_state=42, n_init=10).fit(Xs)
+    mini = make_clusterer(k, engine_cfg).fit(Xs)
+    mini_labels = mini.predict(Xs)
+    # Inertia of the minibatch centers measured on the whole sample (its own inertia_ is per batch)
+    mini_inertia = float(((Xs - mini.cluster_centers_[mini_labels]) ** 2).sum())
+    full_sil = compute_silhouette(Xs, full.labels_, full.cluster_centers_, silhouette_method, silhouette_sample_size, seed)['score']
+    mini_sil = compute_silhouette(Xs, mini_labels, mini.cluster_centers_, silhouette_method, silhouette_sample_size, seed)['score']
+    inertia_ratio = mini_inertia / full.inertia_ if full.inertia_ > 0 else 1.0
+    passed = inertia_ratio <= GUARD_MAX_INERTIA_RATIO and (full_sil - mini_sil) <= GUARD_MAX_SILHOUETTE_DROP
+    return {
+        'k': int(k),
+        'sample_rows': int(len(idx)),
+        'kmeans_inertia': float(full.inertia_),
+        'minibatch_inertia': mini_inertia,
+        'inertia_ratio': float(inertia_ratio),
+        'kmeans_silhouette': float(full_sil),
+        'minibatch_silhouette': float(mini_sil),
+        'max_inertia_ratio': GUARD_MAX_INERTIA_RATIO,
+        'max_silhouette_drop': GUARD_MAX_SILHOUETTE_DROP,
+        'passed': bool(passed),
+    }
+
+
+K_RANGE = range(2, 7)
+
+
+# ====================================================
+#  RFM TRANSFORM / PERSISTED MODEL / ASSIGN MODE
+# ====================================================
+# The model is plain JSON: transform parameters (Recency inversion max, log1p columns), RobustScaler
+# center/scale, centroids, the selection decision and baseline statistics for drift checks.
+# assign_customers places new or updated customers with one nearest-centroid pass and reports
+# drift; the full K sweep is only needed once a drift threshold is exceeded.
+MODEL_VERSION = 1
+LOG_TRANSFORM_COLUMNS = ['Frequency', 'Monetary', 'Recency']
+# Drift limits: feature mean shift (in baseline standard deviations of the scaled feature),
+# population stability index of the cluster shares, and growth of the mean distance to the centroid
+DEFAULT_MAX_FEATURE_SHIFT = 0.5
+DEFAULT_MAX_SHARE_PSI = 0.2
+DEFAULT_MAX_DISTANCE_RATIO = 1.5
+
+
+def transform_rfm(df: pd.DataFrame, selected_features: List[str], recency_max: Optional[float] = None,
+                  log_columns: Optional[List[str]] = None):
+    """Invert Recency (against recency_max, the column max when fitting) and log1p Frequency / Monetary / Recency
+    (or the model's log_columns). Returns (transformed frame, transform params for the model)."""
+    rfm_df = df[selected_features].copy()
     if 'Recency' in rfm_df.columns:
-        rfm_df['Recency'] = rfm_df['Recency'].max() - rfm_df['Recency']
+        if recency_max is None:
+            recency_max = float(rfm_df['Recency'].max())
+            rfm_df['Recency'] = recency_max - rfm_df['Recency']
+        else:
+            # Customers older than anyone in the fitted data would invert below 0; pin them to the edge
+            rfm_df['Recency'] = (recency_max - rfm_df['Recency']).clip(lower=0)
+    if log_columns is None:
+        log_columns = [c for c in LOG_TRANSFORM_COLUMNS if c in rfm_df.columns]
+    for col in log_columns:
+        rfm_df[col] = np.log1p(rfm_df[col])
+    return rfm_df, {'recency_max': recency_max, 'log1p': log_columns}
+
+
+def nearest_centroid(X: np.ndarray, centers: np.ndarray):
+    """Label and distance of the closest centroid for every row (one vectorized pass)."""
+    dist = np.column_stack([np.sqrt(((X - c) ** 2).sum(axis=1)) for c in centers])
+    labels = dist.argmin(axis=1)
+    return labels, dist[np.arange(len(labels)), labels]
+
+
+def population_stability(expected: np.ndarray, actual: np.ndarray, eps: float = 1e-6) -> float:
+    expected = np.clip(np.asarray(expected, dtype=float), eps, None)
+    actual = np.clip(np.asarray(actual, dtype=float), eps, None)
+    return float(((actual - expected) * np.log(actual / expected)).sum())
+
+
+def build_segmentation_model(selected_features: List[str], transform: Dict[str, Any], scaler: RobustScaler,
+                             centers: np.ndarray, labels: np.ndarray, X: np.ndarray,
+                             decision: Dict[str, Any], engine_cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON-friendly model of a finished run: everything assign_customers needs, plus the drift baseline."""
+    _, distances = nearest_centroid(X, centers)
+    k = len(centers)
+    return {
+        'version': MODEL_VERSION,
+        'features': list(selected_features),
+        'transform': transform,
+        'scaler': {'type': 'RobustScaler', 'center': scaler.center_.tolist(), 'scale': scaler.scale_.tolist()},
+        'k': int(k),
+        'centroids': np.asarray(centers).tolist(),
+        'algorithm': engine_cfg.get('algorithm'),
+        'decision': decision,
+        'baseline': {
+            'rows': int(len(X)),
+            'feature_mean': X.mean(axis=0).tolist(),
+            'feature_std': X.std(axis=0).tolist(),
+            'cluster_share': (np.bincount(labels, minlength=k) / max(len(labels), 1)).tolist(),
+            'mean_distance': float(distances.mean()) if len(distances) else 0.0,
+        },
+    }
 
-    # Log-transform Frequency and Monetary
-    for col in ['Frequency', 'Monetary', 'Recency']:
-        if col in rfm_df.columns:
-            rfm_df[col] = np.log1p(rfm_df[col])
 
-    scaler = RobustScaler()
-    X = scaler.fit_transform(rfm_df[selected_features])
-    # Populate feature info for downstream payload
-    robust_present = list(selected_features)
-    vlog(f"Encoded matrix shape={X.shape}")
-    
-    # Evaluate K (2..10)
-    from collections import Counter
+def load_model(path: str) -> Dict[str, Any]:
+    with open(path, 'r', encoding='utf-8') as f:
+        model = json.load(f)
+    if model.get('version') != MODEL_VERSION:
+        raise ValueError(f"Unsupported segmentation model version {model.get('version')!r} (expected {MODEL_VERSION})")
+    return model
+
+
+def save_model(model: Dict[str, Any], path: str):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(model, f)
+
+
+def assign_customers(df: pd.DataFrame, model: Dict[str, Any],
+                     max_feature_shift: float = DEFAULT_MAX_FEATURE_SHIFT,
+                     max_share_psi: float = DEFAULT_MAX_SHARE_PSI,
+                     max_distance_ratio: float = DEFAULT_MAX_DISTANCE_RATIO) -> Dict[str, Any]:
+    """Place customers into the clusters of a persisted model (no refit) and measure drift against its baseline.
+    df is a segmentation frame (load_segmentation_frame / prepare_segmentation_frame) with the model's features."""
+    features = model['features']
+    missing = [c for c in features if c not in df.columns]
+    if missing:
+        raise ValueError(f"Input is missing model features {missing}")
+    if df.empty:
+        raise ValueError("No customers to assign after the order / NA filters")
+
+    recency_max = model['transform']['recency_max']
+    rfm_df, _ = transform_rfm(df, features, recency_max=recency_max, log_columns=model['transform']['log1p'])
+    out_of_range = int((df['Recency'] > recency_max).sum()) if 'Recency' in features else 0
+    X = (rfm_df[features].to_numpy(dtype=float) - np.asarray(model['scaler']['center'])) / np.asarray(model['scaler']['scale'])
+    centers = np.asarray(model['centroids'])
+    labels, distances = nearest_centroid(X, centers)
+    k = len(centers)
+
+    baseline = model['baseline']
+    base_mean = np.asarray(baseline['feature_mean'])
+    base_std = np.where(np.asarray(baseline['feature_std']) > 0, baseline['feature_std'], 1.0)
+    shifts = np.abs(X.mean(axis=0) - base_mean) / base_std
+    shares = np.bincount(labels, minlength=k) / len(labels)
+    psi = population_stability(baseline['cluster_share'], shares)
+    distance_ratio = float(distances.mean() / baseline['mean_distance']) if baseline['mean_distance'] > 0 else 1.0
+    exceeded = [f"feature_shift:{f}" for f, shift in zip(features, shifts) if shift > max_feature_shift]
+    if psi > max_share_psi:
+        exceeded.append('cluster_share_psi')
+    if distance_ratio > max_distance_ratio:
+        exceeded.append('mean_distance_ratio')
+    vlog(f"Assigned {len(labels)} customers to k={k}; drift exceeded={exceeded}")
+
+    df = df.copy()
+    df['Cluster'] = labels
+    return {
+        'mode': 'assign',
+        'k': int(k),
+        'cluster_assignments': df[['CustomerId', 'Cluster']].to_dict(orient='records'),
+        'cluster_summary': generate_cluster_summary(df, features),
+        'drift': {
+            'rows': int(len(labels)),
+            'out_of_range_rows': out_of_range,
+            'feature_shift': {f: float(v) for f, v in zip(features, shifts)},
+            'cluster_share': {'baseline': baseline['cluster_share'], 'current': shares.tolist(), 'psi': psi},
+            'mean_distance': {'baseline': baseline['mean_distance'], 'current': float(distances.mean()), 'ratio': distance_ratio},
+            'thresholds': {'max_feature_shift': max_feature_shift, 'max_share_psi': max_share_psi,
+                           'max_distance_ratio': max_distance_ratio},
+            'exceeded': exceeded,
+            'needs_refit': bool(exceeded),
+        },
+    }
+
+def evaluate_k(X: np.ndarray, k: int,
+               silhouette_method: str = 'auto',
+               silhouette_sample_size: int = DEFAULT_SILHOUETTE_SAMPLE_SIZE,
+               silhouette_seed: int = DEFAULT_SILHOUETTE_SEED,
+               engine_cfg: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Fit and score one candidate k. Self-contained (fixed seeds) so it can run in any worker process."""
+    km = make_clusterer(k, engine_cfg).fit(X)
+    # predict() so MiniBatch labels match its final centers (KMeans labels_ already do)
+    labels = km.labels_ if isinstance(km, KMeans) else km.predict(X)
+    inertia = km.inertia_ if isinstance(km, KMeans) else float(((X - km.cluster_centers_[labels]) ** 2).sum())
+    sil_info = compute_silhouette(X, labels, km.cluster_centers_, silhouette_method, silhouette_sample_size, silhouette_seed)
+    dbi = davies_bouldin_score(X, labels)
+    sizes = np.bincount(labels, minlength=k).tolist()
+    return {
+        'k': k,
+        'labels': labels,
+        'centers': km.cluster_centers_,
+        'inertia': float(inertia),
+        'silhouette': sil_info,
+        'dbi': float(dbi),
+        'sizes': sizes,
+    }
+
+
+def check_jobs(jobs: int) -> int:
+    """K sweep worker count: a positive number of processes, or -1 for all cores (joblib rejects 0)."""
+    if jobs == 0 or jobs < -1:
+        raise ValueError(f"jobs must be a positive number of worker processes or -1 for all cores, got {jobs}")
+    return jobs
+
+
+def sweep_k(X: np.ndarray, registry: KCandidateRegistry,
+            silhouette_method: str = 'auto',
+            silhouette_sample_size: int = DEFAULT_SILHOUETTE_SAMPLE_SIZE,
+            silhouette_seed: int = DEFAULT_SILHOUETTE_SEED,
+            engine_cfg: Optional[Dict[str, Any]] = None,
+            jobs: int = 1):
+    """Evaluate every k in K_RANGE and store the fits in the registry (replacing earlier fits of the same k).
+    Returns (k_results, sil_by_k).
+    """
     k_results = []
-    vlog("Begin K evaluation loop 2..6")
-    for k in range(2, 7):
-        km = KMeans(n_clusters=k, random_state=42, n_init=10)
-        labels = km.fit_predict(X)
-        sil = silhouette_score(X, labels)
-        dbi = davies_bouldin_score(X, labels)
-        counts = Counter(labels)
-        sizes = [counts[i] for i in range(k)]
+    sil_by_k = {}
+    if jobs == 1:
+        vlog(f"Begin K evaluation loop {K_RANGE.start}..{K_RANGE.stop - 1}")
+        evaluations = [evaluate_k(X, k, silhouette_method, silhouette_sample_size, silhouette_seed, engine_cfg) for k in K_RANGE]
+    else:
+        vlog(f"Begin parallel K evaluation {K_RANGE.start}..{K_RANGE.stop - 1} with jobs={jobs}")
+        # Parallel keeps the input order, so k_results are built in the same order as the serial loop
+        evaluations = Parallel(n_jobs=jobs, backend='loky')(
+            delayed(evaluate_k)(X, k, silhouette_method, silhouette_sample_size, silhouette_seed, engine_cfg) for k in K_RANGE
+        )
+    for ev in evaluations:
+        k, sil, dbi, sizes = ev['k'], ev['silhouette']['score'], ev['dbi'], ev['sizes']
+        sil_by_k[k] = ev['silhouette']
+        registry.add(k, ev['labels'], ev['centers'], ev['inertia'])
         k_results.append({'k': k, 'silhouette': float(sil), 'dbi': float(dbi), 'sizes': sizes})
         if VERBOSE:
-            print(f"[SEGMENT][K-EVAL] k={k} sil={sil:.4f} dbi={dbi:.4f} sizes={sizes}", file=sys.stderr)
+            print(f"[SEGMENT][K-EVAL] k={k} sil={sil:.4f} ({sil_by_k[k]['method']}, rows={sil_by_k[k]['rows_scored']}) dbi={dbi:.4f} sizes={sizes}", file=sys.stderr)
+    return k_results, sil_by_k
+
 
+def select_k(k_results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Pick best_k from the sweep metrics. Returns best_k plus the decision fields that explain it."""
     # Silhouette = higher better (Range: -1 to 1)
         # How well customers fit inside their own cluster
         # How far they are from other cluster
@@ -103,19 +449,8 @@ def run_segmentation(df: pd.DataFrame, selected_features: List[str]) -> Dict[str
 
     best_k = int(best_row['k'])
     vlog(f"Selected best_k={best_k} reason={reason}")
-
-    # Final model
-    final_km = KMeans(n_clusters=best_k, random_state=42, n_init=10)
-    final_labels = final_km.fit_predict(X)
-    df = df.copy()
-    # Use capitalized 'Cluster' column as requested
-    df['Cluster'] = final_labels
-    vlog("Final clustering complete; generating summary")
-
-    summary = generate_cluster_summary(df, selected_features)
-
-    decision = {
-        'selected_k': int(best_k),
+    return {
+        'best_k': best_k,
         'silhouette_max': float(sil_max),
         'plateau_threshold': float(plateau_cut),
         'row': {k: (float(v) if isinstance(v, (np.floating, float)) else v) for k, v in best_row.to_dict().items()},
@@ -126,6 +461,93 @@ def run_segmentation(df: pd.DataFrame, selected_features: List[str]) -> Dict[str
             'smallest_cluster_pct_min': smallest_pct_min,
             'target_k_range': [target_k_min, target_k_max],
             'reason': reason
+        },
+    }
+
+def run_segmentation(df: pd.DataFrame, selected_features: List[str],
+                     silhouette_method: str = 'auto',
+                     silhouette_sample_size: int = DEFAULT_SILHOUETTE_SAMPLE_SIZE,
+                     silhouette_seed: int = DEFAULT_SILHOUETTE_SEED,
+                     registry: Optional[KCandidateRegistry] = None,
+                     include_candidates: bool = False,
+                     jobs: int = 1,
+                     engine: str = 'auto',
+                     minibatch_threshold: int = DEFAULT_MINIBATCH_THRESHOLD,
+                     batch_size: int = DEFAULT_MINIBATCH_BATCH_SIZE,
+                     minibatch_n_init: int = DEFAULT_MINIBATCH_N_INIT,
+                     include_model: bool = False) -> Dict[str, Any]:
+    """Run segmentation with fixed encoding/scaling rules.
+    Returns a JSON-friendly dict with best_k, evaluation metrics, assignments, and summary.
+    silhouette_method / silhouette_sample_size / silhouette_seed control how the K loop scores
+    silhouette (see SILHOUETTE_METHODS); the choice is recorded in decision['silhouette'].
+    Pass a KCandidateRegistry to keep every fitted candidate after the call; include_candidates
+    adds per-k labels to the payload (same row order as cluster_assignments).
+    jobs > 1 (or -1 for all cores) spreads the candidate k values over worker processes;
+    every k uses the same fixed seeds, so the result is identical to the serial sweep.
+    engine picks KMeans or MiniBatchKMeans (see ENGINES); when MiniBatch is used, the selected k
+    is checked by minibatch_quality_guard and the whole sweep is redone with full KMeans if the guard fails.
+    include_model adds the persisted model (see build_segmentation_model) for later assign runs.
+    """
+    check_jobs(jobs)
+    if registry is None:
+        registry = KCandidateRegistry()
+
+    vlog(f"===========================Start run_segmentation with features={selected_features}")
+    usable_df = df[selected_features].copy()
+
+    # RFM-only fast path: skip all categorical/frequency encoding; scale numerics only
+    vlog("Using RFM-only encoding path (RobustScaler on recency, frequency, monetary)")
+    #NEW========== Add on invert Recency and log-transform Frequency & Monetary
+    rfm_df, transform = transform_rfm(usable_df, selected_features)
+
+    scaler = RobustScaler()
+    X = scaler.fit_transform(rfm_df[selected_features])
+    # Populate feature info for downstream payload
+    robust_present = list(selected_features)
+    vlog(f"Encoded matrix shape={X.shape}")
+    engine_cfg = resolve_engine(engine, X.shape[0], minibatch_threshold, batch_size, minibatch_n_init)
+    vlog(f"Clustering engine={engine_cfg['algorithm']} (requested={engine})")
+    
+    # Evaluate K (2..6) and pick best_k
+    k_results, sil_by_k = sweep_k(X, registry, silhouette_method, silhouette_sample_size, silhouette_seed, engine_cfg, jobs)
+    selection = select_k(k_results)
+    best_k = selection['best_k']
+
+    engine_cfg['quality_guard'] = None
+    if engine_cfg['engine'] == 'minibatch':
+        guard = minibatch_quality_guard(X, best_k, engine_cfg, seed=silhouette_seed, silhouette_method=silhouette_method,
+                                        silhouette_sample_size=silhouette_sample_size)
+        engine_cfg['quality_guard'] = guard
+        vlog(f"MiniBatch quality guard k={best_k}: inertia_ratio={guard['inertia_ratio']:.4f} passed={guard['passed']}")
+        if not guard['passed']:
+            # Labels, metrics and the chosen k must all come from an algorithm we trust: redo the sweep with full KMeans
+            engine_cfg.pop('batch_size', None)
+            engine_cfg.update({'engine': 'kmeans', 'algorithm': 'KMeans', 'n_init': 10, 'fallback_reason': 'minibatch_quality_guard_failed'})
+            k_results, sil_by_k = sweep_k(X, registry, silhouette_method, silhouette_sample_size, silhouette_seed, engine_cfg, jobs)
+            selection = select_k(k_results)
+            best_k = selection['best_k']
+
+    # Final model: same fit (engine, k, random_state=42) as the sweep, so reuse it
+    final_labels = registry.labels(best_k)
+    df = df.copy()
+    # Use capitalized 'Cluster' column as requested
+    df['Cluster'] = final_labels
+    vlog("Final clustering complete; generating summary")
+
+    summary = generate_cluster_summary(df, selected_features)
+
+    decision = {
+        'selected_k': int(best_k),
+        'silhouette_max': selection['silhouette_max'],
+        'plateau_threshold': selection['plateau_threshold'],
+        'row': selection['row'],
+        'criteria': selection['criteria'],
+        'silhouette': {
+            'requested_method': silhouette_method,
+            'method': sil_by_k[best_k]['method'],
+            'sample_size': int(silhouette_sample_size),
+            'rows_scored': sil_by_k[best_k]['rows_scored'],
+            'seed': int(silhouette_seed),
         }
     }
 
@@ -139,10 +561,19 @@ def run_segmentation(df: pd.DataFrame, selected_features: List[str]) -> Dict[str
         'feature_info': {
             'selected_features': selected_features,
             'robust_scaled': robust_present,
-            'transformed_shape': list(X.shape)
+            'transformed_shape': list(X.shape),
+            'clustering_engine': engine_cfg
         },
         'decision': decision
     }
+    if include_model:
+        response['model'] = build_segmentation_model(selected_features, transform, scaler, registry.centers(best_k),
+                                                     final_labels, X, decision, engine_cfg)
+    if include_candidates:
+        response['candidates'] = {
+            str(k): {'inertia': registry.inertia(k), 'labels': registry.labels(k).tolist()}
+            for k in registry.ks()
+        }
     return response
 
 
@@ -193,43 +624,139 @@ def generate_cluster_summary(df: pd.DataFrame, selected_features: List[str]) ->
 
     return out
 
-def run_segmentation_from_csv(csv_path: str, selected_features: List[str]) -> Dict[str, Any]:
-    df = pd.read_csv(csv_path)
+def is_parquet_path(path: str) -> bool:
+    return path.lower().endswith(('.parquet', '.pq'))
 
-    if 'CustomerId' not in df.columns:
-        raise ValueError(f"'customerid' column not found. Available columns: {list(df.columns)}")
+def read_columns(path: str) -> List[str]:
+    """Column names of a merged CSV / Parquet file without loading the rows."""
+    if is_parquet_path(path):
+        import pyarrow.parquet as pq  # only needed for Parquet input
+        return list(pq.read_schema(path).names)
+    return list(pd.read_csv(path, nrows=0).columns)
 
-    # keep customers with at least one order
-    if 'TotalOrders' in df.columns:
-        df = df[df['TotalOrders'] > 0].copy()
-    vlog(f"Loaded CSV rows={len(df)} after order filter")
+def load_segmentation_frame(csv_path: str, selected_features: List[str]):
+    """Read the merged CSV or Parquet file and keep usable rows. Returns (df, existing_features).
+    Only CustomerId, TotalOrders and the selected features are loaded (column pruning)."""
+    available = read_columns(csv_path)
+
+    if 'CustomerId' not in available:
+        raise ValueError(f"'customerid' column not found. Available columns: {available}")
 
     # Keep only selected features that exist (use exact names provided by caller)
-    existing = [c for c in selected_features if c in df.columns]
+    existing = [c for c in selected_features if c in available]
     if len(existing) == 0:
-        raise ValueError(f"None of the selected features are present in CSV. selected={selected_features}, columns={list(df.columns)}")
+        raise ValueError(f"None of the selected features are present in CSV. selected={selected_features}, columns={available}")
+
+    wanted = ['CustomerId'] + (['TotalOrders'] if 'TotalOrders' in available else []) + existing
+    wanted = list(dict.fromkeys(wanted))
+    if is_parquet_path(csv_path):
+        df = pd.read_parquet(csv_path, columns=wanted)
+    else:
+        df = pd.read_csv(csv_path, usecols=wanted)
+    vlog(f"Loaded columns={wanted} of {len(available)}")
+    return filter_segmentation_rows(df, existing)
+
+
+def prepare_segmentation_frame(merged: pd.DataFrame, selected_features: List[str]):
+    """Same as load_segmentation_frame for a merged table already in memory (customer_profiles.build_merged_table)."""
+    if 'CustomerId' not in merged.columns:
+        raise ValueError(f"'customerid' column not found. Available columns: {list(merged.columns)}")
+    existing = [c for c in selected_features if c in merged.columns]
+    if len(existing) == 0:
+        raise ValueError(f"None of the selected features are present in CSV. selected={selected_features}, columns={list(merged.columns)}")
+    wanted = list(dict.fromkeys(['CustomerId'] + (['TotalOrders'] if 'TotalOrders' in merged.columns else []) + existing))
+    return filter_segmentation_rows(merged[wanted], existing)
+
+
+def filter_segmentation_rows(df: pd.DataFrame, existing: List[str]):
+    """Keep customers with orders and complete selected features. Returns (df, existing)."""
+    # keep customers with at least one order
+    if 'TotalOrders' in df.columns:
+        df = df[df['TotalOrders'] > 0].copy()
+    vlog(f"Loaded rows={len(df)} after order filter")
 
     df = df.dropna(subset=existing)
     vlog(f"Rows after NA drop for existing features={len(df)}")
-    return run_segmentation(df, existing)
+    return df, existing
+
+
+def run_segmentation_from_csv(csv_path: str, selected_features: List[str], **options) -> Dict[str, Any]:
+    """csv_path may also be a Parquet file (.parquet / .pq)."""
+    df, existing = load_segmentation_frame(csv_path, selected_features)
+    return run_segmentation(df, existing, **options)
 
 
 if __name__ == '__main__':
     import argparse
+
+    def jobs_arg(value: str) -> int:
+        """--jobs type: a bad worker count is a usage error, not a segmentation error payload."""
+        try:
+            return check_jobs(int(value))
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+
     parser = argparse.ArgumentParser(description='Run customer segmentation.')
-    parser.add_argument('--csv', required=True, help='Path to merged CSV file')
-    parser.add_argument('--features', required=True, help='Comma-separated list of selected features')
+    parser.add_argument('--input', '--csv', dest='input', required=True, help='Path to merged CSV or Parquet (.parquet/.pq) file')
+    parser.add_argument('--features', required=False, help='Comma-separated list of selected features (required unless --assign)')
     parser.add_argument('--out', required=False, help='Optional path to write JSON result instead of stdout')
     parser.add_argument('--verbose', action='store_true', help='Emit progress logs to stderr')
+    parser.add_argument('--silhouette', choices=SILHOUETTE_METHODS, default='auto',
+                        help='Silhouette scoring in the K loop: full, sampled (stratified), simplified (centroid) or auto')
+    parser.add_argument('--silhouette-sample-size', type=int, default=DEFAULT_SILHOUETTE_SAMPLE_SIZE,
+                        help='Rows scored by the sampled silhouette (auto switches to sampled above this)')
+    parser.add_argument('--silhouette-seed', type=int, default=DEFAULT_SILHOUETTE_SEED,
+                        help='Seed for the silhouette sample so K selection is reproducible')
+    parser.add_argument('--include-candidates', action='store_true',
+                        help='Add labels for every evaluated k to the payload (instant "try another k")')
+    parser.add_argument('--jobs', type=jobs_arg, default=1,
+                        help='Worker processes for the K sweep (-1 = all cores). Results match the serial sweep')
+    parser.add_argument('--engine', choices=ENGINES, default='auto',
+                        help='Clustering engine: kmeans, minibatch, or auto (minibatch at/above --minibatch-threshold rows)')
+    parser.add_argument('--minibatch-threshold', type=int, default=DEFAULT_MINIBATCH_THRESHOLD,
+                        help='Row count at which --engine auto switches to MiniBatchKMeans')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_MINIBATCH_BATCH_SIZE, help='MiniBatchKMeans batch size')
+    parser.add_argument('--minibatch-n-init', type=int, default=DEFAULT_MINIBATCH_N_INIT, help='MiniBatchKMeans n_init')
+    parser.add_argument('--model-out', help='Save the fitted model (scaler, transform, centroids, decision, drift baseline) as JSON')
+    parser.add_argument('--assign', metavar='MODEL', help='Assign the input customers to the clusters of this saved model (no K sweep)')
+    parser.add_argument('--max-feature-shift', type=float, default=DEFAULT_MAX_FEATURE_SHIFT,
+                        help='--assign: feature mean shift (baseline std devs) that flags drift')
+    parser.add_argument('--max-share-psi', type=float, default=DEFAULT_MAX_SHARE_PSI,
+                        help='--assign: population stability index of cluster shares that flags drift')
+    parser.add_argument('--max-distance-ratio', type=float, default=DEFAULT_MAX_DISTANCE_RATIO,
+                        help='--assign: growth of the mean distance to the assigned centroid that flags drift')
     args = parser.parse_args()
+    if not args.features and not args.assign:
+        parser.error('--features is required unless --assign is given')
 
     if args.verbose:
         VERBOSE = True
         vlog('Verbose logging enabled')
 
-    features = [x.strip() for x in args.features.split(',') if x.strip()]
     try:
-        result = run_segmentation_from_csv(args.csv, features)
+        if args.assign:
+            model = load_model(args.assign)
+            df, _ = load_segmentation_frame(args.input, model['features'])
+            result = assign_customers(df, model, max_feature_shift=args.max_feature_shift,
+                                      max_share_psi=args.max_share_psi, max_distance_ratio=args.max_distance_ratio)
+        else:
+            features = [x.strip() for x in args.features.split(',') if x.strip()]
+            result = run_segmentation_from_csv(
+                args.input, features,
+                silhouette_method=args.silhouette,
+                silhouette_sample_size=args.silhouette_sample_size,
+                silhouette_seed=args.silhouette_seed,
+                include_candidates=args.include_candidates,
+                jobs=args.jobs,
+                engine=args.engine,
+                minibatch_threshold=args.minibatch_threshold,
+                batch_size=args.batch_size,
+                minibatch_n_init=args.minibatch_n_init,
+                include_model=bool(args.model_out),
+            )
+            if args.model_out:
+                save_model(result.pop('model'), args.model_out)
+                vlog(f"Model saved to {args.model_out}")
     except Exception as e:
         vlog(f"ERROR during segmentation: {e}")
         err_payload = json.dumps({'error': str(e)})
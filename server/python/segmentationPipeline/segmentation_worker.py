@@ -0,0 +1,161 @@
+"""Long-lived segmentation worker.
+
+Imports pandas / numpy / sklearn once and then serves jobs over stdin/stdout, one JSON object
+per line, so the Node side can keep a warm pool instead of spawning segmentation.py per run.
+
+Requests (stdin):
+    {"id": "job-1", "cmd": "segment", "input": "/path/merged.csv", "features": ["Recency", ...],
+     "options": {"engine": "auto", "jobs": 4, ...}, "verbose": false}
+    {"id": "job-2", "cmd": "candidate", "job": "job-1", "k": 4}   # another k from a finished job, no refit
+    {"id": "job-4", "cmd": "segment", "customers": "/path/customers_cleaned.csv", "orders": "/path/orders_cleaned.csv",
+     "features": [...]}                                           # merge in memory (customer_profiles.py), no merged file
+    {"id": "job-5", "cmd": "segment", "input": "...", "features": [...], "model_out": "/path/model.json"}
+    {"id": "job-6", "cmd": "assign", "input": "/path/new_customers.csv", "model_path": "/path/model.json",
+     "options": {"max_share_psi": 0.2}}                           # nearest-centroid assignment + drift, no K sweep
+    {"id": "job-3", "cmd": "ping"}
+    {"cmd": "shutdown"}
+
+Responses (stdout), one line per request:
+    {"id": "job-1", "ok": true, "result": {...same payload as run_segmentation_from_csv...}}
+    {"id": "job-1", "ok": false, "error": "..."}
+
+A {"event": "ready"} line is written once the imports are done. Logs go to stderr only.
+"""
+import json
+import os
+import sys
+from collections import OrderedDict
+
+import customer_profiles
+import segmentation
+
+# Options a job may pass through to run_segmentation
+ALLOWED_OPTIONS = {
+    'silhouette_method', 'silhouette_sample_size', 'silhouette_seed', 'include_candidates',
+    'jobs', 'engine', 'minibatch_threshold', 'batch_size', 'minibatch_n_init', 'include_model',
+}
+# Options an assign job may pass through to assign_customers
+ASSIGN_OPTIONS = {'max_feature_shift', 'max_share_psi', 'max_distance_ratio'}
+# Finished jobs kept in memory for "candidate" requests (df + fitted K sweep)
+DEFAULT_KEEP_JOBS = 4
+
+
+def log(msg: str):
+    print(f"[SEGMENT][WORKER] {msg}", file=sys.stderr, flush=True)
+
+
+class SegmentationWorker:
+    def __init__(self, keep_jobs: int = DEFAULT_KEEP_JOBS):
+        self.keep_jobs = keep_jobs
+        self.finished = OrderedDict()  # job id -> (df, features, registry)
+
+    def _remember(self, job_id, df, features, registry):
+        if self.keep_jobs <= 0 or job_id is None:
+            return
+        self.finished[job_id] = (df, features, registry)
+        self.finished.move_to_end(job_id)
+        while len(self.finished) > self.keep_jobs:
+            self.finished.popitem(last=False)
+
+    @staticmethod
+    def _options(job: dict, allowed: set) -> dict:
+        options = job.get('options') or {}
+        unknown = set(options) - allowed
+        if unknown:
+            raise ValueError(f"Unknown options: {sorted(unknown)}")
+        return options
+
+    @staticmethod
+    def _load_frame(job: dict, features: list):
+        """Segmentation frame from a merged file ('input' / 'csv') or straight from the cleaned datasets"""
+        path = job.get('input') or job.get('csv')
+        if job.get('customers') and job.get('orders'):
+            merged, _ = customer_profiles.build_merged_table(job['customers'], job['orders'])
+            return segmentation.prepare_segmentation_frame(merged, features)
+        if not path:
+            raise ValueError("'input' (or 'csv', or 'customers' + 'orders') is required")
+        return segmentation.load_segmentation_frame(path, features)
+
+    def segment(self, job: dict) -> dict:
+        features = job.get('features')
+        if isinstance(features, str):
+            features = [x.strip() for x in features.split(',') if x.strip()]
+        if not features:
+            raise ValueError("'features' is required")
+        options = self._options(job, ALLOWED_OPTIONS)
+
+        segmentation.VERBOSE = customer_profiles.VERBOSE = bool(job.get('verbose'))
+        df, existing = self._load_frame(job, features)
+        registry = segmentation.KCandidateRegistry()
+        if job.get('model_out'):
+            options = {**options, 'include_model': True}
+        result = segmentation.run_segmentation(df, existing, registry=registry, **options)
+        if job.get('model_out'):
+            segmentation.save_model(result.pop('model'), job['model_out'])
+        self._remember(job.get('id'), df, existing, registry)
+        return result
+
+    def assign(self, job: dict) -> dict:
+        model = job.get('model') or (segmentation.load_model(job['model_path']) if job.get('model_path') else None)
+        if model is None:
+            raise ValueError("'model' or 'model_path' is required")
+        options = self._options(job, ASSIGN_OPTIONS)
+        segmentation.VERBOSE = customer_profiles.VERBOSE = bool(job.get('verbose'))
+        df, _ = self._load_frame(job, model['features'])
+        return segmentation.assign_customers(df, model, **options)
+
+    def candidate(self, job: dict) -> dict:
+        source = job.get('job')
+        if source not in self.finished:
+            raise ValueError(f"Job '{source}' is not held by this worker (kept: {list(self.finished)})")
+        df, features, registry = self.finished[source]
+        return segmentation.build_candidate_result(df, features, registry, int(job['k']))
+
+    def handle(self, job: dict) -> dict:
+        cmd = job.get('cmd', 'segment')
+        if cmd == 'segment':
+            return self.segment(job)
+        if cmd == 'candidate':
+            return self.candidate(job)
+        if cmd == 'assign':
+            return self.assign(job)
+        if cmd == 'ping':
+            return {'pid': os.getpid()}
+        raise ValueError(f"Unknown cmd '{cmd}'")
+
+
+def serve(stdin=sys.stdin, stdout=sys.stdout, keep_jobs: int = DEFAULT_KEEP_JOBS):
+    worker = SegmentationWorker(keep_jobs)
+    # Anything a job prints must not corrupt the protocol stream
+    sys.stdout = sys.stderr
+
+    def reply(payload: dict):
+        stdout.write(json.dumps(payload) + '\n')
+        stdout.flush()
+
+    reply({'event': 'ready', 'pid': os.getpid()})
+    for line in stdin:
+        line = line.strip()
+        if not line:
+            continue
+        job_id = None
+        try:
+            job = json.loads(line)
+            job_id = job.get('id')
+            if job.get('cmd') == 'shutdown':
+                reply({'id': job_id, 'ok': True, 'result': 'shutdown'})
+                break
+            result = worker.handle(job)
+            reply({'id': job_id, 'ok': True, 'result': result})
+        except Exception as e:
+            log(f"job {job_id} failed: {e}")
+            reply({'id': job_id, 'ok': False, 'error': str(e)})
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Persistent segmentation worker (JSON lines over stdin/stdout).')
+    parser.add_argument('--keep-jobs', type=int, default=DEFAULT_KEEP_JOBS,
+                        help='Finished jobs kept in memory for "candidate" requests')
+    args = parser.parse_args()
+    serve(keep_jobs=args.keep_jobs)